@@ -2,19 +2,33 @@ from flask import Flask, render_template
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from config import config
 from flask_login import LoginManager
 from flask_pagedown import PageDown
+from .fragments import FragmentCache
+from .page_cache import PageCache
+from .last_seen import LastSeenTracker
+from .user_cache import UserCache
+from .render_pool import RenderPool
+from .rendering import render_cache
+from .email import MailQueue
+from .database import DatabaseTuning, RoutingSQLAlchemy
 
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 pagedown = PageDown()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+last_seen_tracker = LastSeenTracker()
+user_cache = UserCache()
+render_pool = RenderPool()
+mail_queue = MailQueue()
+database_tuning = DatabaseTuning()
 
 
 def create_app(config_name):
@@ -22,6 +36,10 @@ def create_app(config_name):
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
 
+    if app.config["FLASKY_PROXY_FIX"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        proxies = app.config["FLASKY_PROXY_FIX"]
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
     if app.config["SSL_REDIRECT"]:
         from flask_sslify import SSLify
         sslify = SSLify(app)
@@ -29,8 +47,16 @@ def create_app(config_name):
     mail.init_app(app)
     moment.init_app(app)
     db.init_app(app)
+    database_tuning.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    last_seen_tracker.init_app(app)
+    user_cache.init_app(app)
+    render_pool.init_app(app)
+    render_cache.init_app(app)
+    mail_queue.init_app(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -2,7 +2,8 @@ from flask import Blueprint
 
 api = Blueprint("api", __name__)
 
-from . import authentication, comments, decorators, errors, posts, users
+# throttling 须在 authentication 之前导入，限流先于认证执行
+from . import throttling, authentication, comments, decorators, errors, posts, search, users
 
 @api.route("/")
 def index():
@@ -1,12 +1,62 @@
+import hashlib
+import hmac
 from flask_httpauth import HTTPBasicAuth
 from ..models import User
-from flask import g, jsonify
+from flask import g, jsonify, current_app
 from .errors import unauthorized, forbidden
 from . import api
+from .. import db, user_cache
+from ..cache import create_cache
+from ..metrics import metrics
 
 auth = HTTPBasicAuth()
 
 
+@api.record_once
+def init_credential_cache(state):
+    """
+    验证通过的 邮箱+密码 短时间内再次使用时不必重新计算密码散列
+    """
+    state.app.extensions["api_credentials"] = create_cache(state.app.config["FLASKY_API_CREDENTIAL_CACHE"],
+                                                           max_entries=state.app.config["FLASKY_API_CREDENTIAL_CACHE_SIZE"])
+
+
+def credential_key(email, password):
+    """
+    缓存中只保存以 SECRET_KEY 为密钥的 HMAC，不保存明文密码
+    """
+    message = "{}\0{}".format(email, password).encode("utf-8")
+    return "credential:" + hmac.new(current_app.config["SECRET_KEY"].encode("utf-8"), message,
+                                    hashlib.sha256).hexdigest()
+
+
+def verify_credentials(email, password):
+    """
+    :param email:
+    :param password:
+    :return User: 邮箱或密码错误时为 None
+    """
+    cache = current_app.extensions["api_credentials"]
+    key = credential_key(email, password)
+    cached = cache.get(key)
+    if cached is not None:
+        user_id, password_hash = cached
+        user = user_cache.get_user(user_id)
+        # 修改邮箱或密码后缓存的结果不再有效
+        if user is not None and user.email == email and user.password_hash == password_hash:
+            metrics.incr("credential_cache.hit")
+            return user
+    metrics.incr("credential_cache.miss")
+    user = User.query.filter_by(email=email).first()
+    if user is None or not user.verify_password(password):
+        return None
+    # 认证在视图之前执行，会话中只有可能重新计算的密码散列
+    db.session.commit()
+    user_cache.store(user)
+    cache.set(key, (user.id, user.password_hash), timeout=current_app.config["FLASKY_API_CREDENTIAL_CACHE_TIMEOUT"])
+    return user
+
+
 @auth.verify_password
 def verify_password(email_or_token, password):
     if email_or_token == "":
@@ -15,12 +65,9 @@ def verify_password(email_or_token, password):
         g.current_user = User.verify_auth_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
-    user = User.query.filter_by(email=email_or_token).first()
-    if not user:
-        return False
-    g.current_user = user
+    g.current_user = verify_credentials(email_or_token, password)
     g.token_used = False
-    return user.verify_password(password)
+    return g.current_user is not None
 
 
 @api.before_request
@@ -41,7 +88,3 @@ def get_token():
         return unauthorized("Invalids Credentials")
     return jsonify({"token": g.current_user.generate_auth_token(expiration=3600),
                     "expiration": 3600})
-
-
-
-
@@ -0,0 +1,45 @@
+"""
+    批量读取：?ids=1,2,3 用一条 IN 查询取出多行，按请求中的顺序返回，
+    不存在的 id 在 missing 中列出
+"""
+from flask import request, current_app, jsonify
+from ..exceptions import ValidationError
+from ..feeds import load_by_ids
+from .conditional import etag_for, conditional
+
+
+def parse_ids():
+    """
+    解析请求参数 ids，去掉重复的 id 并保持顺序；先按原始个数检查上限，过长的列表不必逐个解析
+    :return list:
+    """
+    parts = [part.strip() for part in request.args.get("ids", "").split(",")]
+    parts = [part for part in parts if part]
+    if not parts:
+        raise ValidationError("ids is empty")
+    max_ids = current_app.config["FLASKY_API_BATCH_MAX_IDS"]
+    if len(parts) > max_ids:
+        raise ValidationError("at most {} ids per request".format(max_ids))
+    ids = []
+    for part in parts:
+        try:
+            ids.append(int(part))
+        except ValueError:
+            raise ValidationError("invalid id: {}".format(part))
+    return list(dict.fromkeys(ids))
+
+
+def batch_response(query, key, etag_parts):
+    """
+    :param query: 加载对象用的查询，可带有 joinedload 等选项
+    :param key: 响应中列表的键名，如 "posts"
+    :param etag_parts: 对象 -> 能确定其内容的值，如 (id, version)
+    :return Response:
+    """
+    ids = parse_ids()
+    objects = load_by_ids(query, ids)
+    found = [objects[id] for id in ids if id in objects]
+    missing = [id for id in ids if id not in objects]
+    etag = etag_for("batch", key, [etag_parts(obj) for obj in found], missing)
+    return conditional(etag, lambda: jsonify({key: [obj.to_json() for obj in found],
+                                              "missing": missing}))
@@ -0,0 +1,47 @@
+"""
+    批量写入：请求体为 JSON 数组，逐条校验后在一个事务里插入，
+    响应中按请求顺序返回每一条的结果或错误
+"""
+from flask import request, current_app, jsonify
+from ..exceptions import ValidationError
+
+
+def validate_items(validate):
+    """
+    :param validate: 单条 JSON -> 校验后的值，校验失败时抛出 ValidationError
+    :return (values, errors): 通过校验的值；与请求等长的错误信息列表，通过的位置为 None
+    """
+    items = request.json
+    if not isinstance(items, list):
+        raise ValidationError("expected a JSON array")
+    max_items = current_app.config["FLASKY_API_BULK_MAX_ITEMS"]
+    if len(items) > max_items:
+        raise ValidationError("at most {} items per request".format(max_items))
+    values = []
+    errors = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("item is not an object")
+            values.append(validate(item))
+            errors.append(None)
+        except ValidationError as e:
+            errors.append(e.args[0])
+    return values, errors
+
+
+def bulk_response(errors, urls):
+    """
+    :param errors: validate_items 返回的错误信息列表
+    :param urls: 成功创建的各条资源的地址，顺序与通过校验的条目一致
+    :return Response:
+    """
+    urls = iter(urls)
+    results = []
+    for error in errors:
+        if error is None:
+            results.append({"status": 201, "url": next(urls)})
+        else:
+            results.append({"status": 400, "error": "bad request", "message": error})
+    created = sum(1 for error in errors if error is None)
+    return jsonify({"results": results, "created": created, "failed": len(errors) - created})
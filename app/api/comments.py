@@ -2,17 +2,78 @@ from app import db
 from app.api.decorators import permission_required
 from . import api
 from ..models import Comment, Post, Permission
-from flask import jsonify, request, g
+from flask import jsonify, request, g, current_app, url_for
+from ..feeds import load_by_ids
+from ..pagination import KeysetPagination
+from .conditional import etag_for, conditional, row_versions, page_response
+from .streaming import wants_ndjson, ndjson_response
+from .batch import batch_response
+from .bulk import validate_items, bulk_response
+from ..exceptions import ValidationError
 
 
 @api.route("/comments/")
 def get_comments():
     """
-    返回所有评论
+    返回所有评论，按游标分页；format=ndjson 时按 id 顺序流式返回全部，
+    带有 ids 参数时批量返回指定的评论
     :return:
     """
-    comments = Comment.query.all()
-    return jsonify({"comments": [comment.to_json() for comment in comments]})
+    if "ids" in request.args:
+        return batch_response(Comment.query, "comments", lambda comment: (comment.id, comment.version))
+    if wants_ndjson():
+        return ndjson_response(Comment.query.order_by(Comment.id))
+    pagination = KeysetPagination(row_versions(Comment.query, Comment), current_app.config["FLASK_COMMENTS_PER_PAGE"],
+                                  cursor=request.args.get("cursor"), columns=(Comment.timestamp, Comment.id))
+    return page_response(pagination, Comment, "comments", "api.get_comments")
+
+
+def comments_response(name, versions):
+    """
+    ETag 由评论的 id 和版本号算出，未命中时才加载评论并序列化
+    :param name: 区分不同列表的名称
+    :param versions: (id, version) 列表
+    :return Response:
+    """
+    def build_response():
+        comments = load_by_ids(Comment.query, [c.id for c in versions])
+        return jsonify({"comments": [comments[c.id].to_json() for c in versions if c.id in comments]})
+    return conditional(etag_for(name, versions), build_response)
+
+
+def post_id_from_json(json_comment):
+    post_id = json_comment.get("post_id")
+    if not isinstance(post_id, int) or isinstance(post_id, bool):
+        raise ValidationError("comment does not have post_id")
+    return post_id
+
+
+@api.route("/comments/bulk", methods=["POST"])
+@permission_required(Permission.COMMENT)
+def new_comments_bulk():
+    """
+    批量创建评论，请求体为带有 post_id 的评论 JSON 数组，通过校验的在同一个事务中插入
+    :return:
+    """
+    items, errors = validate_items(lambda item: (post_id_from_json(item), Comment.body_from_json(item)))
+    # 用一条 IN 查询确认评论的文章都存在
+    post_ids = set(post_id for post_id, body in items)
+    existing = set()
+    if post_ids:
+        existing = set(row.id for row in Post.query.with_entities(Post.id).filter(Post.id.in_(post_ids)))
+    valid = []
+    items = iter(items)
+    for i, error in enumerate(errors):
+        if error is not None:
+            continue
+        item = next(items)
+        if item[0] in existing:
+            valid.append(item)
+        else:
+            errors[i] = "post not found"
+    ids = Comment.bulk_insert(g.current_user.id, valid)
+    db.session.commit()
+    return bulk_response(errors, [url_for("api.get_comment", id=id) for id in ids])
 
 
 @api.route("/comments/<int:id>")
@@ -23,7 +84,8 @@ def get_comment(id):
     :return:
     """
     comment = Comment.query.get_or_404(id)
-    return jsonify({"comment": comment.to_json()})
+    return conditional(etag_for("comment", comment.id, comment.version),
+                       lambda: jsonify({"comment": comment.to_json()}))
 
 
 @api.route("/posts/<int:id>/comments")
@@ -34,7 +96,8 @@ def get_posts_comments(id):
     :return:
     """
     post = Post.query.get_or_404(id)
-    return jsonify({"comments": [comment.to_json() for comment in post.comments.filter_by(disabled=False).all()]})
+    versions = post.comments.filter_by(disabled=False).with_entities(Comment.id, Comment.version).all()
+    return comments_response(("post_comments", post.id), versions)
 
 
 @api.route("/posts/<int:id>/comments", methods=["POST"])
@@ -47,7 +110,7 @@ def new_posts_comments(id):
     """
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author_id = g.current_user.id
     comment.post = post
     db.session.add(comment)
     db.session.commit()
@@ -0,0 +1,73 @@
+"""
+    API 读接口的条件请求：ETag 由行版本号、时间戳等列直接算出，不需要先序列化，
+    请求头 If-None-Match 与之相同时直接返回 304
+"""
+import hashlib
+from flask import request, current_app, make_response, jsonify, url_for
+from ..feeds import load_by_ids
+
+
+def etag_for(*parts):
+    """
+    :param parts: 能唯一确定响应内容的值，如 ("post", id, version)
+    :return str:
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def conditional(etag, build_response):
+    """
+    :param etag:
+    :param build_response: 未命中时调用，生成完整响应
+    :return: 304 响应或 build_response() 的结果，都带有 ETag 和 Cache-Control
+    """
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(build_response())
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config["FLASKY_API_CACHE_MAX_AGE"]
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def row_versions(query, model):
+    """
+    只查询翻页和计算 ETag 所需的列
+    :param query:
+    :param model: Post 或 Comment
+    """
+    return query.with_entities(model.id, model.timestamp, model.version)
+
+
+def page_response(pagination, model, key, endpoint, **kwargs):
+    """
+    生成分页后的列表，只有请求参数 count 为真时才统计总数；
+    ETag 由本页各行的 id 和版本号算出，未命中时才加载整行并序列化
+    :param pagination: 基于 row_versions 查询的 KeysetPagination
+    :param model: Post 或 Comment
+    :param key: 响应中列表的键名，如 "posts"
+    :param endpoint: 生成前后页链接的端点
+    :return Response:
+    """
+    count = None
+    if request.args.get("count", "").lower() in ("1", "true", "yes"):
+        count = pagination.total
+    etag = etag_for(endpoint, kwargs, [(row.id, row.version) for row in pagination.items],
+                    pagination.prev_cursor, pagination.next_cursor, count)
+
+    def build_response():
+        prev = None
+        if pagination.has_prev:
+            prev = url_for(endpoint, cursor=pagination.prev_cursor, **kwargs)
+        next = None
+        if pagination.has_next:
+            next = url_for(endpoint, cursor=pagination.next_cursor, **kwargs)
+        objects = load_by_ids(model.query, [row.id for row in pagination.items])
+        return jsonify({key: [objects[row.id].to_json() for row in pagination.items if row.id in objects],
+                        "next_url": next,
+                        "prev_url": prev,
+                        "count": count
+                        })
+    return conditional(etag, build_response)
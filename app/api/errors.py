@@ -1,3 +1,4 @@
+import math
 from ..main import main
 from flask import request, Response, jsonify, render_template
 from . import api
@@ -25,6 +26,20 @@ def bad_request(message):
     return response
 
 
+def too_many_requests(message, retry_after):
+    response = jsonify({"error": "too many requests", "message": message})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(int(math.ceil(retry_after)))
+    return response
+
+
+def service_unavailable(message, retry_after):
+    response = jsonify({"error": "service unavailable", "message": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(int(math.ceil(retry_after)))
+    return response
+
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
@@ -4,29 +4,23 @@ from flask import jsonify, request, g, url_for, current_app
 from .. import db
 from .decorators import permission_required
 from .errors import forbidden
+from ..pagination import KeysetPagination
+from .conditional import etag_for, conditional, row_versions, page_response
+from .batch import batch_response
+from .bulk import validate_items, bulk_response
 
 
 @api.route("/posts/")
 def get_posts():
     """
-    返回全部博客
+    返回全部博客，带有 ids 参数时批量返回指定的博客
     :return:
     """
-    page = request.args.get("page", 1, type=int)
-    pagination = Post.query.paginate(page=page, per_page=current_app.config["FLASK_POSTS_PER_PAGE"],
-                                     error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_posts", page=page-1)
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_posts", page=page+1)
-    return jsonify({"posts": [post.to_json() for post in posts],
-                    "next_url": next,
-                    "prev_url": prev,
-                    "count": pagination.total
-                    })
+    if "ids" in request.args:
+        return batch_response(Post.query, "posts", lambda post: (post.id, post.version))
+    pagination = KeysetPagination(row_versions(Post.query, Post), current_app.config["FLASK_POSTS_PER_PAGE"],
+                                  cursor=request.args.get("cursor"))
+    return page_response(pagination, Post, "posts", "api.get_posts")
 
 
 @api.route("/posts/", methods=["POST"])
@@ -37,12 +31,25 @@ def new_post():
     :return:
     """
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_user.id
     db.session.add(post)
     db.session.commit()
     return jsonify(post.to_json()), 201, {"Location": url_for("api.get_post", id=post.id)}
 
 
+@api.route("/posts/bulk", methods=["POST"])
+@permission_required(Permission.WRITE)
+def new_posts_bulk():
+    """
+    批量创建博客文章，请求体为文章的 JSON 数组，通过校验的在同一个事务中插入
+    :return:
+    """
+    bodies, errors = validate_items(Post.body_from_json)
+    ids = Post.bulk_insert(g.current_user.id, bodies)
+    db.session.commit()
+    return bulk_response(errors, [url_for("api.get_post", id=id) for id in ids])
+
+
 @api.route("/posts/<int:id>")
 def get_post(id):
     """
@@ -51,7 +58,7 @@ def get_post(id):
     :return:
     """
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return conditional(etag_for("post", post.id, post.version), lambda: jsonify(post.to_json()))
 
 @api.route("/posts/<int:id>", methods=["PUT"])
 def edit_post(id):
@@ -61,7 +68,7 @@ def edit_post(id):
     :return:
     """
     post = Post.query.get_or_404(id)
-    if g.current_user != post.author and not g.current_user.can(Permission.ADMIN):
+    if g.current_user.id != post.author_id and not g.current_user.can(Permission.ADMIN):
         return forbidden("Insufficient permissions")
     post.body = request.json.get("body", post.body)
     db.session.add(post)
@@ -0,0 +1,31 @@
+from . import api
+from flask import jsonify, request, current_app, url_for
+from .errors import bad_request
+from ..search import SearchResults
+
+
+@api.route("/search")
+def search():
+    """
+    按相关度返回正文包含全部搜索词的文章和评论，按游标分页；
+    snippet 为转义后的 HTML 片段，命中词包在 <mark> 中
+    :return:
+    """
+    q = request.args.get("q", "").strip()
+    results = SearchResults(q, current_app.config["FLASK_SEARCH_RESULTS_PER_PAGE"], cursor=request.args.get("cursor"))
+    if results.pagination is None:
+        return bad_request("q is required")
+    prev = None
+    if results.pagination.has_prev:
+        prev = url_for("api.search", q=q, cursor=results.pagination.prev_cursor)
+    next = None
+    if results.pagination.has_next:
+        next = url_for("api.search", q=q, cursor=results.pagination.next_cursor)
+    return jsonify({"results": [{"type": hit.kind,
+                                 "rank": hit.rank,
+                                 "snippet": str(hit.snippet),
+                                 hit.kind: hit.target.to_json()}
+                                for hit in results.hits],
+                    "next_url": next,
+                    "prev_url": prev
+                    })
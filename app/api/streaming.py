@@ -0,0 +1,26 @@
+"""
+    NDJSON 流式输出：用 yield_per 分块读取，每行序列化后立即写出，
+    内存占用与表的大小无关
+"""
+from flask import request, current_app, json, Response, stream_with_context
+
+
+def wants_ndjson():
+    """
+    请求参数 format=ndjson 或 Accept 首选 application/x-ndjson 时使用流式输出
+    """
+    return request.args.get("format") == "ndjson" \
+        or request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def ndjson_response(query):
+    """
+    :param query: 已排好序的查询，每行对象需要有 to_json()
+    :return Response:
+    """
+    chunk_size = current_app.config["FLASKY_API_STREAM_CHUNK_SIZE"]
+
+    def generate():
+        for row in query.yield_per(chunk_size):
+            yield json.dumps(row.to_json()) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -0,0 +1,60 @@
+"""
+    API 的限流和准入控制，在认证之前执行：
+    同一客户端请求过于频繁时返回 429，本进程同时处理的请求过多时返回 503
+"""
+import hashlib
+import threading
+from flask import request, current_app, g
+from . import api
+from .errors import too_many_requests, service_unavailable
+from ..rate_limit import create_buckets
+from ..metrics import metrics
+
+
+@api.record_once
+def init_throttling(state):
+    config = state.app.config
+    state.app.extensions["api_rate_limit"] = create_buckets(config["FLASKY_API_RATE_LIMIT_BACKEND"],
+                                                            max_entries=config["FLASKY_API_RATE_LIMIT_SIZE"],
+                                                            path=config["FLASKY_API_RATE_LIMIT_PATH"])
+    max_concurrent = config["FLASKY_API_MAX_CONCURRENT"]
+    state.app.extensions["api_admission"] = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+
+def client_keys():
+    """
+    每个请求都按客户端 IP 计数；带有认证信息时再按其中的邮箱或令牌计数。
+    用户名在认证之前读取，每次换一个用户名可以得到新的桶，只按它计数挡不住猜密码
+    :return list: [(键, 额度倍数)]
+    """
+    keys = [("ip:{}".format(request.remote_addr), current_app.config["FLASKY_API_RATE_LIMIT_IP_FACTOR"])]
+    if request.authorization and request.authorization.username:
+        keys.append(("auth:" + hashlib.sha1(request.authorization.username.encode("utf-8")).hexdigest(), 1))
+    return keys
+
+
+@api.before_request
+def throttle():
+    if current_app.config["FLASKY_API_RATE_LIMIT"]:
+        limits = current_app.config["FLASKY_API_RATE_LIMITS"]
+        scope = request.endpoint if request.endpoint in limits else "default"
+        count, period = limits[scope]
+        for key, factor in client_keys():
+            allowed, retry_after = current_app.extensions["api_rate_limit"].take(
+                "{}:{}".format(scope, key), float(count * factor) / period, count * factor)
+            if not allowed:
+                metrics.incr("rate_limit.throttled")
+                metrics.incr("rate_limit.throttled.{}".format(scope))
+                return too_many_requests("Rate limit exceeded", retry_after)
+    semaphore = current_app.extensions["api_admission"]
+    if semaphore is not None:
+        if not semaphore.acquire(blocking=False):
+            metrics.incr("admission.rejected")
+            return service_unavailable("Too many concurrent requests", retry_after=1)
+        g.api_admitted = True
+
+
+@api.teardown_request
+def release(exc):
+    if g.pop("api_admitted", False):
+        current_app.extensions["api_admission"].release()
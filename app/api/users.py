@@ -1,6 +1,26 @@
 from . import api
-from ..models import User
-from flask import jsonify, request, url_for, current_app
+from ..models import User, Post
+from flask import jsonify, request, current_app
+from ..pagination import KeysetPagination
+from .conditional import etag_for, conditional, row_versions, page_response
+from .streaming import wants_ndjson, ndjson_response
+from .batch import batch_response
+
+
+def user_version(user):
+    """
+    用户 JSON 中会变化的字段
+    """
+    return user.id, user.username, user.member_since, user.last_seen, user.post_count
+
+
+@api.route("/users/")
+def get_users():
+    """
+    批量返回 ids 参数指定的用户
+    :return:
+    """
+    return batch_response(User.query, "users", user_version)
 
 
 @api.route("/user/<int:id>")
@@ -11,7 +31,7 @@ def get_user(id):
     :return:
     """
     user = User.query.get_or_404(id)
-    return jsonify({"user": user.to_json()})
+    return conditional(etag_for("user", *user_version(user)), lambda: jsonify({"user": user.to_json()}))
 
 
 @api.route("/user/<int:id>/posts")
@@ -22,29 +42,22 @@ def get_user_posts(id):
     :return:
     """
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    pagination = user.posts.paginate(page=page, per_page=current_app.config["FLASK_POSTS_PER_PAGE"],
-                                     error_out=False)
-    posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for("api.get_user_posts", page=page - 1, id=user.id)
-    next = None
-    if pagination.has_next:
-        next = url_for("api.get_user_posts", page=page - 1, id=user.id)
-    return jsonify({"posts": [post.to_json() for post in posts],
-                    "next_url": next,
-                    "prev_url": prev,
-                    "count": pagination.total
-                    })
+    pagination = KeysetPagination(row_versions(user.posts, Post), current_app.config["FLASK_POSTS_PER_PAGE"],
+                                  cursor=request.args.get("cursor"))
+    return page_response(pagination, Post, "posts", "api.get_user_posts", id=user.id)
 
 
 @api.route("user/<int:id>/timeline")
 def get_user_followed_posts(id):
     """
-    返回指定用户关注者发布的全部博客
+    返回指定用户关注者发布的博客，按游标分页；format=ndjson 时流式返回全部
     :param id:
     :return:
     """
     user = User.query.get_or_404(id)
-    return jsonify({"posts": [post.to_json() for post in user.followed_posts.all()]})
+    if wants_ndjson():
+        return ndjson_response(user.followed_posts.order_by(Post.timestamp.desc(), Post.id.desc()))
+    pagination = KeysetPagination(row_versions(user.followed_posts, Post),
+                                  current_app.config["FLASK_POSTS_PER_PAGE"],
+                                  cursor=request.args.get("cursor"))
+    return page_response(pagination, Post, "posts", "api.get_user_followed_posts", id=user.id)
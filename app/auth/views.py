@@ -5,14 +5,15 @@ from .forms import LoginForms,RegistrationForms, ChangePasswordForms, \
 from datetime import datetime
 from ..models import User
 from flask_login import login_user, current_user, logout_user, login_required
-from .. import db
+from .. import db, last_seen_tracker
 from ..email import send_mail
+from ..decorators import primary_only
 
 
 @auth.before_app_request  # 对全部的路由都是有效的
 def before_request():
     if current_user.is_authenticated:  # 用户已登陆
-        current_user.ping()  # 更新用户最近登陆的时间
+        last_seen_tracker.touch(current_user._get_current_object())  # 记录用户最近访问的时间，稍后批量写入
         if not current_user.confirmed \
                 and request.endpoint \
                 and request.blueprint != "auth" \
@@ -28,6 +29,7 @@ def login():
         if form.validate_on_submit():
             user = User.query.filter_by(email=form.email.data).first()
             if user is not None and user.verify_password(form.password.data):
+                db.session.commit()  # 保存可能重新计算的密码散列
                 login_user(user, form.remember_me.data)
                 next = request.args.get("next")
                 if next is None or not next.startswith("/"):
@@ -51,10 +53,12 @@ def register():
     if form.validate_on_submit():
         user = User(username=form.name.data, password=form.password1.data, email=form.email.data)
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         token = user.generate_confirmation_token()
-        # 发送确认邮件
-        send_mail(user.email, "Please confirm your account", "auth/mail/confirm", user=user, token=token)
+        # 发送确认邮件，开启 outbox 时与新用户在同一个事务中提交
+        send_mail(user.email, "Please confirm your account", "auth/mail/confirm",
+                  dedup_key="confirm:{}".format(user.id), user=user, token=token)
+        db.session.commit()
         flash("You can login now!")
         return redirect(url_for("auth.login"))
     return render_template("auth/register.html", form=form, current_time=datetime.utcnow())
@@ -62,6 +66,7 @@ def register():
 
 @auth.route("/confirm/<token>")
 @login_required
+@primary_only
 def confirm(token):
     if current_user.confirmed:
         return redirect(url_for("main.index"))
@@ -82,10 +87,13 @@ def unconfirmed():
 
 @auth.route("/confirm")
 @login_required
+@primary_only
 def resend_confirmation():
     if not current_user.confirmed:
         token = current_user.generate_confirmation_token()
-        send_mail(current_user.email, "Please confirm your account", "auth/mail/confirm", user=current_user, token=token)
+        send_mail(current_user.email, "Please confirm your account", "auth/mail/confirm",
+                  dedup_key="confirm:{}".format(current_user.id), user=current_user, token=token)
+        db.session.commit()
         flash("A new confirmatino email has been sent to you by email.")
         return redirect(url_for("main.index"))
 
@@ -108,7 +116,9 @@ def send_reset_password_mail():
     form = ResetPasswordEmailForms()
     if form.validate_on_submit():
         token = User().generate_reset_password_token()
-        send_mail(form.email.data, "Reset password", "auth/mail/reset_password", token=token)
+        send_mail(form.email.data, "Reset password", "auth/mail/reset_password",
+                  dedup_key="reset_password:{}".format(form.email.data), token=token)
+        db.session.commit()
         flash("Please check your email, and follow the steps to reset your password!")
         redirect(url_for("auth.login"))
     return render_template("auth/send_reset_password_email.html", form=form, current_time=datetime.utcnow())
@@ -137,13 +147,15 @@ def change_email():
     if form.validate_on_submit():
         token = current_user.generate_change_email_token(form.mail.data)
         send_mail(form.mail.data, "Flasky-Confirm Email", "auth/mail/change_email",
-                  token=token, user=current_user)
+                  dedup_key="change_email:{}".format(current_user.id), token=token, user=current_user)
+        db.session.commit()
         flash("account's email has changed, please check your emial and finish the follow steps")
         return redirect(url_for("main.index"))
     return render_template("auth/change_email.html", form=form, current_time=datetime.utcnow())
 
 
 @auth.route("/changemail/<token>", methods=["GET"])
+@primary_only
 def change_email_confirm(token):
     new_email = User().confirm_change_email(token)
     if g.user.confirmed:
@@ -0,0 +1,140 @@
+"""
+    进程内 / 本机共享的键值缓存后端
+
+    * NullCache: 不缓存
+    * LRUCache: 进程内，按条目数限制大小，最近最少使用的先淘汰
+    * SQLiteCache: 本机 SQLite 文件，同一台机器上的多个工作进程共享
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class NullCache(object):
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(object):
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteCache(object):
+    """
+    每个线程持有一个连接；按写入顺序淘汰，超过 max_entries 后每写入 prune_every 次清理一次。
+    同一文件中的多个缓存各用一张表，清理和 clear 互不影响
+    """
+    prune_every = 100
+
+    def __init__(self, path, max_entries=10000, table="cache"):
+        if not table.isidentifier():
+            raise ValueError("invalid cache table name: {}".format(table))
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS {} "
+                         "(key TEXT PRIMARY KEY, value BLOB, expires REAL)".format(self.table))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, expires FROM {} WHERE key = ?".format(self.table), (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO {} (key, value, expires) VALUES (?, ?, ?)".format(self.table),
+                     (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            conn.execute("DELETE FROM {0} WHERE rowid IN "
+                         "(SELECT rowid FROM {0} ORDER BY rowid DESC LIMIT -1 OFFSET ?)".format(self.table),
+                         (self.max_entries,))
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM {} WHERE key = ?".format(self.table), (key,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM {}".format(self.table))
+
+
+def create_cache(kind, max_entries=1000, path=None, table="cache"):
+    """
+    按配置创建缓存后端
+    :param kind: "null" | "lru" | "sqlite"
+    :param max_entries: 条目数上限
+    :param path: sqlite 后端的文件路径
+    :param table: sqlite 后端的表名，共用一个文件的缓存须各不相同
+    """
+    if not kind or kind == "null":
+        return NullCache()
+    if kind == "lru":
+        return LRUCache(max_entries)
+    if kind == "sqlite":
+        return SQLiteCache(path, max_entries, table)
+    raise ValueError("unknown cache backend: {}".format(kind))
@@ -0,0 +1,193 @@
+"""
+    数据库连接的调优：SQLite 在每个新连接上执行 FLASKY_SQLITE_PRAGMAS（WAL、synchronous、busy_timeout 等），
+    并可改用固定大小的连接池复用连接；其他数据库使用 FLASKY_DATABASE_POOL 中的连接池设置。
+    配置了 FLASKY_DATABASE_REPLICAS 时，GET 请求中的查询由 RoutingSession 发往只读副本
+"""
+import random
+import threading
+import time
+from flask import g, has_request_context, request, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select, TextClause
+from .metrics import metrics
+
+PIN_KEY = "_db_primary_until"  # 浏览器会话中记下的时间之前，该用户的请求只读主库
+
+
+def is_file_sqlite(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def engine_options(config, uri):
+    """
+    按数据库类型生成 create_engine 的参数，SQLALCHEMY_ENGINE_OPTIONS 中的设置优先
+    :param config: app.config
+    :param uri: 数据库 URI
+    :return dict:
+    """
+    options = {}
+    if make_url(uri).get_backend_name() != "sqlite":
+        options.update(config["FLASKY_DATABASE_POOL"])
+    elif is_file_sqlite(uri) and config["FLASKY_SQLITE_POOL_SIZE"]:
+        # SQLAlchemy 对 SQLite 文件默认每次借出连接时新建，PRAGMA 和页缓存随连接关闭而丢失
+        options.update(poolclass=QueuePool, pool_size=config["FLASKY_SQLITE_POOL_SIZE"],
+                       max_overflow=config["FLASKY_SQLITE_POOL_OVERFLOW"],
+                       connect_args={"check_same_thread": False})
+    options.update(config["SQLALCHEMY_ENGINE_OPTIONS"])
+    return options
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    :param dbapi_connection: sqlite3.Connection
+    :param pragmas: {名称: 值}，按顺序执行 PRAGMA 名称=值
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA {}={}".format(name, value))
+    finally:
+        cursor.close()
+
+
+def listen_pragmas(engine, pragmas):
+    """
+    引擎每建立一个新连接时执行 pragmas
+    """
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+    event.listen(engine, "connect", lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
+
+
+class DatabaseTuning(object):
+    """
+    在 db.init_app 之后调用：先按数据库类型写入 SQLALCHEMY_ENGINE_OPTIONS，再创建引擎并挂上 PRAGMA 钩子
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import db
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, app.config["SQLALCHEMY_DATABASE_URI"])
+        # 副本作为没有模型的 bind 注册，create_all 不会在副本上建表
+        replicas = ["replica%d" % i for i in range(len(app.config["FLASKY_DATABASE_REPLICAS"]))]
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.update(zip(replicas, app.config["FLASKY_DATABASE_REPLICAS"]))
+        app.config["SQLALCHEMY_BINDS"] = binds
+        app.extensions["replicas"] = ReplicaSet(app, replicas)
+        for bind in [None] + list(binds):
+            listen_pragmas(db.get_engine(app, bind), app.config["FLASKY_SQLITE_PRAGMAS"])
+
+
+class ReplicaSet(object):
+    """
+    每个应用一个；连接失败的副本 FLASKY_DATABASE_REPLICA_RETRY 秒内不再选用
+    """
+
+    def __init__(self, app, binds):
+        self.app = app
+        self.binds = binds
+        self.down_until = {}
+        self.lock = threading.Lock()
+
+    def choose(self, session):
+        """
+        为会话选一个可用的副本，之后该会话的查询都用它；都不可用时返回 None，使用主库
+        :return Engine:
+        """
+        from . import db
+        bind = session.info.get("replica")
+        if bind is None:
+            bind = session.info["replica"] = self._available()
+        return db.get_engine(self.app, bind) if bind else None
+
+    def _available(self):
+        from . import db
+        now = time.time()
+        candidates = [bind for bind in self.binds if self.down_until.get(bind, 0) <= now]
+        random.shuffle(candidates)
+        for bind in candidates:
+            try:
+                db.get_engine(self.app, bind).connect().close()
+            except Exception as e:
+                metrics.incr("replica.unavailable")
+                self.app.logger.warning("replica {} unavailable: {!r}".format(bind, e))
+                with self.lock:
+                    self.down_until[bind] = now + self.app.config["FLASKY_DATABASE_REPLICA_RETRY"]
+                continue
+            return bind
+        return False
+
+
+def is_write(clause):
+    """
+    :param clause: session.execute 执行的语句
+    :return bool: 除 SELECT 以外的语句都可能修改数据
+    """
+    if isinstance(clause, Select):
+        return False
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(("SELECT", "EXPLAIN", "PRAGMA"))
+    return True
+
+
+class RoutingSession(SignallingSession):
+    """
+    GET/HEAD 请求中的 SELECT 发往副本；会话写入过，或者该用户在 FLASKY_DATABASE_REPLICA_PIN 秒内写入过时，
+    一律使用主库，刚提交的修改在重定向后的页面中也能读到。
+    写入包括 flush、session.execute 执行的非 SELECT 语句和直接取连接执行的语句（如批量插入）
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if clause is not None and is_write(clause):
+            self.info["wrote"] = True
+        if isinstance(clause, Select) and self.reads_from_replica():
+            engine = self.app.extensions["replicas"].choose(self)
+            if engine is not None:
+                metrics.incr("replica.reads")
+                return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def connection(self, mapper=None, clause=None, **kwargs):
+        # 调用者拿到连接后执行什么语句无从得知，按写入处理
+        if mapper is None and clause is None:
+            self.info["wrote"] = True
+        return super(RoutingSession, self).connection(mapper=mapper, clause=clause, **kwargs)
+
+    def reads_from_replica(self):
+        if not self.app.extensions["replicas"].binds or self.info.get("wrote") or self._flushing:
+            return False
+        if not has_request_context() or request.method not in ("GET", "HEAD"):
+            return False
+        # 用 primary_only 标记的视图在 GET 请求中写入，写入依据的数据也要从主库读取
+        if getattr(self.app.view_functions.get(request.endpoint), "primary_only", False):
+            return False
+        # 整页缓存未命中时渲染的页面会提供给所有访问者，直到下次失效，
+        # 从主库读取，以免把副本上的旧数据缓存下来
+        if g.get("page_cache") is not None:
+            return False
+        return flask_session.get(PIN_KEY, 0) < time.time()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, "after_flush", on_flushed)
+        event.listen(factory, "after_commit", on_committed)
+        return factory
+
+
+def on_flushed(session, flush_context):
+    session.info["wrote"] = True
+
+
+def on_committed(session):
+    if session.info.get("wrote") and has_request_context() and session.app.extensions["replicas"].binds:
+        flask_session[PIN_KEY] = time.time() + session.app.config["FLASKY_DATABASE_REPLICA_PIN"]
+
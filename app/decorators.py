@@ -17,3 +17,12 @@ def permission_required(permission):
 
 def admin_required(f):
     return permission_required(Permission.ADMIN)(f)
+
+
+def primary_only(f):
+    """
+    标记先读后写的 GET 视图（关注、屏蔽评论、确认链接等）：这些视图根据读到的数据决定写入什么，
+    读到副本上的旧数据会写错，请求中的查询全部发往主库，见 RoutingSession.reads_from_replica
+    """
+    f.primary_only = True
+    return f
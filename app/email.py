@@ -1,21 +1,303 @@
-from . import mail
+"""
+    邮件发送：send_mail 把邮件放入有界队列，由固定数量的后台线程发送；
+    每个线程连续发送队列中的邮件时复用同一个 SMTP 连接，空闲一段时间后断开。
+    开启 FLASKY_MAIL_OUTBOX 后邮件先写入 outbox 表，事务提交后由发送线程或 flask dispatch-mail 发送；
+    发送线程在 outbox 中最早的重试时间到达时再次发送，发送失败的邮件不必等下一次提交
+"""
+import atexit
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
 from flask import render_template, current_app
-from flask_mail import Mail, Message
-from threading import Thread
+from flask_mail import Message
+from .metrics import metrics
 
+_stop = object()  # 放入队列，让一个发送线程退出
+_dispatch = object()  # 放入队列，让一个发送线程发送 outbox 中到期的邮件
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
 
+class MailQueue(object):
+    """
+    FLASKY_MAIL_WORKERS 个发送线程共用一个长度为 FLASKY_MAIL_QUEUE_SIZE 的队列；
+    队列满时 send_mail 最多等待 FLASKY_MAIL_QUEUE_TIMEOUT 秒，仍然满就在调用方的线程中直接发送，
+    不丢弃邮件，也不再为每封邮件创建线程。进程退出前发完队列中剩下的邮件
+    """
 
-def send_mail(to, subject, template, **kwargs):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["mail_queue"] = MailWorkers(app)
+
+    @staticmethod
+    def _workers():
+        return current_app.extensions["mail_queue"]
+
+    def submit(self, msg):
+        """
+        :param msg: flask_mail.Message
+        """
+        self._workers().submit(msg)
+
+    def dispatch_outbox(self):
+        """
+        outbox 有新邮件的事务提交后调用，由发送线程尽快发送
+        """
+        self._workers().dispatch_outbox()
+
+    def join(self):
+        """
+        等待队列中的邮件全部处理完
+        """
+        self._workers().queue.join()
+
+    def shutdown(self, timeout=None):
+        self._workers().shutdown(timeout)
+
+
+class MailWorkers(object):
+    """
+    每个应用一个，第一次提交邮件时才启动发送线程
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config["FLASKY_MAIL_WORKERS"]
+        self.timeout = app.config["FLASKY_MAIL_QUEUE_TIMEOUT"]
+        self.idle = app.config["FLASKY_MAIL_IDLE_TIMEOUT"]
+        self.queue = queue.Queue(app.config["FLASKY_MAIL_QUEUE_SIZE"])
+        self.threads = []
+        self.lock = threading.Lock()
+        self.dispatch_queued = False
+        self.retry_timer = None
+        self.retry_due = None
+
+    def submit(self, msg):
+        self.start()
+        try:
+            self.queue.put(msg, timeout=self.timeout)
+        except queue.Full:
+            # 发送跟不上时由调用方承担，请求变慢但邮件不会丢
+            metrics.incr("mail.queue_full")
+            from . import mail
+            with mail.connect() as connection:
+                self.deliver(connection, msg)
+
+    def dispatch_outbox(self):
+        with self.lock:
+            if self.dispatch_queued:
+                return
+            self.dispatch_queued = True
+        self.start()
+        try:
+            self.queue.put_nowait(_dispatch)
+        except queue.Full:
+            # 邮件仍在 outbox 中，由下一次提交或 flask dispatch-mail 发送
+            self.dispatch_queued = False
+
+    def schedule_dispatch(self, delay):
+        """
+        delay 秒后发送 outbox 中到期的邮件；已经安排了更早的发送时不再重复安排
+        """
+        due = time.time() + delay
+        with self.lock:
+            if self.retry_timer is not None:
+                if self.retry_due <= due:
+                    return
+                self.retry_timer.cancel()
+            timer = threading.Timer(delay, self._retry)
+            timer.daemon = True
+            self.retry_timer, self.retry_due = timer, due
+        timer.start()
+
+    def _retry(self):
+        with self.lock:
+            self.retry_timer = self.retry_due = None
+        self.dispatch_outbox()
+
+    def take(self, timeout=None):
+        msg = self.queue.get(timeout=timeout)
+        if msg is _dispatch:
+            # 取出后立即清除，发送失败时之后的提交仍能再次触发发送
+            self.dispatch_queued = False
+        return msg
+
+    def start(self):
+        if self.threads:
+            return
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name="mail-sender-%d" % i, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        atexit.register(self.shutdown)
+
+    def shutdown(self, timeout=None):
+        """
+        发完已在队列中的邮件后停止发送线程
+        """
+        with self.lock:
+            threads, self.threads = self.threads, []
+            if self.retry_timer is not None:
+                self.retry_timer.cancel()
+                self.retry_timer = self.retry_due = None
+        for thread in threads:
+            self.queue.put(_stop)
+        for thread in threads:
+            thread.join(timeout)
+
+    def run(self):
+        from . import mail
+        msg = self.take()
+        while msg is not _stop:
+            with self.app.app_context():
+                try:
+                    with mail.connect() as connection:
+                        metrics.incr("mail.connections")
+                        # 队列中还有邮件就用同一个连接继续发送
+                        while msg is not None and msg is not _stop:
+                            sending, msg = msg, None
+                            try:
+                                self.deliver(connection, sending)
+                            finally:
+                                self.queue.task_done()
+                            try:
+                                msg = self.take(timeout=self.idle)
+                            except queue.Empty:
+                                pass
+                except Exception:
+                    # 连接失败或服务器拒绝，丢弃这个连接，下一封邮件重新连接
+                    metrics.incr("mail.failed")
+                    self.app.logger.exception("failed to send mail")
+                    if msg is _dispatch:
+                        self.schedule_dispatch(self.app.config["FLASKY_MAIL_OUTBOX_RETRY_BASE"])
+                    if msg is not None and msg is not _stop:
+                        self.queue.task_done()
+                        msg = None
+            if msg is None:
+                msg = self.take()
+        self.queue.task_done()
+
+    def deliver(self, connection, msg):
+        if msg is _dispatch:
+            dispatch_outbox(connection)
+            due = next_attempt_at()
+            if due is not None:
+                self.schedule_dispatch(max(0.0, (due - datetime.utcnow()).total_seconds()))
+            return
+        connection.send(msg)
+        metrics.incr("mail.sent")
+
+
+def dispatch_outbox(connection, batch_size=None):
+    """
+    分批发送 outbox 中到期的邮件：每批先用一条 UPDATE 认领（推后 next_attempt_at 并记下认领者），
+    多个进程同时发送也不会重复；发送后在一个事务中记下结果，失败的按指数退避安排下次重试
+    :param connection: mail.connect() 打开的连接
+    :param batch_size: 每批的封数
+    :return (int, int): 发送成功、失败的封数
+    """
+    from . import db
+    from .models import OutboxMessage
+    app = current_app._get_current_object()
+    config = app.config
+    batch_size = batch_size or config["FLASKY_MAIL_OUTBOX_BATCH_SIZE"]
+    table = OutboxMessage.__table__
+    engine = db.get_engine(app)
+    sent = failed = 0
+    while True:
+        now = datetime.utcnow()
+        claim = uuid.uuid4().hex
+        due = db.select([table.c.id]).where(table.c.next_attempt_at <= now).\
+            order_by(table.c.next_attempt_at).limit(batch_size)
+        with engine.begin() as conn:
+            # 发送中途进程退出时，租约到期后由其他发送者重试
+            conn.execute(table.update().where(db.and_(table.c.id.in_(due), table.c.next_attempt_at <= now)).
+                         values(claimed_by=claim,
+                                next_attempt_at=now + timedelta(seconds=config["FLASKY_MAIL_OUTBOX_LEASE"])))
+            rows = conn.execute(db.select([table]).where(table.c.claimed_by == claim).
+                                order_by(table.c.id)).fetchall()
+        if not rows:
+            break
+        delivered, errors = [], []
+        for row in rows:
+            msg = Message(row.subject, sender=config["FLASKY_MAIL_SENDER"], recipients=[row.recipient],
+                          cc=[config["FLASKY_MAIL_SENDER"]], body=row.body, html=row.html)
+            try:
+                connection.send(msg)
+            except Exception as e:
+                app.logger.warning("failed to send outbox mail {}: {!r}".format(row.id, e))
+                errors.append((row, repr(e)))
+            else:
+                delivered.append((row, datetime.utcnow()))
+        with engine.begin() as conn:
+            if delivered:
+                conn.execute(table.update().where(table.c.id == db.bindparam("row_id")).
+                             values(sent_at=db.bindparam("sent"), next_attempt_at=None, claimed_by=None,
+                                    attempts=table.c.attempts + 1, last_error=None),
+                             [{"row_id": row.id, "sent": sent_at} for row, sent_at in delivered])
+            if errors:
+                conn.execute(table.update().where(table.c.id == db.bindparam("row_id")).
+                             values(next_attempt_at=db.bindparam("retry"), claimed_by=None,
+                                    attempts=table.c.attempts + 1, last_error=db.bindparam("error")),
+                             [{"row_id": row.id, "retry": retry_at(row.attempts + 1, config), "error": error}
+                              for row, error in errors])
+        for row, sent_at in delivered:
+            metrics.incr("mail.outbox.latency_ms", int((sent_at - row.created_at).total_seconds() * 1000))
+        metrics.incr("mail.outbox.sent", len(delivered))
+        metrics.incr("mail.outbox.failed", len(errors))
+        sent += len(delivered)
+        failed += len(errors)
+        if len(rows) < batch_size:
+            break
+    with engine.connect() as conn:
+        metrics.set("mail.outbox.depth", conn.execute(
+            db.select([db.func.count()]).select_from(table).where(table.c.next_attempt_at.isnot(None))).scalar())
+    return sent, failed
+
+
+def next_attempt_at():
+    """
+    :return datetime: outbox 中待发送邮件最早的重试时间（包括认领后租约到期的时间），没有时为 None
+    """
+    from . import db
+    from .models import OutboxMessage
+    table = OutboxMessage.__table__
+    with db.get_engine(current_app._get_current_object()).connect() as conn:
+        return conn.execute(db.select([db.func.min(table.c.next_attempt_at)])).scalar()
+
+
+def retry_at(attempts, config):
+    """
+    第 attempts 次失败后的下次重试时间：FLASKY_MAIL_OUTBOX_RETRY_BASE * 2^(attempts-1) 秒，
+    不超过 FLASKY_MAIL_OUTBOX_RETRY_MAX；达到 FLASKY_MAIL_OUTBOX_MAX_ATTEMPTS 次后放弃，返回 None
+    """
+    if attempts >= config["FLASKY_MAIL_OUTBOX_MAX_ATTEMPTS"]:
+        metrics.incr("mail.outbox.abandoned")
+        return None
+    delay = min(config["FLASKY_MAIL_OUTBOX_RETRY_BASE"] * 2 ** (attempts - 1), config["FLASKY_MAIL_OUTBOX_RETRY_MAX"])
+    return datetime.utcnow() + timedelta(seconds=delay)
+
+
+def send_mail(to, subject, template, dedup_key=None, **kwargs):
+    """
+    开启 FLASKY_MAIL_OUTBOX 时只把邮件加入当前会话，调用方提交事务后才会发送
+    :param dedup_key: 同一个键还有未发送的邮件时替换其内容，不再新增，如 "confirm:<user id>"
+    """
     app = current_app._get_current_object()
-    msg = Message(app.config["FLASKY_MAIL_SUBJECT_PREFIX"] + subject,
-                  sender=app.config["FLASKY_MAIL_SENDER"], recipients=[to],
-                  cc=[app.config["FLASKY_MAIL_SENDER"]])
-    msg.body = render_template(template + ".txt", **kwargs)
-    msg.html = render_template(template + ".html", **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    subject = app.config["FLASKY_MAIL_SUBJECT_PREFIX"] + subject
+    body = render_template(template + ".txt", **kwargs)
+    html = render_template(template + ".html", **kwargs)
+    if app.config["FLASKY_MAIL_OUTBOX"]:
+        from .models import OutboxMessage
+        return OutboxMessage.enqueue(to, subject, body, html, dedup_key=dedup_key)
+    msg = Message(subject, sender=app.config["FLASKY_MAIL_SENDER"], recipients=[to],
+                  cc=[app.config["FLASKY_MAIL_SENDER"]], body=body, html=html)
+    from . import mail_queue
+    mail_queue.submit(msg)
+    return msg
@@ -1,50 +1,231 @@
-from random import randint
-from sqlalchemy.exc import IntegrityError
+"""
+    生成大量测试数据：用户、文章、评论和幂律分布的关注关系，用于在接近生产规模的数据上做基准测试。
+    每批用一条 executemany 插入并提交一次，插入绕过 ORM 事件，全部写完后统一修复计数列并重建时间线；
+    所有用户共用一个预先算好的密码哈希（明文为 FAKE_PASSWORD）。
+    正文只由小写单词和句号组成，body_html 直接写成 Markdown 渲染的结果，不逐行渲染。
+    相同的 seed 和 now（以及相同版本的 Faker）生成相同的数据
+"""
+import hashlib
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
 from faker import Faker
-from .models import User, Post, Follow
+from flask import current_app
+from werkzeug.security import SALT_CHARS
 from . import db
+from .models import Role, User, Post, Comment, Follow, Timeline
+from .passwords import hash_password
 
+FAKE_PASSWORD = "password"
+EPOCH = datetime(2026, 1, 1)  # 默认的时间窗口结束时间，固定下来才能每次生成相同的数据
 
-def users(count=100):
-    fake = Faker()
-    i = 0
-    while i < count:
-        u = User(email=fake.email(),
-                 username=fake.user_name(),
-                 password="password",
-                 confirmed=True,
-                 name=fake.name(),
-                 location=fake.city(),
-                 about_me=fake.text(),
-                 member_since=fake.past_date())
-        db.session.add(u)
-        try:
-            db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
-    fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(),
-                 timestamp=fake.past_datetime(),
-                 author=u)
-        db.session.add(p)
-    db.session.commit()
-
-
-def follow(count=100):
-    fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        user_id = randint(1, user_count-1)
-        f = Follow(follower_id=user_id, followed_id=user_count-user_id)
-        try:
-            db.session.add(f)
+# 各规模下生成的行数
+PRESETS = {
+    "S": {"users": 1000, "posts": 10000, "comments": 20000, "follows": 20000},
+    "M": {"users": 50000, "posts": 500000, "comments": 1000000, "follows": 1000000},
+    "L": {"users": 500000, "posts": 5000000, "comments": 10000000, "follows": 10000000},
+}
+
+POPULARITY_EXPONENT = 1.0  # 第 r 受欢迎的用户被关注、发文的概率正比于 1 / r ** POPULARITY_EXPONENT
+FOLLOWING_ALPHA = 1.5  # 每个用户关注的人数服从此参数的帕累托分布
+DISABLED_COMMENTS = 0.02  # 被屏蔽的评论比例
+
+
+class Generator(object):
+    """
+    依次调用 users、follows、posts、comments 生成各表的数据，最后调用 finish；
+    后面的步骤使用前面生成的用户和文章，没有生成时使用数据库中已有的
+    """
+
+    def __init__(self, seed=0, batch_size=5000, now=None, days=365):
+        """
+        :param seed: 随机数种子
+        :param batch_size: 每次 executemany 插入并提交的行数
+        :param now: 生成数据的时间窗口的结束时间，默认为 EPOCH
+        :param days: 时间窗口的天数
+        """
+        self.rng = random.Random(seed)
+        fake = Faker()
+        fake.seed_instance(seed)
+        # Faker 只用来生成几个素材池，逐行调用 Faker 太慢
+        self.words = sorted(set(word for word in fake.words(2000) if word.isalpha() and word.islower()))
+        self.names = [fake.name() for i in range(1000)]
+        self.cities = [fake.city() for i in range(500)]
+        self.handles = [fake.user_name() for i in range(1000)]
+        self.batch_size = batch_size
+        self.now = now or EPOCH
+        self.seconds = days * 24 * 3600
+        self.start = self.now - timedelta(seconds=self.seconds)
+        salt = "".join(self.rng.choice(SALT_CHARS) for i in range(current_app.config["FLASKY_PASSWORD_SALT_LENGTH"]))
+        self.password_hash = hash_password(FAKE_PASSWORD, salt=salt)
+        self.user_ids = array("q")
+        self.post_ids = array("q")
+        self.post_times = array("d")  # 文章发布时间，为 start 之后的秒数
+        self._popularity = None
+
+    def insert(self, table, rows):
+        if rows:
+            db.session.execute(table.insert(), rows)
             db.session.commit()
-        except:
-            db.session.rollback()
\ No newline at end of file
+
+    def next_id(self, model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def text(self, sentences):
+        """
+        :return str: Markdown 把它渲染成单个 <p> 段落，不含需要转义或链接化的内容
+        """
+        return " ".join(" ".join(self.rng.choices(self.words, k=self.rng.randint(4, 14))).capitalize() + "."
+                        for i in range(sentences))
+
+    def moment(self, after=0.0):
+        """
+        :param after: 不早于 start 之后的这么多秒
+        :return datetime: 时间窗口内的随机时间
+        """
+        return self.start + timedelta(seconds=int(self.rng.uniform(after, self.seconds)))
+
+    def users(self, count):
+        table = User.__table__
+        role_id = Role.query.filter_by(default=True).first().id
+        first_id = self.next_id(User)
+        for low in range(0, count, self.batch_size):
+            rows = []
+            for id in range(first_id + low, first_id + min(low + self.batch_size, count)):
+                handle = self.rng.choice(self.handles)
+                email = "%s%d@example.com" % (handle, id)
+                member_since = self.moment() - timedelta(days=self.rng.randint(0, 365))
+                rows.append({"id": id, "email": email, "username": "%s%d" % (handle, id), "role_id": role_id,
+                             "password_hash": self.password_hash, "confirmed": True,
+                             "name": self.rng.choice(self.names), "location": self.rng.choice(self.cities),
+                             "about_me": self.text(1), "member_since": member_since,
+                             "last_seen": self.moment(), "avatar_hash": hashlib.md5(email.encode("utf-8")).hexdigest(),
+                             "post_count": 0, "follower_count": 0, "followed_count": 0, "token_generation": 0})
+            self.insert(table, rows)
+        self.user_ids.extend(range(first_id, first_id + count))
+        self._popularity = None
+        return count
+
+    def popular_users(self, k):
+        """
+        按幂律分布抽取 k 个用户 id，少数用户被抽中的次数远多于其他用户
+        """
+        if self._popularity is None:
+            if not self.user_ids:
+                self.user_ids.extend(id for id, in db.session.query(User.id).order_by(User.id))
+            ranked = list(self.user_ids)
+            self.rng.shuffle(ranked)
+            weights = accumulate(1.0 / rank ** POPULARITY_EXPONENT for rank in range(1, len(ranked) + 1))
+            self._popularity = ranked, list(weights)
+        ranked, cum_weights = self._popularity
+        return self.rng.choices(ranked, cum_weights=cum_weights, k=k)
+
+    def follows(self, count):
+        """
+        每个用户关注的人数服从帕累托分布，总数约为 count；被关注者按幂律分布抽取
+        """
+        self.popular_users(0)
+        ranked = self._popularity[0]
+        if len(ranked) < 2:
+            return 0
+        raw = [self.rng.paretovariate(FOLLOWING_ALPHA) for i in ranked]
+        scale = count / sum(raw)
+        limit = (len(ranked) - 1) // 2
+        table = Follow.__table__
+        rows = []
+        total = 0
+        for follower, weight in zip(self.user_ids, raw):
+            degree = min(limit, int(weight * scale + self.rng.random()))
+            followed = set()
+            for attempt in range(4):
+                followed.update(self.popular_users(degree - len(followed)))
+                followed.discard(follower)
+                if len(followed) >= degree:
+                    break
+            rows.extend({"follower_id": follower, "followed_id": id, "timestamp": self.moment()}
+                        for id in sorted(followed))
+            if len(rows) >= self.batch_size:
+                self.insert(table, rows)
+                total += len(rows)
+                rows = []
+        self.insert(table, rows)
+        return total + len(rows)
+
+    def posts(self, count):
+        """
+        发布时间随 id 递增，作者按幂律分布抽取
+        """
+        table = Post.__table__
+        first_id = self.next_id(Post)
+        for low in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - low)
+            rows = []
+            for i, author_id in enumerate(self.popular_users(size)):
+                offset = self.seconds * (low + i + self.rng.random()) / count
+                body = self.text(self.rng.randint(1, 5))
+                rows.append({"id": first_id + low + i, "body": body, "body_html": "<p>%s</p>" % body,
+                             "timestamp": self.start + timedelta(seconds=int(offset)), "author_id": author_id,
+                             "comment_count": 0, "version": 1, "render_pending": False})
+                self.post_times.append(offset)
+            self.insert(table, rows)
+        self.post_ids.extend(range(first_id, first_id + count))
+        return count
+
+    def comments(self, count):
+        """
+        评论随机分布在文章上，时间晚于所评论的文章
+        """
+        if not self.post_ids:
+            for id, timestamp in db.session.query(Post.id, Post.timestamp).order_by(Post.id):
+                self.post_ids.append(id)
+                self.post_times.append(max(0.0, min((timestamp - self.start).total_seconds(), self.seconds)))
+        if not self.post_ids:
+            return 0
+        table = Comment.__table__
+        first_id = self.next_id(Comment)
+        for low in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - low)
+            rows = []
+            for i, author_id in enumerate(self.popular_users(size)):
+                index = self.rng.randrange(len(self.post_ids))
+                body = self.text(self.rng.randint(1, 2))
+                rows.append({"id": first_id + low + i, "body": body, "body_html": "<p>%s</p>" % body,
+                             "timestamp": self.moment(self.post_times[index]), "author_id": author_id,
+                             "post_id": self.post_ids[index], "disabled": self.rng.random() < DISABLED_COMMENTS,
+                             "version": 1, "render_pending": False})
+            self.insert(table, rows)
+        return count
+
+    def finish(self):
+        """
+        批量插入没有经过 ORM 事件，重新统计计数列并重建时间线
+        """
+        User.repair_counters(self.batch_size)
+        Post.repair_counters(self.batch_size)
+        Timeline.rebuild(self.batch_size)
+
+
+def generate(size="S", seed=0, batch_size=5000, now=None, progress=None):
+    """
+    :param size: PRESETS 中的规模名称，或 {"users": 行数, "posts": ..., "comments": ..., "follows": ...}
+    :param seed:
+    :param batch_size:
+    :param now: 见 Generator
+    :param progress: 每完成一步调用 progress(步骤名称, 行数, 秒数)
+    :return dict: 每张表生成的行数
+    """
+    counts = PRESETS[size] if isinstance(size, str) else size
+    generator = Generator(seed=seed, batch_size=batch_size, now=now)
+    result = {}
+    for step in ("users", "follows", "posts", "comments"):
+        started = time.time()
+        result[step] = getattr(generator, step)(counts.get(step, 0))
+        if progress is not None:
+            progress(step, result[step], time.time() - started)
+    started = time.time()
+    generator.finish()
+    if progress is not None:
+        progress("counters and timelines", 0, time.time() - started)
+    return result
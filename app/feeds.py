@@ -0,0 +1,48 @@
+"""
+    文章、评论、关注列表的加载层：列表中每一行要用到的作者在同一条查询里取出，
+    计数读取反范式的计数列，渲染一页所需的查询数与每页行数无关
+"""
+from . import db
+from .models import Post, Comment, Follow
+
+
+def load_posts(query):
+    """
+    文章连同作者一起加载
+    :param query: Post 查询
+    :return query:
+    """
+    return query.options(db.joinedload(Post.author))
+
+
+def load_comments(query):
+    """
+    评论连同作者一起加载
+    :param query: Comment 查询
+    :return query:
+    """
+    return query.options(db.joinedload(Comment.author))
+
+
+def load_follows(query, attr):
+    """
+    关注关系只加载列表要显示的一侧用户
+    :param query: Follow 查询
+    :param attr: "follower" 或 "followed"
+    :return query:
+    """
+    other = "followed" if attr == "follower" else "follower"
+    return query.options(db.joinedload(getattr(Follow, attr)), db.noload(getattr(Follow, other)))
+
+
+def load_by_ids(query, ids):
+    """
+    用一条 IN 查询取出多行
+    :param query: Post / Comment / User 查询
+    :param ids: 主键列表
+    :return dict: {id: 对象}，不存在的 id 不在其中
+    """
+    if not ids:
+        return {}
+    model = query.column_descriptions[0]["entity"]
+    return {obj.id: obj for obj in query.filter(model.id.in_(set(ids)))}
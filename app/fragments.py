@@ -0,0 +1,36 @@
+from flask import current_app, render_template, request, Markup
+from flask_login import current_user
+from .cache import create_cache
+
+
+class FragmentCache(object):
+    """
+    单篇文章渲染结果的片段缓存，键为 文章 id + Post.version + 访问者相关的变体，
+    文章、评论数或作者资料变化时 Post.version 递增，旧片段不再命中，随后被淘汰
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["fragment_cache"] = create_cache(app.config["FLASKY_FRAGMENT_CACHE"],
+                                                        max_entries=app.config["FLASKY_FRAGMENT_CACHE_SIZE"],
+                                                        path=app.config["FLASKY_FRAGMENT_CACHE_PATH"],
+                                                        table="fragment_cache")
+        app.add_template_global(render_post)
+
+
+def render_post(post):
+    """
+    渲染 _post.html，优先使用缓存
+    :param post:
+    :return Markup:
+    """
+    can_edit = current_user == post.author or current_user.is_administrator()
+    key = "post:{}:{}:{}:{:d}".format(post.id, post.version, request.scheme, can_edit)
+    cache = current_app.extensions["fragment_cache"]
+    html = cache.get(key)
+    if html is None:
+        html = render_template("_post.html", post=post, can_edit=can_edit)
+        cache.set(key, html)
+    return Markup(html)
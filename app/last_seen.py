@@ -0,0 +1,123 @@
+"""
+    last_seen 的延迟写入：请求中只在内存里记下访问时间，由后台线程定期用一条 executemany 批量写入，
+    登录用户的请求不再各自提交一次事务
+"""
+import atexit
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+
+
+class LastSeenTracker(object):
+    """
+    同一用户在 FLASKY_LAST_SEEN_GRANULARITY 秒内的多次访问只记录一次；
+    记下的时间每隔 FLASKY_LAST_SEEN_FLUSH_INTERVAL 秒、或积累到 FLASKY_LAST_SEEN_MAX_PENDING 个用户时写入，
+    进程退出前再写入一次。FLASKY_LAST_SEEN_FLUSH_INTERVAL 为 None 时不启动后台线程，需调用 flush()
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["last_seen"] = LastSeenBuffer(app)
+
+    @staticmethod
+    def _buffer():
+        return current_app.extensions["last_seen"]
+
+    def touch(self, user):
+        """
+        记录用户的访问时间
+        :param user: 已登录的用户
+        """
+        self._buffer().touch(user)
+
+    def flush(self):
+        """
+        :return int: 写入的用户数
+        """
+        return self._buffer().flush()
+
+
+class LastSeenBuffer(object):
+    """
+    每个应用一个，保存尚未写入的 {用户 id: 访问时间}
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.granularity = timedelta(seconds=app.config["FLASKY_LAST_SEEN_GRANULARITY"])
+        self.interval = app.config["FLASKY_LAST_SEEN_FLUSH_INTERVAL"]
+        self.max_pending = app.config["FLASKY_LAST_SEEN_MAX_PENDING"]
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def touch(self, user):
+        now = datetime.utcnow()
+        with self.lock:
+            last_seen = self.pending.get(user.id) or user.last_seen
+            if last_seen is not None and now - last_seen < self.granularity:
+                return
+            self.pending[user.id] = now
+            full = len(self.pending) >= self.max_pending
+        # 本次请求中显示新的时间，但不把对象标记为已修改，提交时不会写入
+        set_committed_value(user, "last_seen", now)
+        self.start()
+        if full:
+            if self.thread is not None:
+                self.wakeup.set()
+            else:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        from . import db
+        from .models import User
+        table = User.__table__
+        # 只会把时间往后改，多个进程各自写入也不会互相覆盖
+        statement = table.update().\
+            where(db.and_(table.c.id == db.bindparam("user_id"),
+                          db.or_(table.c.last_seen.is_(None), table.c.last_seen < db.bindparam("seen")))).\
+            values(last_seen=db.bindparam("seen"))
+        try:
+            # 不推入新的应用上下文，弹出时会清理请求正在使用的 db.session
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(statement, [{"user_id": user_id, "seen": seen}
+                                               for user_id, seen in pending.items()])
+        except Exception:
+            # 写入失败时放回，下次再试
+            with self.lock:
+                for user_id, seen in pending.items():
+                    if self.pending.get(user_id, seen) <= seen:
+                        self.pending[user_id] = seen
+            raise
+        # 缓存中的用户还是旧的 last_seen
+        from . import user_cache
+        user_cache.invalidate([user_cache.user_key(user_id) for user_id in pending], app=self.app)
+        return len(pending)
+
+    def start(self):
+        if self.interval is None or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="last-seen-flusher", daemon=True)
+            self.thread.start()
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("failed to flush last_seen")
@@ -1,12 +1,17 @@
 from flask import render_template, session, request, url_for, redirect, \
-    current_app, flash, abort, make_response, Response
+    current_app, flash, abort, make_response, Response, jsonify
 from . import main
 from .forms import NameForm, EditProfileForm, EditProfileAdminForm, PostForm, CommentForm
 from .. import db
 from ..models import User, Permission, Post, Follow, Comment
 from ..email import send_mail
 from flask_login import login_required, current_user
-from ..decorators import admin_required, permission_required
+from ..decorators import admin_required, permission_required, primary_only
+from ..exceptions import ValidationError
+from ..pagination import KeysetPagination
+from ..feeds import load_posts, load_comments, load_follows
+from ..metrics import metrics
+from ..search import SearchResults
 from flask_sqlalchemy import get_debug_queries
 
 @main.route("/", methods=["GET", "POST"])
@@ -26,9 +31,7 @@ def index():
         query = current_user.followed_posts
     else:
         query = Post.query
-    page = request.args.get("page", 1, type=int)
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASK_POSTS_PER_PAGE"], error_out=False)
+    pagination = paginate_posts(query)
     posts = pagination.items
     return render_template("index.html", form=form, posts=posts,
                            show_followed=show_followed, pagination=pagination)
@@ -37,9 +40,7 @@ def index():
 @main.route("/user/<username>")
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get("page", 1, type=int)
-    pagination = Post.query.filter_by(author=user).order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config["FLASK_POSTS_PER_PAGE"], error_out=False)
+    pagination = paginate_posts(Post.query.filter_by(author_id=user.id))
     posts = pagination.items
     return render_template("user.html", user=user, posts=posts, pagination=pagination)
 
@@ -57,6 +58,17 @@ def for_admin_only():
     return "For administrators!"
 
 
+@main.route("/admin/metrics")
+@login_required
+@admin_required
+def metrics_view():
+    """
+    本进程的计数器，如缓存命中次数
+    :return:
+    """
+    return jsonify(metrics.snapshot())
+
+
 @main.route("/moderate")
 @login_required
 @permission_required(Permission.MODERATE)
@@ -111,7 +123,7 @@ def edit_profile_admin(id):
 
 @main.route("/post/<int:post_id>", methods=["GET", "POST"])
 def post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = load_posts(Post.query.filter_by(id=post_id)).first_or_404()
     form = CommentForm()
     if form.validate_on_submit():
         comment = Comment(body=form.body.data, post=post, author=current_user)
@@ -121,8 +133,9 @@ def post(post_id):
         return redirect(url_for("main.post", post_id=post.id, page=-1))
     page = request.args.get("page", default=1, type=int)
     if page == -1:
-        page = (post.comments.count() - 1) // current_app.config["FLASK_COMMENTS_PER_PAGE"] + 1
-    pagination = Comment.query.filter_by(post=post, disabled=False). \
+        page = (post.comment_count - 1) // current_app.config["FLASK_COMMENTS_PER_PAGE"] + 1
+    pagination = load_comments(Comment.query.filter_by(post_id=post.id, disabled=False)). \
+        order_by(Comment.timestamp). \
         paginate(page=page, per_page=current_app.config["FLASK_COMMENTS_PER_PAGE"], error_out=True)
     comments = pagination.items
     return render_template("post.html", posts=[post], comments=comments,
@@ -149,6 +162,7 @@ def edit(id):
 @main.route("/follow/<int:user_id>")
 @login_required
 @permission_required(Permission.FOLLOW)
+@primary_only
 def follow(user_id):
     user = User.query.get_or_404(user_id)
     if current_user != user and not current_user.is_following(user):
@@ -162,6 +176,7 @@ def follow(user_id):
 
 @main.route("/unfollow/<int:user_id>")
 @login_required
+@primary_only
 def unfollow(user_id):
     user = User.query.get_or_404(user_id)
     if current_user != user and current_user.is_following(user):
@@ -181,7 +196,7 @@ def followers(user_id):
         flash("Invalid user.")
         return redirect(url_for("main.index"))
     page = request.args.get("page", 1, type=int)
-    pagination = user.followers.order_by(Follow.timestamp.desc()).paginate(
+    pagination = load_follows(user.followers, "follower").order_by(Follow.timestamp.desc()).paginate(
         page, per_page=current_app.config["FLASK_FOLLOWERS_PER_PAGE"], error_out=False)
     follows = [{"user": item.follower, "timestamp": item.timestamp} for item in pagination.items]
     return render_template("followers.html", user=user, title="Followers of", follows=follows,
@@ -195,7 +210,7 @@ def followed_by(user_id):
         flash("Invalid user.")
         return redirect(url_for("main.index"))
     page = request.args.get("page", 1, type=int)
-    pagination = user.followed.order_by(Follow.timestamp.desc()).paginate(
+    pagination = load_follows(user.followed, "followed").order_by(Follow.timestamp.desc()).paginate(
         page, per_page=current_app.config["FLASK_FOLLOWERS_PER_PAGE"], error_out=False)
     follows = [{"user": item.followed, "timestamp": item.timestamp} for item in pagination.items]
     return render_template("followers.html", user=user, title="Followed by", follows=follows,
@@ -220,6 +235,7 @@ def followed_posts():
 
 @main.route("/moderate_comments")
 @permission_required(Permission.MODERATE)
+@primary_only
 def moderate_comments():
     comment_id = request.args.get("comment_id", -1, type=int)
     comment_disable = request.args.get("comment_disable", type=bool)
@@ -234,7 +250,7 @@ def moderate_comments():
         else:
             flash("comment has enabled")
     page = request.args.get("page", 1)
-    pagination = Comment.query.order_by(Comment.timestamp).paginate(
+    pagination = load_comments(Comment.query).order_by(Comment.timestamp).paginate(
         page=page, per_page=current_app.config["FLASK_COMMENTS_PER_PAGE"],
         error_out=True, max_per_page=None)
     comments = pagination.items
@@ -242,6 +258,34 @@ def moderate_comments():
                            pagination=pagination, moderate=True)
 
 
+@main.route("/search")
+def search():
+    """
+        按相关度分页显示正文包含全部搜索词的文章和评论
+    :return:
+    """
+    q = request.args.get("q", "").strip()
+    try:
+        results = SearchResults(q, current_app.config["FLASK_SEARCH_RESULTS_PER_PAGE"],
+                                cursor=request.args.get("cursor"))
+    except ValidationError:
+        abort(400)
+    return render_template("search.html", q=q, results=results)
+
+
+def paginate_posts(query):
+    """
+        按 (timestamp, id) 游标分页，游标取自请求参数 cursor
+    :param query:
+    :return KeysetPagination:
+    """
+    try:
+        return KeysetPagination(load_posts(query), current_app.config["FLASK_POSTS_PER_PAGE"],
+                                cursor=request.args.get("cursor"))
+    except ValidationError:
+        abort(400)
+
+
 def get_previous_page():
     """
         获取当前请求的前一个页面
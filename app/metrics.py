@@ -0,0 +1,42 @@
+"""
+    进程内的计数器，如各缓存的命中、未命中次数；管理员可访问 /admin/metrics 查看
+"""
+import threading
+
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def incr(self, name, value=1):
+        """
+        :param name: 计数器名称，如 "user_cache.hit"
+        :param value: 增加的数量
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        记下当前值而不是累加，如队列长度
+        """
+        with self._lock:
+            self._counters[name] = value
+
+    def get(self, name):
+        return self._counters.get(name, 0)
+
+    def snapshot(self):
+        """
+        :return dict: 当前全部计数器的副本
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = Metrics()
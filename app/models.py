@@ -1,5 +1,5 @@
-from . import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from . import db, page_cache, user_cache, render_pool, mail_queue
+from werkzeug.security import check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 from . import login_manager
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
@@ -7,9 +7,9 @@ import itsdangerous.exc
 from flask import current_app, g, request, url_for
 from datetime import datetime
 import hashlib
-from markdown import markdown
-import bleach
 from .exceptions import ValidationError
+from .rendering import render_markdown, render_many
+from .passwords import hash_password, needs_rehash
 
 
 @login_manager.user_loader
@@ -19,7 +19,7 @@ def load_user(user_id):
     :param user_id:
     :return User():
     """
-    return User.query.get(int(user_id))
+    return user_cache.get_user(int(user_id))
 
 
 class Role(db.Model):
@@ -51,6 +51,20 @@ class Role(db.Model):
     def has_permission(self, perm):
         return (self.permissions & perm) == perm
 
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        """
+        令牌中带有角色的权限，权限修改后该角色所有用户的旧令牌作废，并从用户缓存中删除这些用户
+        """
+        if not db.inspect(target).attrs.permissions.history.has_changes():
+            return
+        users = User.__table__
+        ids = [id for id, in connection.execute(db.select([users.c.id]).where(users.c.role_id == target.id))]
+        connection.execute(users.update().where(users.c.role_id == target.id).
+                           values(token_generation=db.func.coalesce(users.c.token_generation, 0) + 1))
+        session = db.inspect(target).session
+        session.info.setdefault("user_cache_stale", set()).update(user_cache.user_key(id) for id in ids)
+
     @staticmethod
     def insert_roles():
         roles = {
@@ -75,6 +89,9 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = "follows"
+    # 关注者、被关注者列表按关注时间排序
+    __table_args__ = (db.Index("ix_follows_followed_id_timestamp", "followed_id", "timestamp"),
+                      db.Index("ix_follows_follower_id_timestamp", "follower_id", "timestamp"))
     follower_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow())
@@ -97,6 +114,10 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)  # 注册日期
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)  # 最后登陆日期
     avatar_hash = db.Column(db.String(32))
+    post_count = db.Column(db.Integer, default=0)  # 发布的文章数
+    follower_count = db.Column(db.Integer, default=0)  # 关注者数量
+    followed_count = db.Column(db.Integer, default=0)  # 关注的用户数量
+    token_generation = db.Column(db.Integer, default=0)  # 加 1 后之前签发的 API 令牌全部失效
     posts = db.relationship("Post", backref="author", lazy="dynamic")
     followed = db.relationship("Follow",
                                foreign_keys=[Follow.follower_id],
@@ -109,6 +130,7 @@ class User(UserMixin, db.Model):
                                 lazy="dynamic",
                                 cascade="all, delete-orphan")
     comments = db.relationship("Comment", backref="author", lazy="dynamic")
+    public_attrs = ("username", "avatar_hash", "name", "location", "about_me", "member_since")
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -129,10 +151,22 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
+        self.revoke_auth_tokens()
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """
+        密码正确且散列不符合当前配置时重新计算散列，只加入会话，由调用者提交
+        :param password:
+        :return bool:
+        """
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if self.id is not None and needs_rehash(self.password_hash):
+            # 按当前配置重新计算散列，密码没有变化，令牌不作废
+            self.password_hash = hash_password(password)
+            db.session.add(self)
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config["SECRET_KEY"], expires_in=expiration)
@@ -202,7 +236,10 @@ class User(UserMixin, db.Model):
         return True
 
     def can(self, perm):
-        return self.role is not None and self.role.has_permission(perm)
+        if "role" in db.inspect(self).dict or self.role_id is None:
+            # 角色已经加载，或者是尚未写入数据库的新用户
+            return self.role is not None and self.role.has_permission(perm)
+        return (user_cache.role_permissions(self.role_id) & perm) == perm
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
@@ -248,23 +285,63 @@ class User(UserMixin, db.Model):
         if f:
             db.session.delete(f)
 
+    def fanout_on_read_followed(self):
+        """
+        关注的用户中，关注者数量超过阈值、发布文章时不做写扩散的用户
+        :return query: 用户 id
+        """
+        limit = current_app.config["FLASKY_FANOUT_MAX_FOLLOWERS"]
+        return db.session.query(Follow.followed_id).join(User, User.id == Follow.followed_id).\
+            filter(Follow.follower_id == self.id, User.follower_count > limit)
+
     @property
     def followed_posts(self):
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id).\
-            filter(Follow.follower_id == self.id)
+        """
+        关注用户的文章：读取物化的时间线，关注者过多的用户在读取时合并（读扩散）
+        :return query:
+        """
+        pulled = [row[0] for row in self.fanout_on_read_followed()]
+        if not pulled:
+            return Post.query.join(Timeline, Timeline.post_id == Post.id).\
+                filter(Timeline.user_id == self.id)
+        fanned_out = db.session.query(Timeline.post_id).filter(Timeline.user_id == self.id)
+        return Post.query.filter(db.or_(Post.id.in_(fanned_out), Post.author_id.in_(pulled)))
 
     def generate_auth_token(self, expiration=600):
+        """
+        令牌中带有用户 id、角色权限、是否已确认和令牌代数，校验时不必查询用户和角色
+        :param expiration:
+        :return str:
+        """
         s = Serializer(current_app.config["SECRET_KEY"], expires_in=expiration)
-        return s.dumps({"id": self.id}).decode()
+        return s.dumps({"id": self.id,
+                        "permissions": self.role.permissions if self.role is not None else 0,
+                        "confirmed": bool(self.confirmed),
+                        "generation": self.token_generation or 0}).decode()
+
+    def revoke_auth_tokens(self):
+        """
+        使之前签发的 API 令牌全部失效
+        """
+        self.token_generation = (self.token_generation or 0) + 1
 
     @staticmethod
     def verify_auth_token(token):
+        """
+        :param token:
+        :return TokenUser: 令牌无效、过期或已被撤销时为 None
+        """
         s = Serializer(current_app.config["SECRET_KEY"])
         try:
             data = s.loads(token)
         except:
             return None
-        return User.query.get(data["id"])
+        if "generation" not in data:
+            # 旧格式的令牌只有用户 id
+            return user_cache.get_user(data["id"])
+        if user_cache.token_generation(data["id"]) != data["generation"]:
+            return None
+        return TokenUser(data["id"], data["permissions"], data["confirmed"])
 
     def to_json(self):
         json_user = {
@@ -274,10 +351,80 @@ class User(UserMixin, db.Model):
             "last_seen": self.last_seen,
             "posts_url": url_for("api.get_user_posts", id=self.id),
             "followed_posts_url": url_for("api.get_user_followed_posts", id=self.id),
-            "post_count": self.posts.count()
+            "post_count": self.post_count
         }
         return json_user
 
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target):
+        increase_counter(connection, User.follower_count, target.followed_id, 1)
+        increase_counter(connection, User.followed_count, target.follower_id, 1)
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target):
+        increase_counter(connection, User.follower_count, target.followed_id, -1)
+        increase_counter(connection, User.followed_count, target.follower_id, -1)
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target):
+        increase_counter(connection, User.post_count, target.author_id, 1)
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target):
+        increase_counter(connection, User.post_count, target.author_id, -1)
+
+    @staticmethod
+    def on_post_updated(mapper, connection, target):
+        history = db.inspect(target).attrs.author_id.history
+        if history.has_changes():
+            for author_id in history.deleted:
+                increase_counter(connection, User.post_count, author_id, -1)
+            for author_id in history.added:
+                increase_counter(connection, User.post_count, author_id, 1)
+
+    def profile_changed(self):
+        """
+        页面上公开显示的资料是否有改动（last_seen 除外）
+        """
+        state = db.inspect(self)
+        return any(getattr(state.attrs, key).history.has_changes() for key in self.public_attrs)
+
+    @staticmethod
+    def on_updating(mapper, connection, target):
+        """
+        令牌中带有角色的权限和是否已确认，换了角色或变为未确认（如修改邮箱）后旧令牌作废
+        """
+        state = db.inspect(target)
+        if state.attrs.role_id.history.has_changes() or state.attrs.role.history.has_changes():
+            target.revoke_auth_tokens()
+        elif state.attrs.confirmed.history.has_changes() and not target.confirmed:
+            target.revoke_auth_tokens()
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        """
+        文章里显示的用户名、头像变化时，该用户所有文章的版本号加 1
+        """
+        state = db.inspect(target)
+        if state.attrs.username.history.has_changes() or state.attrs.avatar_hash.history.has_changes():
+            connection.execute(Post.__table__.update().where(Post.author_id == target.id).
+                               values(version=Post.version + 1))
+
+    @staticmethod
+    def repair_counters(batch_size=1000):
+        """
+        按 id 分批重新统计文章数、关注者数和关注数，每批一个事务
+        :param batch_size:
+        :return int: 处理的用户数
+        """
+        counters = {
+            "post_count": db.select([db.func.count()]).where(Post.author_id == User.id),
+            "follower_count": db.select([db.func.count()]).where(Follow.followed_id == User.id),
+            "followed_count": db.select([db.func.count()]).where(Follow.follower_id == User.id),
+        }
+        values = {key: query.as_scalar() for key, query in counters.items()}
+        return repair_in_batches(User, values, batch_size)
+
 
 class AnonymousUser(AnonymousUserMixin):
     def can(self, perm):
@@ -290,6 +437,33 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class TokenUser(object):
+    """
+    API 令牌中携带的用户身份和权限，鉴权时不需要加载 User；
+    权限是签发令牌时的快照，用户的角色、角色的权限变化或用户变为未确认后旧令牌失效
+    （见 User.on_updating、Role.on_updated）
+    """
+    is_anonymous = False
+
+    def __init__(self, id, permissions, confirmed):
+        self.id = id
+        self.permissions = permissions
+        self.confirmed = confirmed
+
+    def can(self, perm):
+        return (self.permissions & perm) == perm
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN)
+
+    @property
+    def user(self):
+        """
+        需要完整的用户对象时再加载
+        """
+        return user_cache.get_user(self.id)
+
+
 class Permission:
     FOLLOW = 1  # 关注用户
     COMMENT = 2  # 在他人文章评论
@@ -300,20 +474,22 @@ class Permission:
 
 class Post(db.Model):
     __tablename__ = "posts"
+    # 用户页按作者筛选、按时间排序；SQLite 的索引隐含 id，可直接按 (timestamp, id) 游标翻页
+    __table_args__ = (db.Index("ix_posts_author_id_timestamp", "author_id", "timestamp"),)
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow())
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    # active_history: 修改前先加载旧值，供计数器事件计算差值
+    author_id = db.column_property(db.Column(db.Integer, db.ForeignKey("users.id")), active_history=True)
     body_html = db.Column(db.Text)
+    comment_count = db.Column(db.Integer, default=0)  # 未被屏蔽的评论数
+    version = db.Column(db.Integer, default=0)  # 页面上显示的内容每变化一次加 1，用作缓存键
+    render_pending = db.Column(db.Boolean, default=False)  # body_html 尚未按最新的 body 渲染（后台渲染模式）
     comments = db.relationship("Comment", backref="post", lazy="dynamic", order_by="Comment.timestamp")
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code",
-                        "em", "i", "li", "ol", "pre", "strong", "ul", "h1",
-                        "h2", "h3", "p"]
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format="html"),
-                                                       tags=allowed_tags, strip=True))
+        set_body_html(target, value)
 
     def to_json(self):
         json_post = {
@@ -323,34 +499,114 @@ class Post(db.Model):
             "timestamp": self.timestamp,
             "author_url": url_for("api.get_user", id=self.author_id),
             "comments_url": url_for("api.get_posts_comments", id=self.id),
-            "comment_count": self.comments.count()
+            "comment_count": self.comment_count
         }
         return json_post
 
     @staticmethod
-    def from_json(json_post):
+    def on_comment_inserted(mapper, connection, target):
+        if not target.disabled:
+            increase_counter(connection, Post.comment_count, target.post_id, 1, version=Post.version + 1)
+
+    @staticmethod
+    def on_comment_deleted(mapper, connection, target):
+        if not target.disabled:
+            increase_counter(connection, Post.comment_count, target.post_id, -1, version=Post.version + 1)
+
+    @staticmethod
+    def on_comment_updated(mapper, connection, target):
+        """
+        评论被屏蔽/恢复或移动到其他文章时，调整相关文章的评论数
+        """
+        state = db.inspect(target)
+        disabled = state.attrs.disabled.history
+        post_id = state.attrs.post_id.history
+        if not disabled.has_changes() and not post_id.has_changes():
+            return
+        old_disabled = disabled.deleted[0] if disabled.deleted else target.disabled
+        old_post_id = post_id.deleted[0] if post_id.deleted else target.post_id
+        if not old_disabled:
+            increase_counter(connection, Post.comment_count, old_post_id, -1, version=Post.version + 1)
+        if not target.disabled:
+            increase_counter(connection, Post.comment_count, target.post_id, 1, version=Post.version + 1)
+
+    @staticmethod
+    def repair_counters(batch_size=1000):
+        """
+        按 id 分批重新统计每篇文章未被屏蔽的评论数，每批一个事务
+        :param batch_size:
+        :return int: 处理的文章数
+        """
+        enabled = db.or_(Comment.disabled == False, Comment.disabled.is_(None))
+        comment_count = db.select([db.func.count()]).\
+            where(db.and_(Comment.post_id == Post.id, enabled)).as_scalar()
+        return repair_in_batches(Post, {"comment_count": comment_count}, batch_size)
+
+    @staticmethod
+    def body_from_json(json_post):
+        """
+        校验并取出 JSON 中的正文
+        :param json_post:
+        :return str:
+        """
         body = json_post.get("body")
-        if body is None or body == "":
+        if not isinstance(body, str) or body == "":
             raise ValidationError("post does not have a body")
-        return Post(body=body)
+        return body
+
+    @staticmethod
+    def from_json(json_post):
+        return Post(body=Post.body_from_json(json_post))
+
+    @staticmethod
+    def bulk_insert(author_id, bodies):
+        """
+        一次插入多篇文章（见 insert_rows），并完成 ORM 事件中的作者计数和时间线写扩散，
+        事务由调用者提交
+        :param author_id:
+        :param bodies: 已校验的正文列表
+        :return list: 新文章的 id，与 bodies 顺序一致
+        """
+        if not bodies:
+            return []
+        connection = db.session.connection()
+        # 先更新计数，SQLite 上由此取得写锁，insert_rows 才能安全地分配 id
+        increase_counter(connection, User.post_count, author_id, len(bodies))
+        ids = insert_rows(connection, Post.__table__, [
+            {"body": body, "body_html": body_html, "author_id": author_id,
+             "comment_count": 0, "version": 1, "render_pending": body_html is None}
+            for body, body_html in zip(bodies, bulk_body_html(bodies))])
+        queue_render(Post.__table__, ids, bodies)
+        if Timeline.fanout_on_write(connection, author_id):
+            rows = db.select([Follow.follower_id, Post.id]).\
+                where(db.and_(Follow.followed_id == author_id, Post.id.in_(ids)))
+            connection.execute(Timeline.__table__.insert().from_select(["user_id", "post_id"], rows))
+        db.session.info["page_cache_stale"] = True
+        return ids
 
 class Comment(db.Model):
     __tablename__ = "comments"
+    # 文章页只显示未屏蔽的评论；管理页和 API 按时间排序全部评论
+    __table_args__ = (db.Index("ix_comments_post_id_disabled_timestamp", "post_id", "disabled", "timestamp"),
+                      db.Index("ix_comments_timestamp", "timestamp"))
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow())
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
-    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
-    disabled = db.Column(db.Boolean, default=False)
+    post_id = db.column_property(db.Column(db.Integer, db.ForeignKey("posts.id")), active_history=True)
+    disabled = db.column_property(db.Column(db.Boolean, default=False), active_history=True)
+    version = db.Column(db.Integer, default=0)  # 内容或屏蔽状态每变化一次加 1，用于 ETag
+    render_pending = db.Column(db.Boolean, default=False)  # body_html 尚未按最新的 body 渲染（后台渲染模式）
 
     @staticmethod
     def on_change_body(target, value, oldvalue, initiator):
-        allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code",
-                        "em", "i", "li", "ol", "pre", "strong", "ul", "h1",
-                        "h2", "h3", "p"]
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format="html"),
-                                                       tags=allowed_tags, strip=True))
+        set_body_html(target, value)
+
+    @staticmethod
+    def on_changed_disabled(target, value, oldvalue, initiator):
+        if value != oldvalue:
+            target.version = (target.version or 0) + 1
 
     def to_json(self):
         json_comment = {
@@ -364,14 +620,336 @@ class Comment(db.Model):
         return json_comment
 
     @staticmethod
-    def from_json(json_comment):
+    def body_from_json(json_comment):
+        """
+        校验并取出 JSON 中的正文
+        :param json_comment:
+        :return str:
+        """
         body = json_comment.get("body")
-        if body is None or body == "":
+        if not isinstance(body, str) or body == "":
             raise ValidationError("comment does not have body")
-        return Comment(body=body)
+        return body
+
+    @staticmethod
+    def from_json(json_comment):
+        return Comment(body=Comment.body_from_json(json_comment))
+
+    @staticmethod
+    def bulk_insert(author_id, items):
+        """
+        一次插入多条评论（见 insert_rows），并更新每篇文章的评论数和版本号，事务由调用者提交
+        :param author_id:
+        :param items: 已校验的 (文章 id, 正文) 列表，文章必须存在
+        :return list: 新评论的 id，与 items 顺序一致
+        """
+        if not items:
+            return []
+        connection = db.session.connection()
+        counts = {}
+        for post_id, body in items:
+            counts[post_id] = counts.get(post_id, 0) + 1
+        # 先更新计数，SQLite 上由此取得写锁，insert_rows 才能安全地分配 id
+        for post_id, count in sorted(counts.items()):
+            increase_counter(connection, Post.comment_count, post_id, count, version=Post.version + 1)
+        bodies = [body for post_id, body in items]
+        ids = insert_rows(connection, Comment.__table__, [
+            {"body": body, "body_html": body_html, "author_id": author_id, "post_id": post_id,
+             "disabled": False, "version": 1, "render_pending": body_html is None}
+            for (post_id, body), body_html in zip(items, bulk_body_html(bodies))])
+        queue_render(Comment.__table__, ids, bodies)
+        db.session.info["page_cache_stale"] = True
+        return ids
+
+
+def set_body_html(target, value):
+    """
+    正文修改时渲染 body_html；后台渲染模式下先清空，事务提交后交给 render_pool
+    """
+    if render_pool.enabled():
+        target.body_html = None
+        target.render_pending = True
+    else:
+        target.body_html = render_markdown(value)
+        target.render_pending = False
+    target.version = (target.version or 0) + 1
+
+
+def bulk_body_html(bodies):
+    """
+    批量插入时的 body_html；后台渲染模式下全部为 None，插入后由 queue_render 交给 render_pool
+    """
+    if render_pool.enabled():
+        return [None] * len(bodies)
+    return render_many(bodies)
+
+
+def queue_render(table, ids, bodies):
+    """
+    后台渲染模式下记下批量插入的行，事务提交后交给 render_pool
+    """
+    if render_pool.enabled():
+        db.session.info.setdefault("render_queue", {}).setdefault(table, {}).update(zip(ids, bodies))
+
+
+def insert_rows(connection, table, rows):
+    """
+    批量插入并返回新行的主键，顺序与 rows 一致：
+    支持 RETURNING 的数据库用一条多行 INSERT ... RETURNING，由数据库分配主键；
+    SQLite 整个数据库同时只有一个写事务，调用者须已在本事务中执行过写入语句（如更新计数）取得写锁，
+    这里按 max(id) + 1 分配主键后 executemany，主键列不是 AUTOINCREMENT，不存在被跳过的序列；
+    其他数据库逐行插入
+    :param connection: 当前事务的连接
+    :param table: posts 或 comments 表
+    :param rows: 不含主键的各行
+    :return list:
+    """
+    dialect = connection.dialect
+    if dialect.implicit_returning:
+        result = connection.execute(table.insert().values(rows).returning(table.c.id))
+        return [row[0] for row in result]
+    if dialect.name == "sqlite":
+        first_id = (connection.execute(db.select([db.func.max(table.c.id)])).scalar() or 0) + 1
+        ids = list(range(first_id, first_id + len(rows)))
+        connection.execute(table.insert(), [dict(row, id=id) for id, row in zip(ids, rows)])
+        return ids
+    return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def increase_counter(connection, column, id, delta, **values):
+    """
+    在 flush 所用的连接上原子地增减计数列
+    :param connection:
+    :param column: 计数列，如 Post.comment_count
+    :param id: 所在行的主键
+    :param delta:
+    :param values: 同一条 UPDATE 里一并修改的其他列
+    """
+    if id is None:
+        return
+    table = column.class_.__table__
+    values[column.key] = db.func.coalesce(column, 0) + delta
+    connection.execute(table.update().where(table.c.id == id).values(values))
+
+
+def repair_in_batches(model, values, batch_size):
+    """
+    按主键区间分批执行 UPDATE ... SET 计数列 = (子查询)，每批提交一次
+    :return int: 处理的行数
+    """
+    table = model.__table__
+    max_id = db.session.query(db.func.max(model.id)).scalar() or 0
+    total = 0
+    for low in range(0, max_id, batch_size):
+        result = db.session.execute(table.update().
+                                    where(db.and_(model.id > low, model.id <= low + batch_size)).
+                                    values(values))
+        db.session.commit()
+        total += result.rowcount
+    return total
+
+
+class Timeline(db.Model):
+    """
+    物化的关注者时间线（写扩散）：文章发布时为作者的每个关注者写入一行，
+    User.followed_posts 只需按 user_id 做一次索引范围扫描
+    """
+    __tablename__ = "timelines"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+
+    def __repr__(self):
+        return "<Timeline user:{} post:{}>".format(self.user_id, self.post_id)
+
+    @staticmethod
+    def fanout_on_write(connection, user_id):
+        """
+        关注者数量不超过阈值的用户，发布文章时写扩散；否则由关注者在读取时合并
+        """
+        follower_count = connection.execute(
+            db.select([User.follower_count]).where(User.id == user_id)).scalar()
+        return (follower_count or 0) <= current_app.config["FLASKY_FANOUT_MAX_FOLLOWERS"]
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target):
+        if target.author_id is None or not Timeline.fanout_on_write(connection, target.author_id):
+            return
+        followers = db.select([Follow.follower_id, db.literal(target.id)]).\
+            where(Follow.followed_id == target.author_id)
+        connection.execute(Timeline.__table__.insert().from_select(["user_id", "post_id"], followers))
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target):
+        connection.execute(Timeline.__table__.delete().where(Timeline.post_id == target.id))
+
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target):
+        if not Timeline.fanout_on_write(connection, target.followed_id):
+            return
+        exists = db.select([Timeline.post_id]).where(db.and_(Timeline.user_id == target.follower_id,
+                                                            Timeline.post_id == Post.id))
+        posts = db.select([db.literal(target.follower_id), Post.id]).\
+            where(db.and_(Post.author_id == target.followed_id, ~db.exists(exists)))
+        connection.execute(Timeline.__table__.insert().from_select(["user_id", "post_id"], posts))
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target):
+        posts = db.select([Post.id]).where(Post.author_id == target.followed_id)
+        connection.execute(Timeline.__table__.delete().where(
+            db.and_(Timeline.user_id == target.follower_id, Timeline.post_id.in_(posts))))
+        # 计数已由 User.on_follow_deleted 减一，恰好等于阈值说明刚从读扩散变回写扩散
+        follower_count = connection.execute(
+            db.select([User.follower_count]).where(User.id == target.followed_id)).scalar()
+        if follower_count == current_app.config["FLASKY_FANOUT_MAX_FOLLOWERS"]:
+            Timeline.fanout_author(connection, target.followed_id)
+
+    @staticmethod
+    def fanout_author(connection, author_id):
+        """
+        关注者降到阈值以内的用户不再在读取时合并，把关注者超过阈值期间发布、没有写扩散的文章
+        补写进各关注者的时间线
+        """
+        exists = db.select([Timeline.post_id]).where(db.and_(Timeline.user_id == Follow.follower_id,
+                                                            Timeline.post_id == Post.id))
+        rows = db.select([Follow.follower_id, Post.id]).\
+            select_from(Follow.__table__.join(Post.__table__, Post.author_id == Follow.followed_id)).\
+            where(db.and_(Follow.followed_id == author_id, ~db.exists(exists)))
+        connection.execute(Timeline.__table__.insert().from_select(["user_id", "post_id"], rows))
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """
+        按关注者 id 分批重建全部时间线，每批一个事务
+        :param batch_size: 每批处理的关注者数量
+        :return int: 写入的行数
+        """
+        limit = current_app.config["FLASKY_FANOUT_MAX_FOLLOWERS"]
+        pulled = db.select([User.id]).where(User.follower_count > limit)
+        db.session.execute(Timeline.__table__.delete())
+        db.session.commit()
+        total = 0
+        last_id = 0
+        while True:
+            follower_ids = [row[0] for row in db.session.query(Follow.follower_id).distinct().
+                            filter(Follow.follower_id > last_id).
+                            order_by(Follow.follower_id).limit(batch_size)]
+            if not follower_ids:
+                break
+            rows = db.select([Follow.follower_id, Post.id]).\
+                select_from(Follow.__table__.join(Post.__table__, Post.author_id == Follow.followed_id)).\
+                where(db.and_(Follow.follower_id >= follower_ids[0],
+                              Follow.follower_id <= follower_ids[-1],
+                              Follow.followed_id.notin_(pulled)))
+            result = db.session.execute(Timeline.__table__.insert().from_select(["user_id", "post_id"], rows))
+            db.session.commit()
+            total += result.rowcount
+            last_id = follower_ids[-1]
+        return total
+
+
+class OutboxMessage(db.Model):
+    """
+    待发送的邮件，与引起它的修改写在同一个事务中，进程退出也不会丢失；
+    由 app.email.dispatch_outbox 分批发送，失败后按指数退避重试。
+    next_attempt_at 为 None 表示已发送或已放弃
+    """
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    dedup_key = db.Column(db.String(128), index=True)
+    recipient = db.Column(db.String(128), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), index=True)
+    attempts = db.Column(db.Integer, default=0)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return "<OutboxMessage {} to:{}>".format(self.id, self.recipient)
+
+    @staticmethod
+    def enqueue(recipient, subject, body, html, dedup_key=None):
+        """
+        加入当前会话，随调用方的事务一起提交；同一 dedup_key 还有未发送的邮件时只更新其内容，
+        重复点击“重新发送”不会发出多封
+        :return OutboxMessage:
+        """
+        message = None
+        if dedup_key is not None:
+            message = OutboxMessage.query.filter(OutboxMessage.dedup_key == dedup_key,
+                                                 OutboxMessage.sent_at.is_(None),
+                                                 OutboxMessage.next_attempt_at.isnot(None)).first()
+        if message is None:
+            message = OutboxMessage(dedup_key=dedup_key, attempts=0)
+        message.recipient = recipient
+        message.subject = subject
+        message.body = body
+        message.html = html
+        db.session.add(message)
+        return message
+
+
+def on_session_flushed(session, flush_context):
+    """
+    文章、评论、关注关系或用户公开资料有变化时做标记，事务提交后使整页缓存失效；
+    记下修改或删除的用户、角色，事务提交后从用户缓存中删除
+    """
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Post, Comment, Follow)) or isinstance(obj, User) and obj.profile_changed():
+            session.info["page_cache_stale"] = True
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, OutboxMessage):
+            session.info["outbox_pending"] = True
+        if isinstance(obj, (Post, Comment)) and obj.render_pending:
+            queue = session.info.setdefault("render_queue", {}).setdefault(obj.__table__, {})
+            queue[obj.id] = obj.body
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault("user_cache_stale", set()).add(user_cache.user_key(obj.id))
+        elif isinstance(obj, Role):
+            session.info.setdefault("user_cache_stale", set()).add(user_cache.role_key(obj.id))
+
+
+def on_session_committed(session):
+    if session.info.pop("page_cache_stale", False):
+        page_cache.invalidate()
+    user_cache.invalidate(session.info.pop("user_cache_stale", ()))
+    for table, rows in session.info.pop("render_queue", {}).items():
+        render_pool.submit(table, list(rows.items()))
+    if session.info.pop("outbox_pending", False):
+        mail_queue.dispatch_outbox()
+
+
+def on_session_rolled_back(session):
+    session.info.pop("page_cache_stale", None)
+    session.info.pop("user_cache_stale", None)
+    session.info.pop("render_queue", None)
+    session.info.pop("outbox_pending", None)
 
 
 db.event.listen(Post.body, "set", Post.on_changed_body)
 db.event.listen(Comment.body, "set", Comment.on_change_body)
+db.event.listen(Comment.disabled, "set", Comment.on_changed_disabled)
+db.event.listen(Post, "after_insert", User.on_post_inserted)
+db.event.listen(Post, "after_delete", User.on_post_deleted)
+db.event.listen(Post, "after_update", User.on_post_updated)
+db.event.listen(Follow, "after_insert", User.on_follow_inserted)
+db.event.listen(Follow, "after_delete", User.on_follow_deleted)
+db.event.listen(Comment, "after_insert", Post.on_comment_inserted)
+db.event.listen(Comment, "after_delete", Post.on_comment_deleted)
+db.event.listen(Comment, "after_update", Post.on_comment_updated)
+db.event.listen(Role, "after_update", Role.on_updated)
+db.event.listen(User, "before_update", User.on_updating)
+db.event.listen(User, "after_update", User.on_updated)
+db.event.listen(db.session, "after_flush", on_session_flushed)
+db.event.listen(db.session, "after_commit", on_session_committed)
+db.event.listen(db.session, "after_rollback", on_session_rolled_back)
+db.event.listen(Post, "after_insert", Timeline.on_post_inserted)
+db.event.listen(Post, "after_delete", Timeline.on_post_deleted)
+db.event.listen(Follow, "after_insert", Timeline.on_follow_inserted)
+db.event.listen(Follow, "after_delete", Timeline.on_follow_deleted)
 
 
@@ -0,0 +1,115 @@
+import hashlib
+import uuid
+from datetime import datetime
+from flask import current_app, request, session, g, make_response
+from flask_login import current_user
+from .cache import create_cache
+
+
+class PageCache(object):
+    """
+    匿名访问者的整页缓存（需在配置中开启 FLASKY_PAGE_CACHE）
+
+    缓存内容按 代际(generation) + 完整路径 存放，文章、评论、关注关系或用户公开资料
+    变化后提交事务时换一个新代际，旧页面全部失效。ETag 由代际和路径算出，
+    Last-Modified 为最近一次内容变化的时间，条件请求无需渲染即可返回 304。
+    代际单独存放，不会因页面条目超过上限被淘汰
+    """
+    generation_key = "page:generation"
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["page_cache"] = create_cache(app.config["FLASKY_PAGE_CACHE_BACKEND"],
+                                                    max_entries=app.config["FLASKY_PAGE_CACHE_SIZE"],
+                                                    path=app.config["FLASKY_PAGE_CACHE_PATH"],
+                                                    table="page_cache")
+        app.extensions["page_cache_generation"] = create_cache(app.config["FLASKY_PAGE_CACHE_BACKEND"], max_entries=1,
+                                                               path=app.config["FLASKY_PAGE_CACHE_PATH"],
+                                                               table="page_generation")
+        app.before_request(self.serve)
+        app.after_request(self.store)
+
+    @staticmethod
+    def _cache(app=None):
+        return (app or current_app).extensions["page_cache"]
+
+    @staticmethod
+    def _generations(app=None):
+        return (app or current_app).extensions["page_cache_generation"]
+
+    def generation(self):
+        """
+        :return (代际, 最后修改时间):
+        """
+        cache = self._generations()
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # 首次使用时以最新文章/评论的时间作为最后修改时间
+            from . import db
+            from .models import Post, Comment
+            newest = [db.session.query(db.func.max(Post.timestamp)).scalar(),
+                      db.session.query(db.func.max(Comment.timestamp)).scalar()]
+            newest = [t for t in newest if t is not None]
+            generation = (uuid.uuid4().hex, max(newest) if newest else datetime.utcnow())
+            cache.set(self.generation_key, generation)
+        return generation
+
+    def invalidate(self, app=None):
+        """
+        内容变化后调用，之后所有页面都会重新渲染
+        :param app: 在没有应用上下文的线程中调用时传入
+        """
+        if not (app or current_app).config["FLASKY_PAGE_CACHE"]:
+            return
+        self._generations(app).set(self.generation_key, (uuid.uuid4().hex, datetime.utcnow()))
+
+    @staticmethod
+    def cacheable():
+        return current_app.config["FLASKY_PAGE_CACHE"] \
+            and request.method in ("GET", "HEAD") \
+            and request.endpoint in current_app.config["FLASKY_PAGE_CACHE_ENDPOINTS"] \
+            and not current_user.is_authenticated \
+            and not session.get("_flashes")
+
+    def serve(self):
+        if not self.cacheable():
+            return None
+        generation, last_modified = self.generation()
+        key = "page:{}:{}".format(generation, request.full_path)
+        etag = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None \
+                and request.if_modified_since >= last_modified.replace(microsecond=0)
+        if not_modified:
+            response = make_response("", 304)
+        else:
+            cached = self._cache().get(key)
+            if cached is None:
+                g.page_cache = (key, etag, last_modified)  # 视图渲染后由 store 存入缓存
+                return None
+            body, content_type = cached
+            response = make_response(body, 200, {"Content-Type": content_type})
+        return self._add_validators(response, etag, last_modified)
+
+    def store(self, response):
+        page_cache = g.pop("page_cache", None)
+        if page_cache is None or response.status_code != 200 \
+                or session.modified or response.direct_passthrough:
+            return response
+        key, etag, last_modified = page_cache
+        self._cache().set(key, (response.get_data(), response.headers["Content-Type"]),
+                          timeout=current_app.config["FLASKY_PAGE_CACHE_TIMEOUT"])
+        return self._add_validators(response, etag, last_modified)
+
+    @staticmethod
+    def _add_validators(response, etag, last_modified):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+from .exceptions import ValidationError
+
+
+def encode_cursor(direction, values):
+    """
+    把翻页方向和排序键的取值编码成不透明的游标字符串
+    :param direction: "n" 向后(更旧)翻页, "p" 向前(更新)翻页
+    :param values: 排序键的取值
+    :return str:
+    """
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps([direction, values], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    """
+    解码游标，按列类型还原排序键的取值
+    :param cursor:
+    :param columns: 排序键对应的列
+    :return (direction, values):
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(raw.decode("utf-8"))
+        if direction not in ("n", "p") or len(values) != len(columns):
+            raise ValueError(cursor)
+        values = [datetime.fromisoformat(v) if column.type.python_type is datetime else v
+                  for column, v in zip(columns, values)]
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValidationError("invalid cursor")
+    return direction, values
+
+
+def _after(columns, values, descending):
+    """
+    生成 (c1, c2, ...) 在排序方向上位于 values 之后的过滤条件
+    """
+    from . import db
+    column, value = columns[0], values[0]
+    beyond = column < value if descending else column > value
+    if len(columns) == 1:
+        return beyond
+    return db.or_(beyond, db.and_(column == value, _after(columns[1:], values[1:], descending)))
+
+
+class KeysetPagination(object):
+    """
+    基于排序键的游标分页，取代 LIMIT/OFFSET 分页
+    翻页只查询 per_page + 1 行，不执行 COUNT(*)，只有访问 total 时才统计总数
+    """
+    def __init__(self, query, per_page, cursor=None, columns=None, descending=True):
+        if columns is None:
+            from .models import Post
+            columns = (Post.timestamp, Post.id)
+        self.query = query
+        self.per_page = per_page
+        self.columns = columns
+        self.descending = descending
+        self._total = None
+
+        direction, values = "n", None
+        if cursor:
+            direction, values = decode_cursor(cursor, columns)
+        backwards = direction == "p"
+        order = descending != backwards
+        ordered = query.order_by(None).order_by(*[c.desc() if order else c.asc() for c in columns])
+        if values is not None:
+            ordered = ordered.filter(_after(columns, values, order))
+        items = ordered.limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = values is not None, more
+        self.items = items
+
+    def _keys(self, item):
+        return [getattr(item, column.key) for column in self.columns]
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor("n", self._keys(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor("p", self._keys(self.items[0]))
+
+    @property
+    def total(self):
+        """
+        总数需要一次 COUNT(*)，只在确实用到时才查询
+        """
+        if self._total is None:
+            self._total = self.query.order_by(None).count()
+        return self._total
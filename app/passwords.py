@@ -0,0 +1,57 @@
+"""
+    密码散列：算法和强度在配置中设置，保存的散列与当前设置不同时在登录成功后重新计算
+"""
+import hashlib
+import hmac
+from flask import current_app
+from werkzeug.security import generate_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+def normalize_method(method):
+    """
+    pbkdf2 未写迭代次数时补上 werkzeug 的默认值，与散列值中保存的写法一致
+    :param method: 如 "pbkdf2:sha256" 或 "pbkdf2:sha256:260000"
+    :return str:
+    """
+    parts = method.split(":")
+    if parts[0] == "pbkdf2" and len(parts) == 2:
+        return "{}:{}".format(method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+def hash_password(password, method=None, salt_length=None, salt=None):
+    """
+    :param password:
+    :param method: 默认为 FLASKY_PASSWORD_HASH_METHOD
+    :param salt_length: 默认为 FLASKY_PASSWORD_SALT_LENGTH
+    :param salt: 指定盐而不随机生成，只用于生成可重现的测试数据
+    :return str:
+    """
+    method = method or current_app.config["FLASKY_PASSWORD_HASH_METHOD"]
+    if salt is None:
+        return generate_password_hash(password, method=method,
+                                      salt_length=salt_length or current_app.config["FLASKY_PASSWORD_SALT_LENGTH"])
+    # 按 check_password_hash 的校验方式计算，格式与 generate_password_hash 相同
+    method = normalize_method(method)
+    password, key = password.encode("utf-8"), salt.encode("utf-8")
+    if method.startswith("pbkdf2:"):
+        args = method[7:].split(":")
+        if len(args) != 2:
+            raise ValueError("Invalid number of arguments for PBKDF2")
+        h = hashlib.pbkdf2_hmac(args[0], password, key, int(args[1])).hex()
+    else:
+        h = hmac.new(key, password, method).hexdigest()
+    return "%s$%s$%s" % (method, salt, h)
+
+
+def needs_rehash(password_hash):
+    """
+    保存的散列所用的算法、迭代次数或盐的长度是否与当前配置不同
+    :param password_hash: 形如 "pbkdf2:sha256:150000$盐$散列"
+    :return bool:
+    """
+    if password_hash is None or password_hash.count("$") < 2:
+        return False
+    method, salt = password_hash.split("$")[:2]
+    return method != normalize_method(current_app.config["FLASKY_PASSWORD_HASH_METHOD"]) \
+        or len(salt) != current_app.config["FLASKY_PASSWORD_SALT_LENGTH"]
@@ -0,0 +1,120 @@
+"""
+    令牌桶限流的后端
+
+    * MemoryBuckets: 进程内，每个工作进程各自计数
+    * SQLiteBuckets: 本机 SQLite 文件，同一台机器上的多个工作进程共享
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def refill(tokens, updated, now, rate, capacity):
+    """
+    按流逝的时间补充令牌后尝试取出一个
+    :param tokens: 上次剩余的令牌数，新桶为 None
+    :param updated: 上次更新的时间
+    :param now:
+    :param rate: 每秒补充的令牌数
+    :param capacity: 桶的容量，即允许的突发请求数
+    :return (allowed, tokens, retry_after): 是否放行；剩余令牌数；被拒绝时需要等待的秒数
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets(object):
+    """
+    最多保存 max_entries 个桶，最久未使用的先淘汰（淘汰后相当于装满的新桶）
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """
+        :return (allowed, retry_after):
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (None, now))
+            allowed, tokens, retry_after = refill(tokens, updated, now, rate, capacity)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class SQLiteBuckets(object):
+    """
+    每个线程持有一个连接，读改写在 BEGIN IMMEDIATE 事务中完成；
+    超过 max_entries 后每写入 prune_every 次清理一次最久未使用的桶
+    """
+    prune_every = 100
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._connection().execute("CREATE TABLE IF NOT EXISTS rate_limit "
+                                   "(key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, capacity):
+        """
+        :return (allowed, retry_after):
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM rate_limit WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (None, now)
+            allowed, tokens, retry_after = refill(tokens, updated, now, rate, capacity)
+            conn.execute("INSERT OR REPLACE INTO rate_limit (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                conn.execute("DELETE FROM rate_limit WHERE key IN "
+                             "(SELECT key FROM rate_limit ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                             (self.max_entries,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+
+def create_buckets(kind, max_entries=10000, path=None):
+    """
+    按配置创建限流后端
+    :param kind: "memory" | "sqlite"
+    :param max_entries: 保存的桶数上限
+    :param path: sqlite 后端的文件路径
+    """
+    if kind == "memory":
+        return MemoryBuckets(max_entries)
+    if kind == "sqlite":
+        return SQLiteBuckets(path, max_entries)
+    raise ValueError("unknown rate limit backend: {}".format(kind))
@@ -0,0 +1,178 @@
+"""
+    正文的后台渲染：开启后修改正文时只保存 body，body_html 由线程池或进程池渲染后写回，
+    期间 render_pending 为真，模板显示转义后的 body
+"""
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import current_app
+from .rendering import render_many
+
+
+class RenderPool(object):
+    """
+    FLASKY_RENDER_MODE: "sync" 在请求中渲染（默认）, "thread" 线程池, "process" 进程池；
+    渲染任务在事务提交后提交，写回时 body 已被再次修改的行跳过，由新的任务渲染
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["render_pool"] = RenderWorkers(app)
+
+    @staticmethod
+    def enabled():
+        return current_app.config["FLASKY_RENDER_MODE"] != "sync"
+
+    @staticmethod
+    def submit(table, rows):
+        """
+        :param table: Post.__table__ 或 Comment.__table__
+        :param rows: [(id, body)]
+        """
+        current_app.extensions["render_pool"].submit(table, rows)
+
+    @staticmethod
+    def wait():
+        """
+        等待已提交的任务全部写回
+        """
+        current_app.extensions["render_pool"].wait()
+
+
+class RenderWorkers(object):
+    """
+    每个应用一个，第一次提交任务时才创建线程池或进程池
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = None
+        self.outstanding = 0  # 已提交、尚未写回的任务数
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                mode = self.app.config["FLASKY_RENDER_MODE"]
+                workers = self.app.config["FLASKY_RENDER_WORKERS"]
+                if mode == "process":
+                    self.executor = ProcessPoolExecutor(workers)
+                elif mode == "thread":
+                    self.executor = ThreadPoolExecutor(workers)
+                else:
+                    raise ValueError("unknown render mode: {}".format(mode))
+            return self.executor
+
+    def submit(self, table, rows):
+        if not rows:
+            return
+        executor = self._executor()
+        with self.lock:
+            self.outstanding += 1
+        future = executor.submit(render_many, [body for id, body in rows])
+        future.add_done_callback(lambda f: self.write_back(f, table, rows))
+
+    def write_back(self, future, table, rows):
+        try:
+            from . import db, page_cache
+            html = future.result()
+            statement = table.update().\
+                where(db.and_(table.c.id == db.bindparam("row_id"), table.c.body == db.bindparam("source"))).\
+                values(body_html=db.bindparam("html"), render_pending=False, version=table.c.version + 1)
+            with db.get_engine(self.app).begin() as connection:
+                connection.execute(statement, [{"row_id": id, "source": body, "html": body_html}
+                                               for (id, body), body_html in zip(rows, html)])
+            # 回调可能在提交任务的请求线程中执行，不能推入新的应用上下文
+            page_cache.invalidate(app=self.app)
+        except Exception:
+            self.app.logger.exception("failed to render {} rows of {}".format(len(rows), table.name))
+        finally:
+            with self.lock:
+                self.outstanding -= 1
+                self.done.notify_all()
+
+    def wait(self):
+        with self.lock:
+            while self.outstanding:
+                self.done.wait()
+
+
+def rerender(table, batch_size=500, workers=None, checkpoint=None, progress=None):
+    """
+    按 id 顺序分批重新渲染整张表的 body_html（修改 allowed_tags 或升级 markdown、bleach 之后），
+    各批在进程池中渲染，按提交顺序写回，每批一个事务；只更新 body_html 有变化的行
+    :param table: Post.__table__ 或 Comment.__table__
+    :param batch_size: 每批的行数
+    :param workers: 进程数，None 为 CPU 核数，0 在当前进程中渲染
+    :param checkpoint: 进度文件路径，每批提交后记下已完成的最大 id，再次运行时从其后继续
+    :param progress: progress(rows, last_id)，每批写回后调用
+    :return (int, int): 处理的行数、实际修改的行数
+    """
+    from . import db, page_cache
+    last_id = read_checkpoint(checkpoint).get(table.name, 0)
+    executor = ProcessPoolExecutor(workers) if workers != 0 else None
+    window = 2 * (workers or os.cpu_count() or 1)  # 同时在渲染的批数，限制内存占用
+    pending = deque()
+    statement = table.update().\
+        where(db.and_(table.c.id == db.bindparam("row_id"), table.c.body == db.bindparam("source"))).\
+        values(body_html=db.bindparam("html"), render_pending=False, version=table.c.version + 1)
+    total = changed = 0
+    try:
+        while True:
+            while len(pending) < window:
+                rows = db.session.execute(db.select([table.c.id, table.c.body, table.c.body_html]).
+                                          where(table.c.id > last_id).
+                                          order_by(table.c.id).limit(batch_size)).fetchall()
+                db.session.commit()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                bodies = [body or "" for id, body, body_html in rows]
+                html = executor.submit(render_many, bodies) if executor else render_many(bodies)
+                pending.append((rows, html))
+            if not pending:
+                break
+            rows, html = pending.popleft()
+            html = html.result() if executor else html
+            updates = [{"row_id": id, "source": body, "html": new_html}
+                       for (id, body, body_html), new_html in zip(rows, html) if new_html != body_html]
+            if updates:
+                db.session.execute(statement, updates)
+            db.session.commit()
+            total += len(rows)
+            changed += len(updates)
+            write_checkpoint(checkpoint, table.name, rows[-1][0])
+            if progress is not None:
+                progress(total, rows[-1][0])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if changed:
+        page_cache.invalidate()
+    return total, changed
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, name, last_id):
+    """
+    先写临时文件再替换，中途被杀掉也不会留下残缺的进度文件
+    """
+    if not path:
+        return
+    state = read_checkpoint(path)
+    state[name] = last_id
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
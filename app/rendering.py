@@ -0,0 +1,110 @@
+"""
+    文章和评论正文的渲染：Markdown 转为 HTML，再用 bleach 清理标签、为链接加上 <a>
+
+    结果按 正文 + 渲染配置 的散列缓存，相同的正文只渲染一次；
+    Markdown、Cleaner、Linker 每个线程各构建一次后重复使用
+"""
+import hashlib
+import threading
+import bleach
+import markdown
+from markdown import Markdown
+from bleach.sanitizer import Cleaner
+from bleach.linkifier import Linker
+from .cache import LRUCache, SQLiteCache
+from .metrics import metrics
+
+allowed_tags = ["a", "abbr", "acronym", "b", "blockquote", "code",
+                "em", "i", "li", "ol", "pre", "strong", "ul", "h1",
+                "h2", "h3", "p"]
+
+# 允许的标签或 markdown、bleach 的版本变化后，旧的缓存结果不再命中
+fingerprint = repr((sorted(allowed_tags), markdown.__version__, bleach.__version__))
+
+_local = threading.local()
+
+
+class RenderCache(object):
+    """
+    进程内的 LRU，可选地在其后再加一层本机 SQLite 文件（FLASKY_RENDER_CACHE_PERSIST），
+    重启或多个工作进程之间共享渲染结果
+    """
+
+    def __init__(self, max_entries=2000, path=None):
+        self.configure(max_entries, path)
+
+    def init_app(self, app):
+        path = app.config["FLASKY_RENDER_CACHE_PATH"] if app.config["FLASKY_RENDER_CACHE_PERSIST"] else None
+        self.configure(app.config["FLASKY_RENDER_CACHE_SIZE"], path)
+
+    def configure(self, max_entries, path=None):
+        self.memory = LRUCache(max_entries)
+        self.persistent = SQLiteCache(path, max_entries * 10, table="render_cache") if path else None
+
+    @staticmethod
+    def key(value):
+        return "render:" + hashlib.sha256((fingerprint + "\0" + value).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        html = self.memory.get(key)
+        if html is None and self.persistent is not None:
+            html = self.persistent.get(key)
+            if html is not None:
+                self.memory.set(key, html)
+        return html
+
+    def set(self, key, html):
+        self.memory.set(key, html)
+        if self.persistent is not None:
+            self.persistent.set(key, html)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+
+render_cache = RenderCache()
+
+
+def render_source(value):
+    """
+    不经过缓存直接渲染，使用本线程的 Markdown、Cleaner、Linker
+    :param value: Markdown 正文
+    :return str: 清理后的 HTML
+    """
+    pipeline = getattr(_local, "pipeline", None)
+    if pipeline is None:
+        pipeline = _local.pipeline = (Markdown(output_format="html"),
+                                      Cleaner(tags=allowed_tags, strip=True),
+                                      Linker())
+    md, cleaner, linker = pipeline
+    return linker.linkify(cleaner.clean(md.reset().convert(value)))
+
+
+def render_markdown(value):
+    """
+    :param value: Markdown 正文
+    :return str: 清理后的 HTML
+    """
+    return render_many([value])[0]
+
+
+def render_many(values):
+    """
+    批量渲染，已缓存的正文直接返回
+    :param values: Markdown 正文列表
+    :return list: 与 values 顺序一致的 HTML
+    """
+    html = []
+    for value in values:
+        key = render_cache.key(value)
+        body_html = render_cache.get(key)
+        if body_html is None:
+            metrics.incr("render_cache.miss")
+            body_html = render_source(value)
+            render_cache.set(key, body_html)
+        else:
+            metrics.incr("render_cache.hit")
+        html.append(body_html)
+    return html
@@ -0,0 +1,147 @@
+"""
+    文章和评论的全文检索：SQLite FTS5 虚表 search_index 保存文章正文和未屏蔽评论的正文，
+    rowid 为正数时是文章 id，为负数时是评论 id 的相反数。posts、comments 上的触发器在插入、
+    修改正文、屏蔽和删除时同步索引，ORM 写入和 Core 批量插入都不会漏掉；
+    db.create_all 建表后随即建立虚表和触发器，已有的数据库由迁移或 flask rebuild-search 建立
+"""
+from markupsafe import Markup, escape
+from sqlalchemy.schema import DDL
+from . import db
+from .feeds import load_by_ids
+from .models import Post, Comment
+from .pagination import KeysetPagination
+
+MARK_START, MARK_END = "\x02", "\x03"  # snippet() 标出命中词的记号，转义正文后再换成 <mark>
+
+# FTS5 的 search_index 列与表同名，用于 MATCH；rank 为 bm25 得分，越小越相关
+search_index = db.Table("search_index", db.MetaData(),
+                        db.Column("rowid", db.Integer, primary_key=True),
+                        db.Column("body", db.Text),
+                        db.Column("search_index", db.Text),
+                        db.Column("rank", db.Float))
+
+SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_update AFTER UPDATE OF body ON posts BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id; "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_delete AFTER DELETE ON posts BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments "
+    "WHEN NOT coalesce(new.disabled, 0) BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (-new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF body, disabled ON comments BEGIN "
+    "DELETE FROM search_index WHERE rowid = -old.id; "
+    "INSERT INTO search_index(rowid, body) SELECT -new.id, new.body WHERE NOT coalesce(new.disabled, 0); END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN "
+    "DELETE FROM search_index WHERE rowid = -old.id; END",
+]
+
+
+def create_schema(connection):
+    """
+    建立虚表和触发器，已存在的跳过
+    """
+    for statement in SCHEMA:
+        connection.execute(statement)
+
+
+# comments 在 posts 之后创建、之前删除，两张表都在时才能建触发器
+for statement in SCHEMA:
+    db.event.listen(Comment.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+db.event.listen(Comment.__table__, "before_drop",
+                DDL("DROP TABLE IF EXISTS search_index").execute_if(dialect="sqlite"))
+
+
+def match_expression(text):
+    """
+    把用户输入转换成 FTS5 查询：每个词作为一个短语，词之间为 AND，
+    输入中的引号、括号、NEAR 等 FTS5 语法不会引起语法错误
+    :param text: 搜索框中的内容
+    :return str: 没有可搜索的词时为 None
+    """
+    terms = ['"%s"' % term.replace('"', '""') for term in text.split()]
+    return " ".join(terms) or None
+
+
+def highlight(snippet):
+    """
+    :param snippet: snippet() 的结果，命中词两侧为 MARK_START、MARK_END
+    :return Markup: 转义后的片段，命中词包在 <mark> 中
+    """
+    return escape(snippet or "").replace(MARK_START, Markup("<mark>")).replace(MARK_END, Markup("</mark>"))
+
+
+class SearchHit(object):
+    """
+    一条搜索结果，target 为命中的 Post 或 Comment
+    """
+
+    def __init__(self, row, target):
+        self.kind = "post" if row.rowid > 0 else "comment"
+        self.target = target
+        self.rank = row.rank
+        self.snippet = highlight(row.snippet)
+
+    @property
+    def post_id(self):
+        return self.target.id if self.kind == "post" else self.target.post_id
+
+
+class SearchResults(object):
+    """
+    按相关度排序的一页搜索结果，游标为 (rank, rowid)，翻页方式与 KeysetPagination 相同
+    """
+
+    def __init__(self, text, per_page, cursor=None, snippet_tokens=16):
+        """
+        :param text: 搜索内容
+        :param per_page:
+        :param cursor: 请求参数 cursor
+        :param snippet_tokens: 片段中最多包含的词数
+        """
+        self.text = text
+        self.hits = []
+        self.pagination = None
+        expression = match_expression(text or "")
+        if expression is None:
+            return
+        snippet = db.func.snippet(db.literal_column("search_index"), 0, MARK_START, MARK_END, "…", snippet_tokens)
+        query = db.session.query(search_index.c.rowid, search_index.c.rank, snippet.label("snippet")).\
+            filter(search_index.c.search_index.match(expression))
+        self.pagination = KeysetPagination(query, per_page, cursor=cursor,
+                                           columns=(search_index.c.rank, search_index.c.rowid), descending=False)
+        rows = self.pagination.items
+        posts = load_by_ids(Post.query.options(db.joinedload(Post.author)),
+                            [row.rowid for row in rows if row.rowid > 0])
+        comments = load_by_ids(Comment.query.options(db.joinedload(Comment.author)),
+                               [-row.rowid for row in rows if row.rowid < 0])
+        for row in rows:
+            target = posts.get(row.rowid) if row.rowid > 0 else comments.get(-row.rowid)
+            if target is not None:
+                self.hits.append(SearchHit(row, target))
+
+
+def rebuild(batch_size=1000):
+    """
+    清空并按主键区间分批重建索引，每批一个事务，最后合并索引段
+    :param batch_size: 每批的主键区间长度
+    :return int: 写入索引的行数
+    """
+    create_schema(db.session.connection())
+    db.session.execute("DELETE FROM search_index")
+    db.session.commit()
+    total = 0
+    for model, rowid, visible in ((Post, "id", "1"), (Comment, "-id", "NOT coalesce(disabled, 0)")):
+        max_id = db.session.query(db.func.max(model.id)).scalar() or 0
+        statement = "INSERT INTO search_index(rowid, body) SELECT {}, body FROM {} " \
+                    "WHERE id > :low AND id <= :high AND {}".format(rowid, model.__tablename__, visible)
+        for low in range(0, max_id, batch_size):
+            result = db.session.execute(statement, {"low": low, "high": low + batch_size})
+            db.session.commit()
+            total += result.rowcount
+    db.session.execute("INSERT INTO search_index(search_index) VALUES ('optimize')")
+    db.session.commit()
+    return total
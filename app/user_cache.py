@@ -0,0 +1,119 @@
+"""
+    进程内的用户、角色缓存：load_user、API 令牌认证和 User.can 先查这里，不必每个请求都查询用户和角色
+"""
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from .cache import create_cache
+from .metrics import metrics
+
+
+class UserCache(object):
+    """
+    缓存用户的全部列和角色的权限值，条目最多保留 FLASKY_USER_CACHE_TIMEOUT 秒；
+    用户或角色有改动的事务提交后删除对应条目（见 models.on_session_committed），
+    其他进程中的条目要等过期，多进程部署时可改用 "sqlite" 后端共享
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["user_cache"] = create_cache(app.config["FLASKY_USER_CACHE"],
+                                                    max_entries=app.config["FLASKY_USER_CACHE_SIZE"],
+                                                    path=app.config["FLASKY_USER_CACHE_PATH"],
+                                                    table="user_cache")
+
+    @staticmethod
+    def _cache(app=None):
+        return (app or current_app).extensions["user_cache"]
+
+    @staticmethod
+    def user_key(id):
+        return "user:{}".format(id)
+
+    @staticmethod
+    def role_key(id):
+        return "role:{}".format(id)
+
+    def get_user(self, id):
+        """
+        :param id: 用户 id
+        :return User: 属于当前 db.session 的用户，不存在时为 None
+        """
+        from . import db
+        from .models import User
+        mapper = db.inspect(User)
+        # 本次请求已经加载过的直接返回，其中可能有尚未提交的修改
+        user = db.session.identity_map.get(mapper.identity_key_from_primary_key((id,)))
+        if user is not None:
+            return user
+        values = self._cache().get(self.user_key(id))
+        if values is None:
+            metrics.incr("user_cache.miss")
+            user = User.query.get(id)
+            if user is not None:
+                self.store(user)
+            return user
+        metrics.incr("user_cache.hit")
+        # 用缓存的列值构造已持久化的对象，加入会话时不会执行查询
+        user = mapper.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    def store(self, user):
+        """
+        把刚从数据库加载、没有修改过的用户放入缓存
+        :param user:
+        """
+        from . import db
+        if db.inspect(user).modified:
+            return
+        self._cache().set(self.user_key(user.id),
+                          {attr.key: getattr(user, attr.key) for attr in db.inspect(user).mapper.column_attrs},
+                          timeout=current_app.config["FLASKY_USER_CACHE_TIMEOUT"])
+
+    def token_generation(self, id):
+        """
+        校验 API 令牌时只需要这一列，缓存命中时不构造对象
+        :param id: 用户 id
+        :return int: 用户当前的令牌代数，用户不存在时为 None
+        """
+        values = self._cache().get(self.user_key(id))
+        if values is not None:
+            metrics.incr("user_cache.hit")
+            return values.get("token_generation") or 0
+        user = self.get_user(id)
+        if user is None:
+            return None
+        return user.token_generation or 0
+
+    def role_permissions(self, role_id):
+        """
+        :param role_id:
+        :return int: 角色的权限值，角色不存在时为 0
+        """
+        permissions = self._cache().get(self.role_key(role_id))
+        if permissions is None:
+            metrics.incr("role_cache.miss")
+            from . import db
+            from .models import Role
+            permissions = db.session.query(Role.permissions).filter(Role.id == role_id).scalar() or 0
+            self._cache().set(self.role_key(role_id), permissions,
+                              timeout=current_app.config["FLASKY_USER_CACHE_TIMEOUT"])
+        else:
+            metrics.incr("role_cache.hit")
+        return permissions
+
+    def invalidate(self, keys, app=None):
+        """
+        :param keys: 由 user_key、role_key 生成的键
+        :param app: 在没有应用上下文的线程中调用时传入
+        """
+        cache = self._cache(app)
+        for key in keys:
+            cache.delete(key)
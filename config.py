@@ -14,13 +14,97 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = "[Flasky]"
     FLASKY_MAIL_SENDER = os.environ.get("FLASKY_MAIL_SENDER", "Flasky Admin<lovejianglz@163.com>")
     FLASKY_ADMIN = os.environ.get("FLASKY_ADMIN", "lovejianglz@163.com")
+    # 邮件由固定数量的后台线程发送，连续发送时复用 SMTP 连接
+    FLASKY_MAIL_WORKERS = 2
+    FLASKY_MAIL_QUEUE_SIZE = 1000
+    FLASKY_MAIL_QUEUE_TIMEOUT = 5  # 秒，队列满时 send_mail 等待的时间，之后在当前线程中直接发送
+    FLASKY_MAIL_IDLE_TIMEOUT = 2  # 秒，发送线程的连接空闲该时间后断开
+    # 邮件先写入 outbox 表，与引起它的修改在同一个事务中提交；失败后按指数退避重试，发送线程在重试时间到达时
+    # 自行发送。进程重启前安排的重试要等下一次有邮件提交，不能等时用 flask dispatch-mail --loop 持续发送
+    FLASKY_MAIL_OUTBOX = bool(os.environ.get("FLASKY_MAIL_OUTBOX"))
+    FLASKY_MAIL_OUTBOX_BATCH_SIZE = 100
+    FLASKY_MAIL_OUTBOX_LEASE = 300  # 秒，认领后未记下结果（如进程退出）的邮件在这之后重新发送
+    FLASKY_MAIL_OUTBOX_RETRY_BASE = 30  # 秒，第一次失败后的等待时间，之后每次加倍
+    FLASKY_MAIL_OUTBOX_RETRY_MAX = 3600
+    FLASKY_MAIL_OUTBOX_MAX_ATTEMPTS = 8
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     LOGIN_DISABLED = False
     FLASK_POSTS_PER_PAGE = 20
     FLASK_FOLLOWERS_PER_PAGE = 20
     FLASK_COMMENTS_PER_PAGE = 20
+    FLASK_SEARCH_RESULTS_PER_PAGE = 20
     SQLALCHEMY_RECORD_QUERIES = True
     FLASK_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_FANOUT_MAX_FOLLOWERS = 1000  # 关注者超过该数量的用户发文时不写扩散，由关注者读取时合并
+    # 文章片段缓存: "null" 不缓存, "lru" 进程内, "sqlite" 本机多进程共享
+    FLASKY_FRAGMENT_CACHE = os.environ.get("FLASKY_FRAGMENT_CACHE", "lru")
+    FLASKY_FRAGMENT_CACHE_SIZE = 2000
+    FLASKY_FRAGMENT_CACHE_PATH = os.path.join(basedir, "database", "cache.sqlite")
+    # 匿名访问者的整页缓存，多进程部署时使用 "sqlite" 后端才能在进程间同步失效
+    FLASKY_PAGE_CACHE = bool(os.environ.get("FLASKY_PAGE_CACHE"))
+    FLASKY_PAGE_CACHE_BACKEND = os.environ.get("FLASKY_PAGE_CACHE_BACKEND", "lru")
+    FLASKY_PAGE_CACHE_SIZE = 500
+    FLASKY_PAGE_CACHE_PATH = os.path.join(basedir, "database", "cache.sqlite")
+    FLASKY_PAGE_CACHE_TIMEOUT = 300
+    FLASKY_PAGE_CACHE_ENDPOINTS = ("main.index", "main.user", "main.post")
+    FLASKY_API_CACHE_MAX_AGE = 0  # API 响应的 Cache-Control max-age，0 表示每次都用 ETag 校验
+    FLASKY_API_STREAM_CHUNK_SIZE = 500  # NDJSON 流式输出时每次从数据库读取的行数
+    FLASKY_API_BATCH_MAX_IDS = 100  # ?ids= 批量读取时一次最多的 id 数
+    FLASKY_API_BULK_MAX_ITEMS = 1000  # 批量创建文章、评论时一次最多的条数
+    # 登录用户的 last_seen 先记在内存里，由后台线程批量写入
+    FLASKY_LAST_SEEN_GRANULARITY = 60  # 秒，间隔小于该值的访问不再记录
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10  # 秒，None 表示不启动后台线程
+    FLASKY_LAST_SEEN_MAX_PENDING = 1000  # 积累到该数量的用户时立即写入
+    # load_user、令牌认证和权限检查使用的用户/角色缓存: "null" 不缓存, "lru" 进程内, "sqlite" 本机多进程共享
+    FLASKY_USER_CACHE = os.environ.get("FLASKY_USER_CACHE", "lru")
+    FLASKY_USER_CACHE_SIZE = 1000
+    FLASKY_USER_CACHE_PATH = os.path.join(basedir, "database", "cache.sqlite")
+    FLASKY_USER_CACHE_TIMEOUT = 60  # 秒，其他进程中的修改最迟在这之后生效
+    # 验证通过的 API 邮箱+密码 缓存，期间再次请求不必重新计算密码散列
+    FLASKY_API_CREDENTIAL_CACHE = os.environ.get("FLASKY_API_CREDENTIAL_CACHE", "lru")
+    FLASKY_API_CREDENTIAL_CACHE_SIZE = 1000
+    FLASKY_API_CREDENTIAL_CACHE_TIMEOUT = 300
+    # API 限流：令牌桶，(请求数, 秒数) 表示每个客户端在该时间内最多的请求数，也是允许的突发数
+    FLASKY_API_RATE_LIMIT = True
+    FLASKY_API_RATE_LIMITS = {
+        "default": (300, 60),
+        "api.get_comments": (60, 60),
+        "api.get_token": (10, 60),
+    }
+    # 每个请求还按客户端 IP 计数，额度为上面的倍数，同一 NAT 后的多个用户共用；
+    # 认证信息中的用户名由客户端随意填写，不能只按它计数
+    FLASKY_API_RATE_LIMIT_IP_FACTOR = 10
+    # 应用前面的反向代理层数，非 0 时按 X-Forwarded-For 等请求头还原客户端地址；
+    # 部署在代理后面时必须设置，否则所有请求的地址都是代理的地址，共用一个按 IP 计数的限流桶
+    FLASKY_PROXY_FIX = int(os.environ.get("FLASKY_PROXY_FIX", 0))
+    # "memory" 每个工作进程各自计数, "sqlite" 本机多个工作进程共享
+    FLASKY_API_RATE_LIMIT_BACKEND = os.environ.get("FLASKY_API_RATE_LIMIT_BACKEND", "memory")
+    FLASKY_API_RATE_LIMIT_SIZE = 10000
+    FLASKY_API_RATE_LIMIT_PATH = os.path.join(basedir, "database", "rate_limit.sqlite")
+    FLASKY_API_MAX_CONCURRENT = None  # 每个进程同时处理的 API 请求数上限，None 不限制
+    # 密码散列的算法和强度，修改后用户下次登录成功时按新设置重新计算；
+    # 用 flask bench-password 测量不同设置的耗时
+    FLASKY_PASSWORD_HASH_METHOD = os.environ.get("FLASKY_PASSWORD_HASH_METHOD", "pbkdf2:sha256:150000")
+    FLASKY_PASSWORD_SALT_LENGTH = 16
+    # 正文渲染: "sync" 在请求中渲染, "thread" / "process" 由后台线程池 / 进程池渲染后写回
+    FLASKY_RENDER_MODE = os.environ.get("FLASKY_RENDER_MODE", "sync")
+    FLASKY_RENDER_WORKERS = 2
+    # 正文渲染结果按内容缓存，可选地保存到本机 SQLite 文件供多个工作进程共享
+    FLASKY_RENDER_CACHE_SIZE = 2000
+    FLASKY_RENDER_CACHE_PERSIST = bool(os.environ.get("FLASKY_RENDER_CACHE_PERSIST"))
+    FLASKY_RENDER_CACHE_PATH = os.path.join(basedir, "database", "render_cache.sqlite")
+    # 数据库连接：SQLite 在每个新连接上执行的 PRAGMA；SQLite 文件数据库的连接池大小，None 为每次新建连接；
+    # 其他数据库的连接池设置。SQLALCHEMY_ENGINE_OPTIONS 中的设置优先
+    FLASKY_SQLITE_PRAGMAS = {}
+    FLASKY_SQLITE_POOL_SIZE = None
+    FLASKY_SQLITE_POOL_OVERFLOW = 10
+    FLASKY_DATABASE_POOL = {"pool_pre_ping": True, "pool_recycle": 1800}
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # 只读副本的数据库 URI，非空时 GET/HEAD 请求中的查询发往副本；写入后 FLASKY_DATABASE_REPLICA_PIN 秒内
+    # 该用户的请求仍读主库；连接失败的副本 FLASKY_DATABASE_REPLICA_RETRY 秒内不再使用
+    FLASKY_DATABASE_REPLICAS = os.environ.get("DATABASE_REPLICA_URLS", "").split()
+    FLASKY_DATABASE_REPLICA_PIN = 5
+    FLASKY_DATABASE_REPLICA_RETRY = 30
     SSL_REDIRECT = False  # 是否开启HTTPS
 
     @classmethod
@@ -39,15 +123,33 @@ class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False  # 禁用CSRF保护
     SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL") or "sqlite://"
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = None  # 测试中显式调用 flush()
+    FLASKY_API_RATE_LIMIT = False
+    FLASKY_PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"  # 测试中不需要很高的强度
+    FLASKY_DATABASE_REPLICAS = []
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "database",
                                                                                             "blog.sqlite")
     SSL_REDIRECT = True
+    # WAL 下读不阻塞写；synchronous=NORMAL 在 WAL 下只在检查点时 fsync；
+    # cache_size 为负数时单位是 KiB；mmap_size 让读取直接走内存映射
+    FLASKY_SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -16000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    }
+    FLASKY_SQLITE_POOL_SIZE = 10
+    FLASKY_DATABASE_POOL = {"pool_pre_ping": True, "pool_recycle": 1800, "pool_size": 10, "max_overflow": 20}
 
 
 class NginxConfig(ProductionConfig):
+    FLASKY_PROXY_FIX = int(os.environ.get("FLASKY_PROXY_FIX", 1))
+
     @classmethod
     def init_app(cls, app):
         super().init_app(app)
@@ -58,9 +160,6 @@ class NginxConfig(ProductionConfig):
         file_handler.setLevel(logging.WARNING)
         app.logger.addHandler(file_handler)
 
-        from werkzeug.middleware.proxy_fix import ProxyFix
-        app.wsgi_app = ProxyFix(app.wsgi_app)
-
 class DockerConfig(ProductionConfig):
     @classmethod
     def init_app(cls, app):
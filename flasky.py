@@ -2,7 +2,7 @@ import os
 import sys
 import click
 from app import create_app, db
-from app.models import User, Role, Permission, Follow, Post, Comment
+from app.models import User, Role, Permission, Follow, Post, Comment, Timeline, OutboxMessage
 from flask_migrate import Migrate
 
 
@@ -20,7 +20,7 @@ migrate = Migrate(app, db)
 @app.shell_context_processor
 def make_shell_context():
     return dict(db=db, User=User, Role=Role, Permission=Permission, Follow=Follow, Post=Post,
-                Comment=Comment)
+                Comment=Comment, Timeline=Timeline, OutboxMessage=OutboxMessage)
 
 
 @app.cli.command()
@@ -44,3 +44,215 @@ def test(coverage):
         print("HTML version: file://%s/index.html" % covdir)
         COV.erase()
 
+
+@app.cli.command()
+@click.option("--batch-size", default=1000, help="Followers rebuilt per transaction")
+def backfill_timelines(batch_size):
+    """Rebuild the materialized follower timelines."""
+    total = Timeline.rebuild(batch_size=batch_size)
+    print("Timelines rebuilt: %d rows" % total)
+
+
+@app.cli.command()
+@click.option("--batch-size", default=1000, help="Primary key range indexed per transaction")
+def rebuild_search(batch_size):
+    """Create and rebuild the full-text search index."""
+    from app.search import rebuild
+    total = rebuild(batch_size=batch_size)
+    print("Search index rebuilt: %d rows" % total)
+
+
+@app.cli.command()
+@click.option("--size", default="S", type=click.Choice(["S", "M", "L"]), help="Preset row counts")
+@click.option("--seed", default=0, help="Random seed; the same seed and --now generate the same data")
+@click.option("--batch-size", default=5000, help="Rows inserted per transaction")
+@click.option("--now", type=click.DateTime(), default=None,
+              help="End of the generated time window (default 2026-01-01, so runs are reproducible)")
+def generate_fake(size, seed, batch_size, now):
+    """Fill the database with synthetic users, follows, posts and comments."""
+    from app.fake import generate
+
+    def progress(step, rows, seconds):
+        if rows:
+            print("%s: %d rows in %.1fs (%.0f rows/s)" % (step, rows, seconds, rows / max(seconds, 1e-9)))
+        else:
+            print("%s: %.1fs" % (step, seconds))
+    generate(size, seed=seed, batch_size=batch_size, now=now, progress=progress)
+
+
+@app.cli.command()
+@click.option("--method", "methods", multiple=True,
+              help="Hash method to measure, e.g. pbkdf2:sha256:260000 (repeatable)")
+@click.option("--rounds", default=5, help="Hashes and verifications per method")
+def bench_password(methods, rounds):
+    """Measure password hash and verify latency per method."""
+    import timeit
+    from werkzeug.security import check_password_hash
+    from app.passwords import hash_password, normalize_method
+    configured = normalize_method(app.config["FLASKY_PASSWORD_HASH_METHOD"])
+    if not methods:
+        methods = sorted(set([configured] + ["pbkdf2:sha256:%d" % n for n in (50000, 150000, 260000, 600000)]),
+                         key=lambda method: int(method.rsplit(":", 1)[-1]) if method.startswith("pbkdf2") else 0)
+    print("%-28s %12s %12s" % ("method", "hash ms", "verify ms"))
+    for method in methods:
+        password_hash = hash_password("benchmark password", method=method)
+        hash_time = timeit.timeit(lambda: hash_password("benchmark password", method=method), number=rounds)
+        verify_time = timeit.timeit(lambda: check_password_hash(password_hash, "benchmark password"),
+                                    number=rounds)
+        marker = " *" if normalize_method(method) == configured else ""
+        print("%-28s %12.1f %12.1f%s" % (method, hash_time * 1000 / rounds, verify_time * 1000 / rounds, marker))
+
+
+@app.cli.command()
+@click.option("--count", default=2000, help="Bodies rendered per run")
+@click.option("--unique", default=0.2, help="Fraction of distinct bodies")
+@click.option("--seed", default=1, help="Random seed for the sample bodies")
+def bench_render(count, unique, seed):
+    """Measure markdown rendering with and without the render cache."""
+    import random
+    import timeit
+    import bleach
+    from markdown import markdown
+    from app.rendering import allowed_tags, render_source, render_many, render_cache
+    rng = random.Random(seed)
+    words = ["flask", "*blog*", "**post**", "`code`", "http://example.com", "<b>tag</b>", "[link](http://a.b)"]
+    distinct = ["\n\n".join(" ".join(rng.choice(words) for _ in range(rng.randint(10, 60)))
+                              for _ in range(rng.randint(1, 4)))
+                for _ in range(max(1, int(count * unique)))]
+    bodies = [rng.choice(distinct) for _ in range(count)]
+
+    def rebuilt():
+        for body in bodies:
+            bleach.linkify(bleach.clean(markdown(body, output_format="html"), tags=allowed_tags, strip=True))
+
+    def reused():
+        for body in bodies:
+            render_source(body)
+
+    def cached():
+        render_cache.clear()
+        render_many(bodies)
+
+    print("%d bodies, %d distinct" % (len(bodies), len(distinct)))
+    for name, run in (("rebuilt per call", rebuilt), ("reused pipeline", reused), ("render cache", cached)):
+        seconds = timeit.timeit(run, number=1)
+        print("%-18s %8.3f ms/body %10.0f bodies/s" % (name, seconds * 1000 / len(bodies), len(bodies) / seconds))
+
+
+@app.cli.command()
+@click.option("--readers", default=8, help="Reader threads")
+@click.option("--writers", default=2, help="Writer threads")
+@click.option("--seconds", default=5.0, help="Duration of each run")
+def bench_db(readers, writers, seconds):
+    """Compare concurrent SQLite throughput with default and production settings."""
+    import random
+    import shutil
+    import tempfile
+    import threading
+    import time
+    from sqlalchemy import create_engine
+    from app.database import engine_options, listen_pragmas
+    from config import ProductionConfig
+    production = dict(app.config, FLASKY_SQLITE_PRAGMAS=ProductionConfig.FLASKY_SQLITE_PRAGMAS,
+                      FLASKY_SQLITE_POOL_SIZE=ProductionConfig.FLASKY_SQLITE_POOL_SIZE, SQLALCHEMY_ENGINE_OPTIONS={})
+    directory = tempfile.mkdtemp()
+    try:
+        print("%-12s %12s %12s %10s" % ("profile", "reads/s", "writes/s", "errors"))
+        for name, config in (("default", None), ("production", production)):
+            uri = "sqlite:///" + os.path.join(directory, name + ".sqlite")
+            engine = create_engine(uri, **(engine_options(config, uri) if config else {}))
+            if config:
+                listen_pragmas(engine, config["FLASKY_SQLITE_PRAGMAS"])
+            with engine.begin() as conn:
+                conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, body TEXT, timestamp DATETIME)")
+                conn.execute("CREATE INDEX ix_items_timestamp ON items (timestamp)")
+                conn.execute("INSERT INTO items (body, timestamp) VALUES (?, datetime('now'))",
+                             [("item %d" % i,) for i in range(10000)])
+            counts = {"read": 0, "write": 0, "error": 0}
+            lock = threading.Lock()
+            deadline = time.time() + seconds
+
+            def work(kind):
+                rng = random.Random()
+                done = errors = 0
+                while time.time() < deadline:
+                    try:
+                        with engine.begin() as conn:
+                            if kind == "read":
+                                conn.execute("SELECT * FROM items WHERE id >= ? ORDER BY id LIMIT 20",
+                                             rng.randint(1, 10000)).fetchall()
+                            else:
+                                conn.execute("INSERT INTO items (body, timestamp) VALUES ('new', datetime('now'))")
+                        done += 1
+                    except Exception:
+                        errors += 1
+                with lock:
+                    counts[kind] += done
+                    counts["error"] += errors
+
+            threads = [threading.Thread(target=work, args=("read",)) for _ in range(readers)] + \
+                      [threading.Thread(target=work, args=("write",)) for _ in range(writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            engine.dispose()
+            print("%-12s %12.0f %12.0f %10d" % (name, counts["read"] / seconds, counts["write"] / seconds,
+                                                counts["error"]))
+    finally:
+        shutil.rmtree(directory)
+
+
+@app.cli.command()
+@click.option("--batch-size", default=500, help="Rows rendered and written per transaction")
+@click.option("--workers", default=None, type=int, help="Render processes (default: CPU count, 0: inline)")
+@click.option("--checkpoint", default="rerender.checkpoint.json", help="Progress file used to resume")
+@click.option("--restart/--resume", default=False, help="Ignore the progress file and start from the first row")
+def rerender(batch_size, workers, checkpoint, restart):
+    """Re-render body_html of all posts and comments."""
+    import time
+    from app.render_pool import rerender as rerender_table
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    for table in (Post.__table__, Comment.__table__):
+        start = time.time()
+
+        def progress(rows, last_id):
+            print("%s: %d rows up to id %d, %.0f rows/s" % (table.name, rows, last_id,
+                                                            rows / max(time.time() - start, 1e-6)))
+
+        total, changed = rerender_table(table, batch_size=batch_size, workers=workers,
+                                        checkpoint=checkpoint, progress=progress)
+        print("%s: %d rows rendered, %d changed in %.1fs" % (table.name, total, changed, time.time() - start))
+    # 全部完成，下次运行从头开始
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+@app.cli.command()
+@click.option("--batch-size", default=None, type=int, help="Mails claimed and sent per batch")
+@click.option("--loop/--once", default=False, help="Keep polling the outbox instead of exiting")
+@click.option("--interval", default=5.0, help="Seconds between polls with --loop")
+def dispatch_mail(batch_size, loop, interval):
+    """Send due mails from the outbox, retrying failures with backoff."""
+    import time
+    from app import mail
+    from app.email import dispatch_outbox
+    from app.metrics import metrics
+    while True:
+        with mail.connect() as connection:
+            sent, failed = dispatch_outbox(connection, batch_size=batch_size)
+        if sent or failed or not loop:
+            print("Outbox: %d sent, %d failed, %d pending" % (sent, failed, metrics.get("mail.outbox.depth")))
+        if not loop:
+            break
+        time.sleep(interval)
+
+
+@app.cli.command()
+@click.option("--batch-size", default=1000, help="Rows repaired per transaction")
+def repair_counters(batch_size):
+    """Recount the denormalized post, comment and follow counters."""
+    posts = Post.repair_counters(batch_size=batch_size)
+    users = User.repair_counters(batch_size=batch_size)
+    print("Counters repaired: %d posts, %d users" % (posts, users))
@@ -0,0 +1,58 @@
+"""add full-text search index for posts and comments
+
+Revision ID: a6d3e0f4b218
+Revises: f3a1c8d02e57
+Create Date: 2026-10-18 21:12:44.603118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3e0f4b218'
+down_revision = 'f3a1c8d02e57'
+branch_labels = None
+depends_on = None
+
+# 与 app/search.py 中的 SCHEMA 相同；迁移不引用应用代码，以后修改那里时这里保持不变
+SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_update AFTER UPDATE OF body ON posts BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id; "
+    "INSERT INTO search_index(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_search_delete AFTER DELETE ON posts BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments "
+    "WHEN NOT coalesce(new.disabled, 0) BEGIN "
+    "INSERT INTO search_index(rowid, body) VALUES (-new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF body, disabled ON comments BEGIN "
+    "DELETE FROM search_index WHERE rowid = -old.id; "
+    "INSERT INTO search_index(rowid, body) SELECT -new.id, new.body WHERE NOT coalesce(new.disabled, 0); END",
+    "CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN "
+    "DELETE FROM search_index WHERE rowid = -old.id; END",
+]
+
+TRIGGERS = ['posts_search_insert', 'posts_search_update', 'posts_search_delete',
+            'comments_search_insert', 'comments_search_update', 'comments_search_delete']
+
+
+def upgrade():
+    # FTS5 只有 SQLite 支持
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in SCHEMA:
+        op.execute(statement)
+    op.execute("INSERT INTO search_index(rowid, body) SELECT id, body FROM posts")
+    op.execute("INSERT INTO search_index(rowid, body) SELECT -id, body FROM comments "
+               "WHERE NOT coalesce(disabled, 0)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in TRIGGERS:
+        op.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+    op.execute("DROP TABLE IF EXISTS search_index")
@@ -1,6 +1,6 @@
 import unittest
 from app import create_app, db
-from app.models import Role, User
+from app.models import Role, User, Post, Comment, Permission, insert_rows
 import base64
 import json
 from flask import url_for
@@ -54,4 +54,242 @@ class APITestCase(unittest.TestCase):
         self.assertEqual("http://localhost"+json_response["url"], url)
         self.assertEqual(json_response["body"], "body of the *blog* post")
         self.assertEqual(json_response["body_html"],
-                                       "<p>body of the <em>blog</em> post</p>")
\ No newline at end of file
+                                       "<p>body of the <em>blog</em> post</p>")
+
+    def test_conditional_get(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers(username="john@example.com", password="cat")
+        response = self.client.post("/api/v1/posts/", headers=headers,
+                                    data=json.dumps({"body": "first"}))
+        url = response.headers.get("Location")
+
+        for target in (url, "/api/v1/posts/", url + "/comments", "/api/v1/user/%d" % u.id):
+            response = self.client.get(target, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers.get("ETag")
+            self.assertIsNotNone(etag)
+            self.assertTrue("private" in response.headers.get("Cache-Control"))
+            conditional_headers = dict(headers, **{"If-None-Match": etag})
+            response = self.client.get(target, headers=conditional_headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b"")
+
+        # 修改文章后 ETag 失效
+        etag = self.client.get(url, headers=headers).headers.get("ETag")
+        self.client.put(url, headers=headers, data=json.dumps({"body": "second"}))
+        response = self.client.get(url, headers=dict(headers, **{"If-None-Match": etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data(as_text=True))["body"], "second")
+
+    def test_comments_pagination_and_stream(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        post = Post(body="post", author=u)
+        db.session.add_all([u, post])
+        db.session.add_all([Comment(body="comment %d" % i, author=u, post=post) for i in range(25)])
+        db.session.commit()
+        headers = self.get_api_headers(username="john@example.com", password="cat")
+
+        # 按游标翻页，两页合起来正好是全部评论
+        response = self.client.get("/api/v1/comments/?count=1", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        first = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(first["comments"]), 20)
+        self.assertEqual(first["count"], 25)
+        self.assertIsNone(first["prev_url"])
+        response = self.client.get(first["next_url"], headers=headers)
+        second = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(second["comments"]), 5)
+        self.assertIsNone(second["next_url"])
+        self.assertIsNone(second["count"])
+        urls = set(c["url"] for c in first["comments"] + second["comments"])
+        self.assertEqual(len(urls), 25)
+
+        # NDJSON 流式返回全部评论，每行一条
+        response = self.client.get("/api/v1/comments/?format=ndjson", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[0])["body"], "comment 0")
+
+        response = self.client.get("/api/v1/comments/?cursor=bogus", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_read(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        posts = [Post(body="post %d" % i, author=u) for i in range(3)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        ids = [p.id for p in posts]
+        headers = self.get_api_headers(username="john@example.com", password="cat")
+
+        # 按请求顺序返回，重复的 id 只返回一次，不存在的 id 在 missing 中
+        response = self.client.get("/api/v1/posts/?ids=%d,%d,999,%d,%d" % (ids[2], ids[0], ids[2], ids[1]),
+                                   headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([p["body"] for p in json_response["posts"]], ["post 2", "post 0", "post 1"])
+        self.assertEqual(json_response["missing"], [999])
+        etag = response.headers["ETag"]
+        response = self.client.get("/api/v1/posts/?ids=%d,%d,999,%d,%d" % (ids[2], ids[0], ids[2], ids[1]),
+                                   headers=dict(headers, **{"If-None-Match": etag}))
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/api/v1/users/?ids=%d" % u.id, headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))["users"][0]["post_count"], 3)
+        response = self.client.get("/api/v1/comments/?ids=1", headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True)), {"comments": [], "missing": [1]})
+
+        self.app.config["FLASKY_API_BATCH_MAX_IDS"] = 2
+        # 重复的 id 也计入上限
+        for query in ("ids=1,2,3", "ids=1,1,1", "ids=1,x", "ids="):
+            response = self.client.get("/api/v1/posts/?" + query, headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create(self):
+        r = Role.query.filter_by(name="User").first()
+        u1 = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        u2 = User(email="susan@example.com", password="dog", role=r, confirmed=True)
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u2.follow(u1)
+        db.session.commit()
+        u1_id, u2_id = u1.id, u2.id
+        headers = self.get_api_headers(username="john@example.com", password="cat")
+
+        response = self.client.post("/api/v1/posts/bulk", headers=headers,
+                                    data=json.dumps([{"body": "first *post*"}, {"body": ""},
+                                                     "oops", {"body": "second"}]))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response["created"], 2)
+        self.assertEqual(json_response["failed"], 2)
+        self.assertEqual([item["status"] for item in json_response["results"]], [201, 400, 400, 201])
+        post = json.loads(self.client.get(json_response["results"][0]["url"], headers=headers).
+                          get_data(as_text=True))
+        self.assertEqual(post["body_html"], "<p>first <em>post</em></p>")
+
+        # 计数和关注者的时间线与逐条创建时一致
+        self.assertEqual(User.query.get(u1_id).post_count, 2)
+        self.assertEqual(User.query.get(u2_id).followed_posts.count(), 2)
+
+        post_id = Post.query.filter_by(body="second").first().id
+        response = self.client.post("/api/v1/comments/bulk", headers=headers,
+                                    data=json.dumps([{"post_id": post_id, "body": "a"},
+                                                     {"post_id": 999, "body": "b"},
+                                                     {"body": "c"},
+                                                     {"post_id": post_id, "body": "d"}]))
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([item["status"] for item in json_response["results"]], [201, 400, 400, 201])
+        self.assertEqual(json_response["results"][1]["message"], "post not found")
+        post = Post.query.get(post_id)
+        self.assertEqual(post.comment_count, 2)
+        self.assertEqual([c.body for c in post.comments], ["a", "d"])
+
+        response = self.client.post("/api/v1/posts/bulk", headers=headers, data=json.dumps({"body": "x"}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_insert_rows_without_sqlite_ids(self):
+        # 不支持 RETURNING 的其他数据库逐行插入，由数据库分配主键
+        connection = db.session.connection()
+        connection.dialect.name = "other"
+        try:
+            ids = insert_rows(connection, Post.__table__, [{"body": "a"}, {"body": "b"}])
+        finally:
+            del connection.dialect.name
+        self.assertEqual([Post.query.get(id).body for id in ids], ["a", "b"])
+
+    def test_token_auth_without_queries(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        response = self.client.get("/api/v1/tokens/", headers=self.get_api_headers("john@example.com", "cat"))
+        token = json.loads(response.get_data(as_text=True))["token"]
+        token_headers = self.get_api_headers(token, "")
+
+        statements = []
+        db.event.listen(db.engine, "before_cursor_execute",
+                        lambda conn, cursor, statement, *args: statements.append(statement))
+        db.session.remove()
+        self.assertEqual(self.client.get("/api/v1/posts/", headers=token_headers).status_code, 200)
+        db.session.remove()
+        del statements[:]
+        response = self.client.post("/api/v1/posts/", headers=token_headers, data=json.dumps({"body": "hi"}))
+        self.assertEqual(response.status_code, 201)
+        # 鉴权和权限检查没有加载用户和角色（发布文章时写扩散只查询 follower_count）
+        self.assertFalse([s for s in statements if "users.password_hash" in s or "FROM roles" in s])
+
+        # 撤销后旧令牌失效
+        u = User.query.get(user_id)
+        u.revoke_auth_tokens()
+        db.session.commit()
+        self.assertEqual(self.client.get("/api/v1/posts/", headers=token_headers).status_code, 401)
+
+        # 换了角色后旧令牌也失效
+        token = User.query.get(user_id).generate_auth_token()
+        u = User.query.get(user_id)
+        u.role = Role.query.filter_by(name="Administrator").first()
+        db.session.commit()
+        self.assertEqual(self.client.get("/api/v1/posts/", headers=self.get_api_headers(token, "")).status_code,
+                         401)
+
+    def test_token_revoked_with_permission(self):
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        token = u.generate_auth_token()
+        body = json.dumps({"body": "hi"})
+        response = self.client.post("/api/v1/posts/", headers=self.get_api_headers(token, ""), data=body)
+        self.assertEqual(response.status_code, 201)
+
+        # 角色去掉写文章的权限后，旧令牌不再有这个权限
+        db.session.remove()
+        r = Role.query.filter_by(name="User").first()
+        r.remove_permission(Permission.WRITE)
+        db.session.commit()
+        response = self.client.post("/api/v1/posts/", headers=self.get_api_headers(token, ""), data=body)
+        self.assertEqual(response.status_code, 401)
+        db.session.remove()
+        token = User.query.get(user_id).generate_auth_token()
+        response = self.client.post("/api/v1/posts/", headers=self.get_api_headers(token, ""), data=body)
+        self.assertEqual(response.status_code, 403)
+
+        # 修改邮箱后变为未确认，旧令牌失效
+        db.session.remove()
+        User.query.get(user_id).generate_change_email_token("susan@example.com")
+        self.assertEqual(self.client.get("/api/v1/posts/", headers=self.get_api_headers(token, "")).status_code,
+                         401)
+
+    def test_credential_cache(self):
+        from app.metrics import metrics
+        r = Role.query.filter_by(name="User").first()
+        u = User(email="john@example.com", password="cat", role=r, confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        metrics.reset()
+        for i in range(3):
+            response = self.client.get("/api/v1/posts/", headers=self.get_api_headers("john@example.com", "cat"))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.get("credential_cache.miss"), 1)
+        self.assertEqual(metrics.get("credential_cache.hit"), 2)
+        response = self.client.get("/api/v1/posts/", headers=self.get_api_headers("john@example.com", "dog"))
+        self.assertEqual(response.status_code, 401)
+
+        # 修改密码后缓存的旧密码不再有效
+        u = User.query.get(user_id)
+        u.password = "dog"
+        db.session.commit()
+        response = self.client.get("/api/v1/posts/", headers=self.get_api_headers("john@example.com", "cat"))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get("/api/v1/posts/", headers=self.get_api_headers("john@example.com", "dog"))
+        self.assertEqual(response.status_code, 200)
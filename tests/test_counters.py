@@ -0,0 +1,75 @@
+import unittest
+from app import create_app, db
+from app.models import Role, User, Post, Comment
+
+
+class CounterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email="u1@example.com", username="u1", password="cat")
+        self.u2 = User(email="u2@example.com", username="u2", password="dog")
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_post_and_comment_counters(self):
+        post = Post(body="post", author=self.u1)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(self.u1.post_count, 1)
+        self.assertEqual(post.comment_count, 0)
+
+        c1 = Comment(body="c1", post=post, author=self.u2)
+        c2 = Comment(body="c2", post=post, author=self.u2)
+        db.session.add_all([c1, c2])
+        db.session.commit()
+        self.assertEqual(post.comment_count, 2)
+
+        # 屏蔽/恢复评论
+        c1.disabled = True
+        db.session.commit()
+        self.assertEqual(post.comment_count, 1)
+        c1.disabled = False
+        db.session.commit()
+        self.assertEqual(post.comment_count, 2)
+
+        db.session.delete(c2)
+        db.session.commit()
+        self.assertEqual(post.comment_count, 1)
+        db.session.delete(c1)
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.u1.post_count, 0)
+
+    def test_follow_counters(self):
+        self.u1.follow(self.u2)
+        db.session.commit()
+        self.assertEqual(self.u1.followed_count, 1)
+        self.assertEqual(self.u2.follower_count, 1)
+        self.u1.unfollow(self.u2)
+        db.session.commit()
+        self.assertEqual(self.u1.followed_count, 0)
+        self.assertEqual(self.u2.follower_count, 0)
+
+    def test_repair_counters(self):
+        post = Post(body="post", author=self.u1)
+        db.session.add_all([post, Comment(body="c", post=post, author=self.u2),
+                            Comment(body="hidden", post=post, author=self.u2, disabled=True)])
+        self.u2.follow(self.u1)
+        db.session.commit()
+        db.session.execute(User.__table__.update().values(post_count=7, follower_count=7, followed_count=7))
+        db.session.execute(Post.__table__.update().values(comment_count=7))
+        db.session.commit()
+        self.assertEqual(Post.repair_counters(batch_size=1), 1)
+        self.assertEqual(User.repair_counters(batch_size=1), 2)
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual((self.u1.post_count, self.u1.follower_count, self.u1.followed_count), (1, 1, 0))
+        self.assertEqual((self.u2.post_count, self.u2.follower_count, self.u2.followed_count), (0, 0, 1))
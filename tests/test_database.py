@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy.pool import QueuePool
+from app import create_app, db, database_tuning
+from app.database import engine_options
+from app.models import Role
+from config import ProductionConfig
+
+
+class DatabaseTuningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app("testing")
+        self.app.config.update(SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "blog.sqlite"),
+                               SQLALCHEMY_ENGINE_OPTIONS={},
+                               FLASKY_SQLITE_PRAGMAS=ProductionConfig.FLASKY_SQLITE_PRAGMAS,
+                               FLASKY_SQLITE_POOL_SIZE=ProductionConfig.FLASKY_SQLITE_POOL_SIZE)
+        database_tuning.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(self.app).dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_pragmas_and_pool(self):
+        self.assertTrue(isinstance(db.engine.pool, QueuePool))
+        self.assertEqual(db.session.execute("PRAGMA journal_mode").scalar(), "wal")
+        self.assertEqual(db.session.execute("PRAGMA synchronous").scalar(), 1)
+        self.assertEqual(db.session.execute("PRAGMA busy_timeout").scalar(), 5000)
+        self.assertEqual(db.session.execute("PRAGMA cache_size").scalar(), -16000)
+        Role.insert_roles()
+        self.assertEqual(Role.query.count(), 3)
+
+    def test_engine_options(self):
+        config = dict(self.app.config, FLASKY_DATABASE_POOL=ProductionConfig.FLASKY_DATABASE_POOL,
+                      SQLALCHEMY_ENGINE_OPTIONS={"pool_recycle": 60})
+        options = engine_options(config, "postgresql://localhost/blog")
+        self.assertEqual(options["pool_size"], 10)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(options["pool_recycle"], 60)
+        # 内存数据库不换连接池，也不带其他数据库的连接池参数
+        self.assertEqual(engine_options(config, "sqlite://"), {"pool_recycle": 60})
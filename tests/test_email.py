@@ -0,0 +1,234 @@
+import socketserver
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from flask_mail import Message
+from app import create_app, db, mail_queue
+from app import mail
+from app.email import send_mail, dispatch_outbox
+from app.metrics import metrics
+from app.models import Role, User, OutboxMessage
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    只实现 smtplib 用到的几个命令，记下收到的邮件和连接数
+    """
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            first = self.server.connections == 1
+        if first:
+            self.server.gate.wait(5)
+        self.reply("220 localhost")
+        refuse = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command.startswith("MAIL"):
+                refuse = False
+                self.reply("250 ok")
+            elif command.startswith("RCPT"):
+                refuse = refuse or "BAD@" in command
+                self.reply("250 ok")
+            elif command == "DATA" and refuse:
+                self.reply("554 transaction failed")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                data = []
+                for line in iter(self.rfile.readline, b".\r\n"):
+                    data.append(line)
+                with self.server.lock:
+                    self.server.messages.append(b"".join(data))
+                self.reply("250 ok")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.connections = 0
+        self.messages = []
+
+
+class MailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.app = create_app("testing")
+        state = self.app.extensions["mail"]
+        state.server, state.port = self.server.server_address
+        state.use_ssl = state.use_tls = False
+        state.username = None
+        state.suppress = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        metrics.reset()
+
+    def tearDown(self):
+        self.server.gate.set()
+        mail_queue.shutdown(5)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def configure(self, **config):
+        self.app.config.update(config)
+        mail_queue.init_app(self.app)
+
+    @staticmethod
+    def message(i):
+        return Message("mail %d" % i, sender="admin@example.com", recipients=["u%d@example.com" % i])
+
+
+class MailQueueTestCase(MailTestCase):
+    def test_burst_reuses_connections(self):
+        with self.app.test_request_context("/"):
+            send_mail("john@example.com", "Please confirm your account", "auth/mail/confirm",
+                      user=User(username="john"), token="token")
+        for i in range(30):
+            mail_queue.submit(self.message(i))
+        mail_queue.join()
+        self.assertEqual(len(self.server.messages), 31)
+        self.assertTrue(any(b"Please confirm your account" in message for message in self.server.messages))
+        # 不再每封邮件一个线程、一个连接
+        self.assertEqual(len(self.app.extensions["mail_queue"].threads), 2)
+        self.assertTrue(self.server.connections <= 2)
+        self.assertEqual(metrics.get("mail.sent"), 31)
+
+    def test_backpressure(self):
+        self.configure(FLASKY_MAIL_WORKERS=1, FLASKY_MAIL_QUEUE_SIZE=1, FLASKY_MAIL_QUEUE_TIMEOUT=0.1)
+        # 发送线程卡在第一个连接上，队列满后由调用方自己发送
+        self.server.gate.clear()
+        mail_queue.submit(self.message(0))
+        while not self.app.extensions["mail_queue"].queue.empty():
+            time.sleep(0.01)
+        for i in range(1, 3):
+            mail_queue.submit(self.message(i))
+        self.assertEqual(metrics.get("mail.queue_full"), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.server.gate.set()
+        mail_queue.join()
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_shutdown_drains_queue(self):
+        for i in range(5):
+            mail_queue.submit(self.message(i))
+        threads = list(self.app.extensions["mail_queue"].threads)
+        mail_queue.shutdown(5)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+    def test_failed_connection(self):
+        self.app.extensions["mail"].port = 1
+        mail_queue.submit(self.message(0))
+        mail_queue.join()
+        self.assertEqual(metrics.get("mail.failed"), 1)
+        self.assertEqual(metrics.get("mail.sent"), 0)
+
+
+class OutboxTestCase(MailTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["FLASKY_MAIL_OUTBOX"] = True
+        self.app.config["FLASKY_MAIL_OUTBOX_MAX_ATTEMPTS"] = 2
+
+    def test_sent_after_commit(self):
+        client = self.app.test_client()
+        response = client.post("/auth/register", data={"email": "john@example.com", "name": "john",
+                                                      "password1": "cat", "password2": "cat"})
+        self.assertEqual(response.status_code, 302)
+        mail_queue.join()
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.recipient, "john@example.com")
+        self.assertIsNotNone(message.sent_at)
+        self.assertIsNone(message.next_attempt_at)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(metrics.get("mail.outbox.sent"), 1)
+        self.assertEqual(metrics.get("mail.outbox.depth"), 0)
+
+    def test_rollback_and_dedup(self):
+        with self.app.test_request_context("/"):
+            user = User(username="john", email="john@example.com", password="cat")
+            db.session.add(user)
+            db.session.flush()
+            send_mail(user.email, "Confirm", "auth/mail/confirm", dedup_key="confirm", user=user, token="a")
+            db.session.rollback()
+            self.assertEqual(OutboxMessage.query.count(), 0)
+            db.session.add(user)
+            db.session.flush()
+            # 提交前多次发送同一封邮件，只保留最后一次的内容
+            send_mail(user.email, "Confirm", "auth/mail/confirm", dedup_key="confirm", user=user, token="a")
+            send_mail(user.email, "Confirm", "auth/mail/confirm", dedup_key="confirm", user=user, token="b")
+            self.assertEqual(OutboxMessage.query.count(), 1)
+            db.session.commit()
+        mail_queue.join()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertTrue(b"/b" in self.server.messages[0])
+
+    def test_failed_connection_retried(self):
+        self.app.config["FLASKY_MAIL_OUTBOX_RETRY_BASE"] = 0.2
+        state = self.app.extensions["mail"]
+        port, state.port = state.port, 1
+        OutboxMessage.enqueue("john@example.com", "s", "body", None)
+        db.session.commit()
+        mail_queue.join()
+        self.assertEqual(metrics.get("mail.failed"), 1)
+        # 之后的提交仍能触发发送
+        self.assertFalse(self.app.extensions["mail_queue"].dispatch_queued)
+        # 发送线程按退避时间自行重试，不依赖 flask dispatch-mail
+        state.port = port
+        deadline = time.time() + 5
+        while not self.server.messages and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_retry_with_backoff(self):
+        OutboxMessage.enqueue("bad@example.com", "s", "body", None)
+        OutboxMessage.enqueue("good@example.com", "s", "body", None)
+        db.session.commit()
+        mail_queue.join()
+        self.assertEqual(metrics.get("mail.outbox.sent"), 1)
+        self.assertEqual(metrics.get("mail.outbox.failed"), 1)
+        with mail.connect() as connection:
+            bad = OutboxMessage.query.filter_by(recipient="bad@example.com").one()
+            self.assertEqual(bad.attempts, 1)
+            self.assertTrue("554" in bad.last_error)
+            self.assertTrue(bad.next_attempt_at > datetime.utcnow() + timedelta(seconds=20))
+            # 未到重试时间
+            self.assertEqual(dispatch_outbox(connection), (0, 0))
+            self.assertEqual(metrics.get("mail.outbox.depth"), 1)
+            db.session.execute(OutboxMessage.__table__.update().values(next_attempt_at=datetime.utcnow()).
+                               where(OutboxMessage.id == bad.id))
+            db.session.commit()
+            # 达到 FLASKY_MAIL_OUTBOX_MAX_ATTEMPTS 后放弃
+            self.assertEqual(dispatch_outbox(connection), (0, 1))
+        db.session.expire_all()
+        self.assertEqual(bad.attempts, 2)
+        self.assertIsNone(bad.next_attempt_at)
+        self.assertIsNone(bad.sent_at)
+        self.assertEqual(metrics.get("mail.outbox.depth"), 0)
+        self.assertEqual(metrics.get("mail.outbox.abandoned"), 1)
@@ -0,0 +1,60 @@
+import unittest
+from datetime import datetime
+from app import create_app, db
+from app.fake import generate, FAKE_PASSWORD
+from app.models import Role, User, Post, Comment, Follow
+from app.rendering import render_markdown
+
+COUNTS = {"users": 60, "posts": 200, "comments": 300, "follows": 400}
+NOW = datetime(2026, 1, 1)
+
+
+class FakeDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def dump(self):
+        return ([(u.id, u.username, u.password_hash, u.member_since, u.follower_count)
+                 for u in User.query.order_by(User.id)],
+                [(p.id, p.author_id, p.body, p.timestamp) for p in Post.query.order_by(Post.id)],
+                [(c.id, c.post_id, c.body, c.disabled) for c in Comment.query.order_by(Comment.id)],
+                sorted((f.follower_id, f.followed_id) for f in Follow.query))
+
+    def test_deterministic(self):
+        generate(COUNTS, seed=7, batch_size=50)
+        first = self.dump()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        generate(COUNTS, seed=7, batch_size=50)
+        self.assertEqual(self.dump(), first)
+
+    def test_generated_data(self):
+        counts = generate(COUNTS, seed=1, batch_size=50, now=NOW)
+        self.assertEqual(counts["posts"], Post.query.count())
+        self.assertEqual(counts["follows"], Follow.query.count())
+        self.assertEqual(Follow.query.filter(Follow.follower_id == Follow.followed_id).count(), 0)
+
+        # 计数列与实际行数一致
+        self.assertEqual(sum(u.post_count for u in User.query), COUNTS["posts"])
+        self.assertEqual(sum(u.follower_count for u in User.query), counts["follows"])
+        self.assertEqual(sum(p.comment_count for p in Post.query), Comment.query.filter_by(disabled=False).count())
+
+        # 关注关系集中在少数用户身上
+        followers = sorted((u.follower_count for u in User.query), reverse=True)
+        self.assertTrue(sum(followers[:6]) > counts["follows"] / 3)
+
+        # 预先算好的 body_html 与渲染结果相同，密码可以登录
+        for item in Post.query.limit(20).all() + Comment.query.limit(20).all():
+            self.assertEqual(item.body_html, render_markdown(item.body))
+        self.assertTrue(User.query.first().verify_password(FAKE_PASSWORD))
@@ -0,0 +1,99 @@
+import unittest
+import base64
+from app import create_app, db
+from app.models import Role, User, Post, Comment, Follow
+
+
+class FeedQueryCountTestCase(unittest.TestCase):
+    """
+    每个列表页的查询数不随每页行数增长
+    """
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        moderator = Role.query.filter_by(name="Moderator").first()
+        self.user = User(email="john@example.com", username="john", password="cat",
+                         confirmed=True, role=moderator)
+        db.session.add(self.user)
+        db.session.commit()
+        self.post = Post(body="commented post", author=self.user)
+        db.session.add(self.post)
+        db.session.commit()
+        self.user_id, self.post_id = self.user.id, self.post.id
+        self.client = self.app.test_client(use_cookies=True)
+        self.statements = []
+        db.event.listen(db.engine, "before_cursor_execute", self.record_statement)
+
+    def tearDown(self):
+        db.event.remove(db.engine, "before_cursor_execute", self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_rows(self, count):
+        """
+        新增 count 个用户，每人发布一篇文章、评论一次并关注 john
+        """
+        start = User.query.count()
+        for i in range(start, start + count):
+            u = User(email="user%d@example.com" % i, username="user%d" % i, confirmed=True)
+            db.session.add_all([u, Post(body="post %d" % i, author=u),
+                                Comment(body="comment %d" % i, post_id=self.post_id, author=u),
+                                Follow(follower=u, followed_id=self.user_id)])
+        db.session.commit()
+
+    def count_queries(self, url, per_page, **kwargs):
+        for key in ("FLASK_POSTS_PER_PAGE", "FLASK_COMMENTS_PER_PAGE", "FLASK_FOLLOWERS_PER_PAGE"):
+            self.app.config[key] = per_page
+        db.session.remove()
+        self.statements = []
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return len(self.statements)
+
+    def assert_constant(self, url, **kwargs):
+        # 先访问一次，让用户缓存里有当前用户和角色
+        db.session.remove()
+        self.client.get(url, **kwargs)
+        self.add_rows(3)
+        small = self.count_queries(url, 3, **kwargs)
+        self.add_rows(12)
+        large = self.count_queries(url, 15, **kwargs)
+        self.assertEqual(small, large, msg="{}: {} -> {} queries".format(url, small, large))
+
+    def login(self):
+        response = self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        self.assertEqual(response.status_code, 302)
+
+    def api_headers(self):
+        return {"Authorization": "Basic " + base64.b64encode(b"john@example.com:cat").decode(),
+                "Accept": "application/json"}
+
+    def test_index(self):
+        self.assert_constant("/")
+
+    def test_user(self):
+        self.login()
+        self.assert_constant("/user/john")
+
+    def test_post(self):
+        self.assert_constant("/post/%d" % self.post_id)
+
+    def test_followers(self):
+        self.assert_constant("/followers/%d" % self.user_id)
+
+    def test_moderate_comments(self):
+        self.login()
+        self.assert_constant("/moderate_comments")
+
+    def test_api_posts(self):
+        self.assert_constant("/api/v1/posts/", headers=self.api_headers())
+
+    def test_api_post_comments(self):
+        self.assert_constant("/api/v1/posts/%d/comments" % self.post_id, headers=self.api_headers())
@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+from app import create_app, db
+from app.cache import LRUCache, SQLiteCache
+from app.models import Role, User, Post, Comment
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        self.post = Post(body="first version", author=self.user)
+        db.session.add_all([self.user, self.post])
+        db.session.commit()
+        self.cache = self.app.extensions["fragment_cache"]
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_index(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def test_cached_and_invalidated(self):
+        self.assertTrue("first version" in self.get_index())
+        self.assertEqual(len(self.cache), 1)
+        # 缓存命中时不重新渲染
+        self.get_index()
+        self.assertEqual(len(self.cache), 1)
+
+        self.post.body = "second version"
+        db.session.commit()
+        self.assertTrue("second version" in self.get_index())
+
+        db.session.add(Comment(body="nice", post=self.post, author=self.user))
+        db.session.commit()
+        self.assertTrue("1 Comments" in self.get_index())
+
+        self.user.username = "johnny"
+        db.session.commit()
+        self.assertTrue("johnny" in self.get_index())
+        self.assertEqual(len(self.cache), 4)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    def test_lru_bound(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("d", 4, timeout=-1)
+        self.assertIsNone(cache.get("d"))
+
+    def test_sqlite_shared(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "cache.sqlite")
+        try:
+            SQLiteCache.prune_every = 1
+            writer = SQLiteCache(path, max_entries=2)
+            reader = SQLiteCache(path, max_entries=2)
+            writer.set("a", {"html": "<li>"})
+            self.assertEqual(reader.get("a"), {"html": "<li>"})
+            writer.set("b", 2)
+            writer.set("c", 3)
+            self.assertIsNone(reader.get("a"))
+            reader.delete("b")
+            self.assertIsNone(writer.get("b"))
+            # 同一文件中的其他缓存不受清理和 clear 影响
+            other = SQLiteCache(path, max_entries=2, table="other")
+            other.set("a", 1)
+            writer.set("d", 4)
+            writer.clear()
+            self.assertIsNone(writer.get("c"))
+            self.assertEqual(other.get("a"), 1)
+        finally:
+            SQLiteCache.prune_every = 100
+            shutil.rmtree(directory)
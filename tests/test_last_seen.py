@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime
+from app import create_app, db, last_seen_tracker
+from app.models import Role, User
+
+
+class LastSeenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        u = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+        self.set_last_seen(datetime(2000, 1, 1))
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def set_last_seen(self, value):
+        db.session.execute(User.__table__.update().values(last_seen=value))
+        db.session.commit()
+
+    def stored_last_seen(self):
+        db.session.remove()
+        return db.session.query(User.last_seen).filter(User.id == self.user_id).scalar()
+
+    def test_write_behind(self):
+        statements = []
+        db.event.listen(db.engine, "before_cursor_execute",
+                        lambda conn, cursor, statement, *args: statements.append(statement))
+        self.assertEqual(self.client.get("/").status_code, 200)
+        self.assertEqual(self.client.get("/").status_code, 200)
+        # 请求中没有写入 last_seen
+        self.assertFalse([s for s in statements if s.startswith("UPDATE users")])
+        self.assertEqual(self.stored_last_seen(), datetime(2000, 1, 1))
+
+        self.assertEqual(last_seen_tracker.flush(), 1)
+        self.assertTrue((datetime.utcnow() - self.stored_last_seen()).total_seconds() < 3)
+
+        # 间隔小于 FLASKY_LAST_SEEN_GRANULARITY 的访问不再记录
+        self.client.get("/")
+        self.assertEqual(last_seen_tracker.flush(), 0)
+
+    def test_flush_when_full(self):
+        self.app.extensions["last_seen"].max_pending = 1
+        self.client.get("/")
+        self.assertTrue((datetime.utcnow() - self.stored_last_seen()).total_seconds() < 3)
+
+    def test_never_moves_backwards(self):
+        self.client.get("/")
+        self.set_last_seen(datetime(2100, 1, 1))
+        last_seen_tracker.flush()
+        self.assertEqual(self.stored_last_seen(), datetime(2100, 1, 1))
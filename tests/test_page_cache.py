@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, db, page_cache
+from app.models import Role, User, Post
+from app.cache import SQLiteCache
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["FLASKY_PAGE_CACHE"] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add_all([self.user, Post(body="hello", author=self.user)])
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.statements = 0
+        db.event.listen(db.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        db.event.remove(db.engine, "before_cursor_execute", self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_statement(self, *args):
+        self.statements += 1
+
+    def test_cached_page_and_304(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertIsNotNone(response.last_modified)
+
+        self.statements = 0
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertTrue("hello" in response.get_data(as_text=True))
+        self.assertEqual(self.statements, 0)
+
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+
+        # 新文章提交后缓存失效
+        db.session.add(Post(body="world", author=self.user))
+        db.session.commit()
+        response = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertTrue("world" in response.get_data(as_text=True))
+
+    def test_last_seen_does_not_invalidate(self):
+        etag = self.client.get("/user/john").headers["ETag"]
+        self.user.ping()
+        response = self.client.get("/user/john", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_authenticated_not_cached(self):
+        self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get("ETag"))
+
+    def test_generation_survives_pruning(self):
+        directory = tempfile.mkdtemp()
+        try:
+            SQLiteCache.prune_every = 1
+            self.app.config.update(FLASKY_PAGE_CACHE_BACKEND="sqlite", FLASKY_PAGE_CACHE_SIZE=2,
+                                   FLASKY_PAGE_CACHE_PATH=os.path.join(directory, "cache.sqlite"))
+            page_cache.init_app(self.app)
+            etag = self.client.get("/").headers["ETag"]
+            for path in ("/user/john", "/?a=1", "/?a=2"):
+                self.client.get(path)
+            # 页面条目被淘汰，代际不变，ETag 仍然有效
+            response = self.client.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+        finally:
+            SQLiteCache.prune_every = 100
+            shutil.rmtree(directory)
@@ -0,0 +1,86 @@
+import unittest
+import base64
+import json
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Role, User, Post
+from app.exceptions import ValidationError
+from app.pagination import KeysetPagination
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add(self.user)
+        # 25 篇文章，其中每 5 篇时间戳相同，用来检查 id 作为第二排序键
+        base = datetime(2019, 5, 1)
+        for i in range(25):
+            db.session.add(Post(body="post %d" % i, author=self.user,
+                                timestamp=base + timedelta(minutes=i // 5)))
+        db.session.commit()
+        self.expected = [p.id for p in Post.query.order_by(Post.timestamp.desc(), Post.id.desc())]
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self):
+        return {
+            "Authorization": "Basic " + base64.b64encode(b"john@example.com:cat").decode(),
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
+
+    def test_walk_forward_and_back(self):
+        pages = []
+        cursor = None
+        while True:
+            pagination = KeysetPagination(Post.query, 10, cursor=cursor)
+            pages.append([p.id for p in pagination.items])
+            if not pagination.has_next:
+                break
+            cursor = pagination.next_cursor
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertIsNone(pagination.next_cursor)
+
+        pagination = KeysetPagination(Post.query, 10, cursor=pagination.prev_cursor)
+        self.assertEqual([p.id for p in pagination.items], pages[1])
+        pagination = KeysetPagination(Post.query, 10, cursor=pagination.prev_cursor)
+        self.assertEqual([p.id for p in pagination.items], pages[0])
+        self.assertFalse(pagination.has_prev)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValidationError):
+            KeysetPagination(Post.query, 10, cursor="not-a-cursor")
+
+    def test_api_cursor(self):
+        response = self.client.get("/api/v1/posts/", headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertIsNone(json_response["count"])
+        self.assertIsNone(json_response["prev_url"])
+        self.assertEqual(len(json_response["posts"]), 20)
+
+        response = self.client.get(json_response["next_url"] + "&count=1", headers=self.get_api_headers())
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response["count"], 25)
+        self.assertEqual(len(json_response["posts"]), 5)
+        self.assertIsNone(json_response["next_url"])
+
+        response = self.client.get("/api/v1/posts/?cursor=bogus", headers=self.get_api_headers())
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_cursor(self):
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("cursor=" in response.get_data(as_text=True))
+        response = self.client.get("/?cursor=bogus")
+        self.assertEqual(response.status_code, 400)
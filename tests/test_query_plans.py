@@ -0,0 +1,138 @@
+import re
+import unittest
+import base64
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Role, User, Post, Comment, Follow
+
+# 这些表的行数随用户和内容增长，查询计划中不能出现对它们的全表扫描
+GROWING_TABLES = ("users", "posts", "comments", "follows", "timelines")
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """
+    在有数据的 SQLite 数据库上访问各个常用页面，对执行过的每条 SELECT 运行 EXPLAIN QUERY PLAN，
+    出现全表扫描或没有用到预期的索引时失败
+    """
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["FLASKY_FRAGMENT_CACHE"] = "null"
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        moderator = Role.query.filter_by(name="Moderator").first()
+        self.user = User(email="john@example.com", username="john", password="cat",
+                         confirmed=True, role=moderator)
+        db.session.add(self.user)
+        db.session.commit()
+        self.seed()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        self.statements = []
+        db.event.listen(db.engine, "before_cursor_execute", self.record_statement)
+
+    def tearDown(self):
+        db.event.remove(db.engine, "before_cursor_execute", self.record_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def seed(self, users=30, posts_per_user=5, comments_per_post=3):
+        """
+        每个用户发布几篇文章，互相关注、评论，部分评论被屏蔽
+        """
+        start = datetime.utcnow() - timedelta(days=30)
+        authors = [User(email="user%d@example.com" % i, username="user%d" % i, confirmed=True)
+                   for i in range(users)]
+        db.session.add_all(authors)
+        db.session.flush()
+        everyone = [self.user] + authors
+        for i, author in enumerate(authors):
+            db.session.add_all([Follow(follower=self.user, followed=author, timestamp=start + timedelta(minutes=i)),
+                                Follow(follower=author, followed=self.user, timestamp=start + timedelta(minutes=i))])
+        db.session.commit()
+        for i in range(posts_per_user):
+            for j, author in enumerate(everyone):
+                post = Post(body="post %d" % i, author=author, timestamp=start + timedelta(hours=i, minutes=j))
+                db.session.add(post)
+                for k in range(comments_per_post):
+                    db.session.add(Comment(body="comment", post=post, author=everyone[(j + k + 1) % len(everyone)],
+                                           disabled=k == 0, timestamp=post.timestamp + timedelta(minutes=k)))
+        db.session.commit()
+        self.post_id = self.user.posts.first().id
+        db.session.execute("ANALYZE")
+
+    def record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append((statement, parameters))
+
+    def plans(self, url, headers=None):
+        """
+        :return list: [(statement, [计划中每一步的描述])]
+        """
+        db.session.remove()
+        self.statements = []
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200, url)
+        statements, self.statements = self.statements, []
+        connection = db.engine.connect()
+        try:
+            return [(statement, [row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + statement,
+                                                                       parameters)])
+                    for statement, parameters in statements]
+        finally:
+            connection.close()
+
+    def assert_indexed(self, url, *indexes, **kwargs):
+        """
+        :param indexes: 这个页面的查询计划中必须用到的索引
+        """
+        plans = self.plans(url, **kwargs)
+        for statement, details in plans:
+            for detail in details:
+                scan = re.match(r"SCAN (?:TABLE )?(\w+)(?: AS \w+)?\s*$", detail)
+                if scan and scan.group(1) in GROWING_TABLES:
+                    self.fail("{} scans {}:\n{}\n{}".format(url, scan.group(1), statement, "\n".join(details)))
+        used = " ".join(detail for statement, details in plans for detail in details)
+        for index in indexes:
+            self.assertTrue(re.search(r"\b%s\b" % index, used), "{} does not use {}:\n{}".format(
+                url, index, "\n".join("{}\n  {}".format(s, "\n  ".join(d)) for s, d in plans)))
+
+    def api_headers(self):
+        return {"Authorization": "Basic " + base64.b64encode(b"john@example.com:cat").decode(),
+                "Accept": "application/json"}
+
+    def test_home_feed(self):
+        self.assert_indexed("/", "ix_posts_timestamp")
+
+    def test_followed_feed(self):
+        self.client.set_cookie("localhost", "show_followed", "1")
+        self.assert_indexed("/")
+
+    def test_user_page(self):
+        self.assert_indexed("/user/user3", "ix_posts_author_id_timestamp")
+
+    def test_post_comments(self):
+        self.assert_indexed("/post/%d" % self.post_id, "ix_comments_post_id_disabled_timestamp")
+
+    def test_followers(self):
+        self.assert_indexed("/followers/%d" % self.user.id, "ix_follows_followed_id_timestamp")
+
+    def test_followed(self):
+        self.assert_indexed("/followed_by/%d" % self.user.id, "ix_follows_follower_id_timestamp")
+
+    def test_moderation(self):
+        self.assert_indexed("/moderate_comments", "ix_comments_timestamp")
+
+    def test_api(self):
+        headers = self.api_headers()
+        self.assert_indexed("/api/v1/posts/", "ix_posts_timestamp", headers=headers)
+        self.assert_indexed("/api/v1/user/%d/posts" % self.user.id, "ix_posts_author_id_timestamp", headers=headers)
+        self.assert_indexed("/api/v1/comments/", "ix_comments_timestamp", headers=headers)
+        self.assert_indexed("/api/v1/posts/%d/comments" % self.post_id, "ix_comments_post_id_disabled_timestamp",
+                            headers=headers)
+
+    def test_search(self):
+        self.assert_indexed("/search?q=post")
+        self.assert_indexed("/api/v1/search?q=comment", headers=self.api_headers())
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import base64
+from unittest import mock
+from app import create_app, db
+from app.models import Role, User
+from app.metrics import metrics
+from app.rate_limit import MemoryBuckets, SQLiteBuckets
+from config import TestingConfig
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["FLASKY_API_RATE_LIMIT"] = True
+        self.app.config["FLASKY_API_RATE_LIMITS"] = {"default": (3, 60), "api.get_token": (1, 60)}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        for email in ("john@example.com", "susan@example.com"):
+            db.session.add(User(email=email, password="cat", confirmed=True))
+        db.session.commit()
+        self.client = self.app.test_client()
+        metrics.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, email="john@example.com", password="cat", headers=None):
+        auth = base64.b64encode((email + ":" + password).encode()).decode()
+        headers = dict(headers or {}, Authorization="Basic " + auth)
+        return self.client.get(url, headers=headers)
+
+    def test_throttled(self):
+        for i in range(3):
+            self.assertEqual(self.get("/api/v1/posts/").status_code, 200)
+        response = self.get("/api/v1/posts/")
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response.headers["Retry-After"]) >= 1)
+        self.assertEqual(metrics.get("rate_limit.throttled"), 1)
+        # 错误的密码同样计数，认证之前已被拒绝
+        self.assertEqual(self.get("/api/v1/posts/", password="dog").status_code, 429)
+
+        # 其他客户端和单独限流的接口各有自己的桶
+        self.assertEqual(self.get("/api/v1/posts/", email="susan@example.com").status_code, 200)
+        self.assertEqual(self.get("/api/v1/tokens/", email="susan@example.com").status_code, 200)
+        self.assertEqual(self.get("/api/v1/tokens/", email="susan@example.com").status_code, 429)
+        self.assertEqual(metrics.get("rate_limit.throttled.api.get_token"), 1)
+
+    def test_rotating_usernames(self):
+        # 每次换一个用户名仍受同一 IP 的额度限制
+        self.app.config["FLASKY_API_RATE_LIMIT_IP_FACTOR"] = 2
+        for i in range(6):
+            self.assertEqual(self.get("/api/v1/posts/", email="guess%d@example.com" % i).status_code, 401)
+        self.assertEqual(self.get("/api/v1/posts/", email="guess6@example.com").status_code, 429)
+
+    def test_behind_proxy(self):
+        with mock.patch.object(TestingConfig, "FLASKY_PROXY_FIX", 1):
+            app = create_app("testing")
+        app.config.update(FLASKY_API_RATE_LIMIT=True, FLASKY_API_RATE_LIMITS={"default": (1, 60)},
+                          FLASKY_API_RATE_LIMIT_IP_FACTOR=1)
+        self.client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            try:
+                # 代理后面的不同客户端按 X-Forwarded-For 中的地址分别计数
+                self.assertEqual(self.get("/api/v1/posts/", email="a@example.com",
+                                          headers={"X-Forwarded-For": "10.0.0.1"}).status_code, 401)
+                self.assertEqual(self.get("/api/v1/posts/", email="b@example.com",
+                                          headers={"X-Forwarded-For": "10.0.0.1"}).status_code, 429)
+                self.assertEqual(self.get("/api/v1/posts/", email="c@example.com",
+                                          headers={"X-Forwarded-For": "10.0.0.2"}).status_code, 401)
+            finally:
+                db.session.remove()
+                db.drop_all()
+
+    def test_admission(self):
+        semaphore = threading.BoundedSemaphore(1)
+        self.app.extensions["api_admission"] = semaphore
+        self.assertEqual(self.get("/api/v1/posts/").status_code, 200)
+        # 请求结束后释放
+        self.assertTrue(semaphore.acquire(blocking=False))
+        response = self.get("/api/v1/posts/")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(metrics.get("admission.rejected"), 1)
+        semaphore.release()
+
+    def test_buckets(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "rate_limit.sqlite")
+            # 两个 SQLiteBuckets 模拟两个工作进程共享同一个文件
+            for first, second in ((MemoryBuckets(),) * 2, (SQLiteBuckets(path), SQLiteBuckets(path))):
+                self.assertEqual(first.take("k", 1, 2)[0], True)
+                self.assertEqual(second.take("k", 1, 2)[0], True)
+                allowed, retry_after = first.take("k", 1, 2)
+                self.assertFalse(allowed)
+                self.assertTrue(0 < retry_after <= 1)
+                self.assertTrue(second.take("other", 1, 2)[0])
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,116 @@
+import unittest
+from app import create_app, db, render_pool
+from app.models import Role, User, Post, Comment
+
+
+class RenderPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["FLASKY_RENDER_MODE"] = "thread"
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        render_pool.wait()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_render_after_commit(self):
+        post = Post(body="*hello*", author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+        render_pool.wait()
+        db.session.remove()
+        post = Post.query.get(post_id)
+        self.assertFalse(post.render_pending)
+        self.assertEqual(post.body_html, "<p><em>hello</em></p>")
+        version = post.version
+
+        comment = Comment(body="**hi**", post=post, author=post.author)
+        post.body = "*world*"
+        db.session.add(comment)
+        self.assertTrue(post.render_pending)
+        self.assertIsNone(post.body_html)
+        db.session.commit()
+        render_pool.wait()
+        db.session.remove()
+        post = Post.query.get(post_id)
+        self.assertEqual(post.body_html, "<p><em>world</em></p>")
+        self.assertTrue(post.version > version + 1)
+        self.assertEqual(post.comments.first().body_html, "<p><strong>hi</strong></p>")
+
+    def test_pending_shows_escaped_body(self):
+        post = Post(body="<b>raw</b>", author=self.user)
+        db.session.add(post)
+        db.session.flush()
+        with self.app.test_request_context("/"):
+            from app.fragments import render_post
+            html = render_post(post)
+        self.assertTrue("&lt;b&gt;raw&lt;/b&gt;" in html)
+        db.session.rollback()
+
+    def test_latest_body_wins(self):
+        post = Post(body="first", author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+        # 连续修改，较早的任务写回时 body 已经不同，不会覆盖
+        for body in ("second", "third", "fourth"):
+            post = Post.query.get(post_id)
+            post.body = body
+            db.session.commit()
+        render_pool.wait()
+        db.session.remove()
+        post = Post.query.get(post_id)
+        self.assertFalse(post.render_pending)
+        self.assertEqual(post.body_html, "<p>fourth</p>")
+
+    def test_bulk_insert_in_process_pool(self):
+        self.app.config["FLASKY_RENDER_MODE"] = "process"
+        ids = Post.bulk_insert(self.user.id, ["*a*", "*b*"])
+        db.session.commit()
+        render_pool.wait()
+        db.session.remove()
+        self.assertEqual([Post.query.get(id).body_html for id in ids], ["<p><em>a</em></p>", "<p><em>b</em></p>"])
+
+    def test_rerender_resumes_from_checkpoint(self):
+        import os
+        import shutil
+        import tempfile
+        from app.render_pool import rerender
+        self.app.config["FLASKY_RENDER_MODE"] = "sync"
+        posts = [Post(body="*%d*" % i, author=self.user) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        ids = [post.id for post in posts]
+        versions = [post.version for post in posts]
+        # 模拟按旧配置渲染的结果
+        db.session.execute(Post.__table__.update().values(body_html="stale"))
+        db.session.commit()
+        directory = tempfile.mkdtemp()
+        try:
+            checkpoint = os.path.join(directory, "checkpoint.json")
+
+            def interrupt(rows, last_id):
+                if rows >= 4:
+                    raise KeyboardInterrupt
+            # 第一次在第二批提交后中断，再次运行只处理剩下的一行
+            with self.assertRaises(KeyboardInterrupt):
+                rerender(Post.__table__, batch_size=2, workers=0, checkpoint=checkpoint, progress=interrupt)
+            self.assertEqual(rerender(Post.__table__, batch_size=2, workers=0, checkpoint=checkpoint), (1, 1))
+            # 不带进度文件从头开始，没有需要修改的行
+            self.assertEqual(rerender(Post.__table__, batch_size=2, workers=2), (5, 0))
+        finally:
+            shutil.rmtree(directory)
+        db.session.remove()
+        for i, (id, version) in enumerate(zip(ids, versions)):
+            post = Post.query.get(id)
+            self.assertEqual(post.body_html, "<p><em>%d</em></p>" % i)
+            self.assertEqual(post.version, version + 1)
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app import rendering
+from app.rendering import RenderCache, render_many, render_markdown, render_cache
+from app.metrics import metrics
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        render_cache.clear()
+        metrics.reset()
+
+    def test_identical_bodies_rendered_once(self):
+        html = render_many(["*a*", "*b*", "*a*"])
+        self.assertEqual(html, ["<p><em>a</em></p>", "<p><em>b</em></p>", "<p><em>a</em></p>"])
+        self.assertEqual(render_markdown("*b*"), "<p><em>b</em></p>")
+        self.assertEqual(metrics.get("render_cache.miss"), 2)
+        self.assertEqual(metrics.get("render_cache.hit"), 2)
+
+    def test_key_includes_configuration(self):
+        key = RenderCache.key("*a*")
+        fingerprint = rendering.fingerprint
+        try:
+            rendering.fingerprint = fingerprint + "changed"
+            self.assertNotEqual(RenderCache.key("*a*"), key)
+        finally:
+            rendering.fingerprint = fingerprint
+
+    def test_pipeline_reused(self):
+        self.assertEqual(rendering.render_source("hi <script>x</script> http://example.com"),
+                         '<p>hi x <a href="http://example.com" rel="nofollow">http://example.com</a></p>')
+        pipeline = rendering._local.pipeline
+        rendering.render_source("[ref][1]\n\n[1]: http://example.com")
+        self.assertIs(rendering._local.pipeline, pipeline)
+        # 重复使用的 Markdown 实例不会带上一次的引用链接
+        self.assertEqual(rendering.render_source("[ref][1]"), "<p>[ref][1]</p>")
+
+    def test_persistent(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "render_cache.sqlite")
+            first = RenderCache(10, path)
+            first.set(RenderCache.key("*a*"), "<p>cached</p>")
+            # 另一个进程的进程内缓存是空的，从 SQLite 中读到
+            second = RenderCache(10, path)
+            self.assertEqual(second.get(RenderCache.key("*a*")), "<p>cached</p>")
+            self.assertEqual(second.memory.get(RenderCache.key("*a*")), "<p>cached</p>")
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from flask import session as flask_session
+from app import create_app, db, database_tuning
+from app.database import PIN_KEY
+from app.metrics import metrics
+from app.models import Role, User, Post, Comment
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """
+    主库和副本都是 SQLite 文件，副本是某一时刻主库的拷贝，之后主库的修改不会出现在副本中
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app("testing")
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + self.path("primary.sqlite")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(email="john@example.com", username="john", password="cat", confirmed=True,
+                    role=Role.query.filter_by(name="Moderator").first())
+        post = Post(body="replicated", author=user)
+        comment = Comment(body="replicated comment", author=user, post=post)
+        db.session.add_all([user, post, comment])
+        db.session.commit()
+        self.post_id, self.user_id, self.comment_id = post.id, user.id, comment.id
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        shutil.copy(self.path("primary.sqlite"), self.path("replica.sqlite"))
+        self.use_replicas("sqlite:///" + self.path("replica.sqlite"))
+        # 只在主库上的文章
+        post = Post(body="primary only", author_id=self.user_id)
+        db.session.add(post)
+        db.session.commit()
+        self.new_post_id = post.id
+        db.session.remove()
+        metrics.reset()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        for bind in [None] + list(self.app.config["SQLALCHEMY_BINDS"]):
+            db.get_engine(self.app, bind).dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def use_replicas(self, *uris):
+        self.app.config["FLASKY_DATABASE_REPLICAS"] = list(uris)
+        self.app.config["SQLALCHEMY_BINDS"] = {}
+        database_tuning.init_app(self.app)
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.client.get("/post/%d" % self.post_id).status_code, 200)
+        self.assertEqual(self.client.get("/post/%d" % self.new_post_id).status_code, 404)
+        self.assertTrue(metrics.get("replica.reads") > 0)
+
+    def test_read_your_writes(self):
+        self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        response = self.client.post("/", data={"body": "just written"}, follow_redirects=True)
+        self.assertTrue("just written" in response.get_data(as_text=True))
+        # 写入之后的请求读主库
+        self.assertEqual(self.client.get("/post/%d" % self.new_post_id).status_code, 200)
+        # 其他访问者仍读副本；测试中各请求共用推入的应用上下文，先结束写入过的会话
+        db.session.remove()
+        other = self.app.test_client()
+        self.assertEqual(other.get("/post/%d" % self.new_post_id).status_code, 404)
+
+    def test_unavailable_replica(self):
+        self.use_replicas("sqlite:///" + self.path("missing/replica.sqlite"))
+        for i in range(2):
+            self.assertEqual(self.client.get("/post/%d" % self.new_post_id).status_code, 200)
+        # 失败后一段时间内不再尝试连接
+        self.assertEqual(metrics.get("replica.unavailable"), 1)
+        self.assertEqual(metrics.get("replica.reads"), 0)
+
+    def test_primary_only_view(self):
+        # 另一位协管员刚在主库上屏蔽了评论，副本还没有同步
+        Comment.query.get(self.comment_id).disabled = True
+        db.session.commit()
+        db.session.remove()
+        self.app.config["FLASKY_DATABASE_REPLICA_PIN"] = 0
+        self.client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        db.session.remove()
+        url = "/moderate_comments?comment_id=%d&comment_disable=1" % self.comment_id
+        self.assertEqual(self.client.get(url).status_code, 200)
+        db.session.remove()
+        self.assertEqual(Post.query.get(self.post_id).comment_count, 0)
+
+    def test_raw_writes_pin_to_primary(self):
+        with self.app.test_request_context("/"):
+            Post.bulk_insert(self.user_id, ["bulk"])
+            self.assertFalse(db.session().reads_from_replica())
+            db.session.commit()
+            self.assertTrue(flask_session[PIN_KEY] > time.time())
+        db.session.remove()
+        with self.app.test_request_context("/"):
+            db.session.execute("UPDATE posts SET body = body WHERE id = 0")
+            self.assertFalse(db.session().reads_from_replica())
+        db.session.remove()
+        with self.app.test_request_context("/"):
+            db.session.execute("SELECT 1")
+            self.assertTrue(db.session().reads_from_replica())
+
+    def test_page_cache_fill_reads_primary(self):
+        self.app.config["FLASKY_PAGE_CACHE"] = True
+        self.assertEqual(self.client.get("/post/%d" % self.new_post_id).status_code, 200)
@@ -0,0 +1,118 @@
+import unittest
+import base64
+from app import create_app, db
+from app.models import Role, User, Post, Comment
+from app.search import SearchResults, match_expression, rebuild
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def search(self, text, per_page=20, cursor=None):
+        return SearchResults(text, per_page, cursor=cursor)
+
+    def test_index_follows_writes(self):
+        post = Post(body="flask makes web apps easy", author=self.user)
+        comment = Comment(body="I like flask too", post=post, author=self.user)
+        db.session.add_all([post, comment])
+        db.session.commit()
+        hits = self.search("flask").hits
+        self.assertEqual(sorted(hit.kind for hit in hits), ["comment", "post"])
+
+        # 修改正文、屏蔽评论、删除文章后索引随之更新
+        post.body = "django is fine"
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual([(hit.kind, hit.target.id) for hit in self.search("flask").hits],
+                         [("comment", comment.id)])
+        comment.disabled = True
+        db.session.add(comment)
+        db.session.commit()
+        self.assertEqual(self.search("flask").hits, [])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.search("django").hits, [])
+
+        # 批量插入不经过 ORM 事件，同样进入索引
+        Post.bulk_insert(self.user.id, ["bulk flask post"])
+        db.session.commit()
+        self.assertEqual([hit.kind for hit in self.search("bulk").hits], ["post"])
+
+    def test_ranking_and_snippet(self):
+        db.session.add_all([Post(body="a post that mentions sqlite once among many other words", author=self.user),
+                            Post(body="sqlite sqlite sqlite", author=self.user),
+                            Post(body="<b>sqlite</b> & friends", author=self.user)])
+        db.session.commit()
+        hits = self.search("sqlite").hits
+        self.assertEqual(hits[0].target.body, "sqlite sqlite sqlite")
+        self.assertEqual([hit.rank for hit in hits], sorted(hit.rank for hit in hits))
+        # 正文被转义，只有命中词包在 <mark> 中
+        snippet = [hit.snippet for hit in hits if "friends" in hit.target.body][0]
+        self.assertEqual(str(snippet), "&lt;b&gt;<mark>sqlite</mark>&lt;/b&gt; &amp; friends")
+
+    def test_cursor_pagination(self):
+        db.session.add_all([Post(body="needle " + "hay " * i, author=self.user) for i in range(7)])
+        db.session.commit()
+        seen = []
+        results = self.search("needle", per_page=3)
+        while True:
+            seen.extend(hit.target.id for hit in results.hits)
+            if not results.pagination.has_next:
+                break
+            results = self.search("needle", per_page=3, cursor=results.pagination.next_cursor)
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        previous = self.search("needle", per_page=3, cursor=results.pagination.prev_cursor)
+        self.assertEqual([hit.target.id for hit in previous.hits], seen[3:6])
+
+    def test_query_syntax_is_escaped(self):
+        db.session.add(Post(body='say "hello" (world)', author=self.user))
+        db.session.commit()
+        self.assertEqual(match_expression('"hello" AND ('), '"""hello""" "AND" "("')
+        self.assertEqual(len(self.search('hello NEAR( "world').hits), 0)
+        self.assertEqual(len(self.search("hello world").hits), 1)
+        self.assertIsNone(self.search("   ").pagination)
+
+    def test_rebuild(self):
+        post = Post(body="rebuilt entry", author=self.user)
+        db.session.add_all([post, Comment(body="hidden entry", post=post, author=self.user, disabled=True),
+                            Comment(body="visible entry", post=post, author=self.user)])
+        db.session.commit()
+        db.session.execute("DELETE FROM search_index")
+        db.session.commit()
+        self.assertEqual(self.search("entry").hits, [])
+        self.assertEqual(rebuild(batch_size=1), 2)
+        self.assertEqual(sorted(hit.target.body for hit in self.search("entry").hits),
+                         ["rebuilt entry", "visible entry"])
+
+    def test_views(self):
+        post = Post(body="searchable post", author=self.user)
+        db.session.add_all([post, Comment(body="searchable comment", post=post, author=self.user)])
+        db.session.commit()
+        response = self.client.get("/search?q=searchable")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("<mark>searchable</mark> post" in response.get_data(as_text=True))
+        self.assertEqual(self.client.get("/search?q=x&cursor=bogus").status_code, 400)
+
+        headers = {"Authorization": "Basic " + base64.b64encode(b"john@example.com:cat").decode(),
+                   "Accept": "application/json"}
+        response = self.client.get("/api/v1/search?q=searchable", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()["results"]
+        self.assertEqual(sorted(result["type"] for result in results), ["comment", "post"])
+        self.assertTrue(all("<mark>searchable</mark>" in result["snippet"] for result in results))
+        self.assertEqual(self.client.get("/api/v1/search", headers=headers).status_code, 400)
@@ -0,0 +1,77 @@
+import unittest
+from app import create_app, db, user_cache
+from app.models import Role, User, Permission
+from app.metrics import metrics
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        u = User(email="john@example.com", username="john", password="cat", confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+        db.session.remove()
+        metrics.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def load(self):
+        """
+        模拟一次新请求加载用户
+        """
+        db.session.remove()
+        return user_cache.get_user(self.user_id)
+
+    def test_cached_user_and_role(self):
+        self.load()
+        statements = []
+        db.event.listen(db.engine, "before_cursor_execute",
+                        lambda conn, cursor, statement, *args: statements.append(statement))
+        u = self.load()
+        self.assertEqual(u.username, "john")
+        self.assertTrue(u.can(Permission.WRITE))
+        self.assertFalse(u.is_administrator())
+        self.assertEqual(statements[-1:], ["SELECT roles.permissions AS roles_permissions \nFROM roles \nWHERE roles.id = ?"])
+        u = self.load()
+        self.assertTrue(u.can(Permission.WRITE))
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(metrics.get("user_cache.hit"), 2)
+        self.assertEqual(metrics.get("user_cache.miss"), 1)
+        self.assertEqual(metrics.get("role_cache.hit"), 2)
+
+        # 缓存的对象属于当前会话，可以修改和提交
+        u.about_me = "hello"
+        db.session.commit()
+        self.assertEqual(self.load().about_me, "hello")
+
+    def test_invalidated_on_commit(self):
+        self.load().can(Permission.WRITE)
+        u = self.load()
+        role_id = u.role_id
+        u.password = "dog"
+        db.session.commit()
+        self.assertTrue(self.load().verify_password("dog"))
+
+        role = Role.query.get(role_id)
+        role.remove_permission(Permission.WRITE)
+        db.session.commit()
+        self.assertFalse(self.load().can(Permission.WRITE))
+
+    def test_metrics_endpoint(self):
+        client = self.app.test_client(use_cookies=True)
+        client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+        self.assertEqual(client.get("/admin/metrics").status_code, 403)
+        u = self.load()
+        u.role = Role.query.filter_by(name="Administrator").first()
+        db.session.commit()
+        response = client.get("/admin/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("user_cache.miss" in response.get_json())
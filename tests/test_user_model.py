@@ -1,7 +1,9 @@
 import unittest
-from app.models import User, AnonymousUser, Role, Follow, Post
+from app.models import User, AnonymousUser, Role, Follow, Post, Timeline
 from app.models import Permission
 from app import create_app, db
+from app.passwords import hash_password
+from werkzeug.security import check_password_hash
 from datetime import datetime
 import time
 import hashlib
@@ -34,6 +36,38 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u.verify_password("cat"))
         self.assertFalse(u.verify_password("dog"))
 
+    def test_password_rehash(self):
+        u = User(username="rehash", email="rehash@123.com", password="cat")
+        db.session.add(u)
+        db.session.commit()
+        self.assertTrue(u.password_hash.startswith("pbkdf2:sha256:1000$"))
+        generation = u.token_generation
+        self.app.config["FLASKY_PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:2000"
+        self.assertFalse(u.verify_password("dog"))
+        self.assertTrue(u.password_hash.startswith("pbkdf2:sha256:1000$"))
+        # 只修改散列，不提交会话中的其他修改
+        db.session.add(User(username="pending", email="pending@123.com", password="cat"))
+        self.assertTrue(u.verify_password("cat"))
+        db.session.rollback()
+        self.assertIsNone(User.query.filter_by(username="pending").first())
+        self.assertTrue(User.query.filter_by(username="rehash").first().password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(u.verify_password("cat"))
+        db.session.commit()
+        db.session.remove()
+        u = User.query.filter_by(username="rehash").first()
+        self.assertTrue(u.password_hash.startswith("pbkdf2:sha256:2000$"))
+        self.assertEqual(u.token_generation, generation)
+        self.assertTrue(u.verify_password("cat"))
+
+    def test_seeded_password_hash(self):
+        # 指定盐生成的散列可以用 werkzeug 校验，相同的盐结果相同
+        for method in ("pbkdf2:sha256", "pbkdf2:sha256:1000", "sha256"):
+            password_hash = hash_password("cat", method=method, salt="abcdefgh")
+            self.assertEqual(password_hash, hash_password("cat", method=method, salt="abcdefgh"))
+            self.assertTrue(check_password_hash(password_hash, "cat"))
+            self.assertFalse(check_password_hash(password_hash, "dog"))
+        self.assertTrue(hash_password("cat", salt="abcdefgh").startswith("pbkdf2:sha256:1000$abcdefgh$"))
+
     def test_password_salts_are_random(self):
         u1 = User(username="random1", email="random1@123.com", password="cat")
         u2 = User(username="random2", email="random2@123.com", password="cat")
@@ -157,3 +191,62 @@ class UserModelTestCase(unittest.TestCase):
         db.session.add_all([p])
         db.session.commit()
         self.assertEqual(u1.followed_posts.first(), p)
+
+    def test_timeline_fanout(self):
+        u1 = User(username="u1")
+        u2 = User(username="u2")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body="before follow", author=u2)
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(Timeline.query.count(), 0)
+        u1.follow(u2)
+        db.session.commit()
+        p2 = Post(body="after follow", author=u2)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(Timeline.query.filter_by(user_id=u1.id).count(), 2)
+        self.assertEqual(set(u1.followed_posts.all()), {p1, p2})
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(Timeline.query.count(), 0)
+        self.assertEqual(u1.followed_posts.count(), 0)
+
+    def test_timeline_fanout_on_read(self):
+        self.app.config["FLASKY_FANOUT_MAX_FOLLOWERS"] = 1
+        u1 = User(username="u1")
+        u2 = User(username="u2")
+        u3 = User(username="u3")
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u3)
+        u2.follow(u3)
+        db.session.commit()
+        p = Post(body="popular", author=u3)
+        db.session.add(p)
+        db.session.commit()
+        self.assertEqual(Timeline.query.count(), 0)
+        self.assertEqual(u1.followed_posts.all(), [p])
+        self.assertEqual(u2.followed_posts.all(), [p])
+
+        # 关注者降回阈值以内后，之前没有写扩散的文章补进时间线
+        u2.unfollow(u3)
+        db.session.commit()
+        self.assertEqual(Timeline.query.filter_by(user_id=u1.id).count(), 1)
+        self.assertEqual(u1.followed_posts.all(), [p])
+        self.assertEqual(u2.followed_posts.all(), [])
+
+    def test_timeline_rebuild(self):
+        u1 = User(username="u1")
+        u2 = User(username="u2")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.add_all([Post(body="post %d" % i, author=u2) for i in range(3)])
+        db.session.commit()
+        db.session.execute(Timeline.__table__.delete())
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.count(), 0)
+        self.assertEqual(Timeline.rebuild(batch_size=1), 3)
+        self.assertEqual(u1.followed_posts.count(), 3)